@@ -0,0 +1,180 @@
+# The part of the armature exporter that does not need Blender: keyframe scheduling and
+# reduction, bone matrix assembly and encoding and the streamed ARMATURE / ARMATURE_CLIP writer.
+# export_armature_json.py samples the poses out of Blender and hands them to it;
+# benchmark_export.py runs it on generated animations.
+import itertools
+import json
+import math
+import os
+import re
+
+from export_common import format_floats, written_files
+
+def assemble_matrix(basis, basis_inverse, pose_matrix, local_inverse):
+    # compare the current pose to the bind pose to see the relative offset
+    # (basis @ pose) @ (basis @ bind_pose)^-1, with the bind pose inverse cached per bone
+    return basis @ pose_matrix @ local_inverse @ basis_inverse
+
+# Sibling file a clip is streamed from, eg. spider_anim_Death.json next to spider_anim.json
+def clip_path(filepath, clip_name):
+    root, ext = os.path.splitext(filepath)
+    return '{}_{}{}'.format(root, re.sub(r'[^\w\-]+', '_', clip_name), ext)
+
+# Gathers the frames to sample for an action from the frames it has keys on: every keyframe
+# once, with extra frames inserted wherever two of them are further apart than the resolution
+def schedule_keyframes(key_frames, resolution):
+    keyframes = []
+    for kf in sorted({math.floor(frame) for frame in key_frames}):
+        if keyframes and resolution > 0:
+            while kf - keyframes[-1] > resolution:
+                keyframes.append(keyframes[-1] + resolution)
+        keyframes.append(kf)
+        
+    return keyframes
+
+# Axis aligned box around a set of points, grown by padding on every side
+def joint_bounds(points, padding):
+    return {
+        'min': [min(p[a] for p in points) - padding for a in range(3)],
+        'max': [max(p[a] for p in points) + padding for a in range(3)],
+    }
+
+# Box (min, max) around the rest pose vertices of each bone, None for bones no vertex is weighted to
+def bone_extents(points_by_bone):
+    return [([min(p[a] for p in points) for a in range(3)], [max(p[a] for p in points) for a in range(3)]) if points else None
+            for points in points_by_bone]
+
+# Corners of each bone's extent moved by its skinning matrix. A skinned vertex is a blend of its
+# bones' transforms of it, so it stays within the box around these points
+def skinned_points(pose, extents):
+    points = []
+    for matrix, extent in zip(pose, extents):
+        if not extent:
+            continue
+        for corner in itertools.product(*zip(*extent)):
+            points.append([sum(matrix[row][c] * corner[c] for c in range(3)) + matrix[row][3] for row in range(3)])
+    return points
+
+# Drops keyframes whose pose the runtime can reconstruct by interpolating its neighbours
+# poses is one list of bone matrices per frame. Returns the indices of the keyframes to keep
+def reduce_keyframes(frames, poses, max_position_error, max_rotation_error):
+    def within_error(i, j, k):
+        t = (frames[k] - frames[i]) / (frames[j] - frames[i])
+        for a, b, actual in zip(poses[i], poses[j], poses[k]):
+            for row in range(3):
+                # the last column holds the translation, the rest rotation (and scale)
+                for column in range(4):
+                    error = abs(a[row][column] + (b[row][column] - a[row][column]) * t - actual[row][column])
+                    if error > (max_position_error if column == 3 else max_rotation_error):
+                        return False
+        return True
+    
+    if len(poses) <= 2:
+        return list(range(len(poses)))
+    
+    kept = [0]
+    anchor = 0
+    end = 2
+    while end < len(poses):
+        # try to skip every sample between the anchor and end
+        if not all(within_error(anchor, end, k) for k in range(anchor + 1, end)):
+            anchor = end - 1
+            kept.append(anchor)
+        end += 1
+    
+    kept.append(len(poses) - 1)
+    return kept
+
+# Flattens a bone matrix in the requested encoding
+# MAT4:   16 floats, column major
+# MAT3x4: 12 floats, column major without the constant bottom row
+# QUAT:    8 floats, rotation quaternion (x, y, z, w), translation and uniform scale
+BONE_ENCODING_FLOATS = {'MAT4': 16, 'MAT3x4': 12, 'QUAT': 8}
+
+# Any matrix indexable by [row][column] will do, QUAT also needs mathutils' decompose()
+def encode_bone(matrix, encoding):
+    if encoding == 'QUAT':
+        translation, rotation, scale = matrix.decompose()
+        return [rotation.x, rotation.y, rotation.z, rotation.w,
+                translation.x, translation.y, translation.z,
+                (scale.x + scale.y + scale.z) / 3.0]
+    
+    rows = 3 if encoding == 'MAT3x4' else 4
+    return [matrix[row][column] for column in range(0, 4) for row in range(0, rows)]
+
+# Writes an ARMATURE (or ARMATURE_CLIP) document while it is sampled: the header first, then the
+# bone data one keyframe at a time and the animation list (only known at the end) last
+class ArmatureStreamWriter:
+    def __init__(self, filepath, export, precision):
+        self.precision = precision
+        self.count = 0
+        self.file = open(filepath, 'w')
+        written_files.append(filepath)
+        
+        header = {k: v for k, v in export.__dict__.items() if k not in ('data', 'animations')}
+        self.file.write(json.dumps(header)[:-1] + ', "data": [')
+        return
+    
+    def write(self, values):
+        if not values:
+            return
+        if self.count:
+            self.file.write(', ')
+        self.file.write(format_floats(values, self.precision))
+        self.count += len(values)
+        return
+    
+    def close(self, animations=None, bounds=None):
+        self.file.write(']')
+        if animations is not None:
+            self.file.write(', "animations": {}'.format(json.dumps(animations, default=lambda o: o.__dict__)))
+        if bounds:
+            self.file.write(', "bounds": {}'.format(json.dumps(bounds)))
+        self.file.write('}')
+        self.file.close()
+        return
+
+# bones are the names of the deform bones, in the order their matrices are written
+class ArmatureExport:
+    def __init__(self, name, bones):
+        self.name = name
+        self.bones = bones
+        self.type = 'ARMATURE'
+        self.animations = []
+        
+        # Data is the complete transform data
+        # PER ANIMATION
+        #    PER FRAME
+        #      PER BONE
+        # flattened as a giant float array
+        # (the exporter streams it to file through ArmatureStreamWriter instead)
+        self.data = []
+        self.encoding = 'MAT4'
+        return
+    
+    def toJson(self):
+        return json.dumps(self, default=lambda o: o.__dict__)
+    
+class ArmatureAnimationExport:
+    def __init__(self, name):
+        self.name = name
+        self.keyframes = []
+        self.bounds = None
+        
+        # File the bone data of a streamed clip is in, None when it is in the armature's data
+        self.src = None
+        return
+    
+    def toJson(self):
+        return json.dumps(self, default=lambda o: o.__dict__)
+
+# The bone data of one animation, loaded by the client after the armature it belongs to
+class ArmatureClipExport:
+    def __init__(self, armatureExport, animationExport):
+        self.name = animationExport.name
+        self.type = 'ARMATURE_CLIP'
+        self.armature = armatureExport.name
+        self.encoding = armatureExport.encoding
+        self.keyframes = animationExport.keyframes
+        self.data = []
+        return
@@ -0,0 +1,207 @@
+# Runs the mesh and armature exporters headlessly (blender -b) over a set of .blend files,
+# several files at a time. Does not need bpy itself, only a Blender executable.
+#
+# eg. rebuild every model and animation in assets/raw:
+#   python blender/batch_export.py "assets/raw/*.blend" \
+#       --mesh-output "assets/models/{name}.json" \
+#       --armature-output "assets/animations/{name}_anim.json" \
+#       --manifest assets/build-manifest.json
+# With a manifest, the asset version map the client fetches with (assets/asset-versions.json) is
+# updated with the hash of every exported file too.
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from build_manifest import BuildManifest, update_versions
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EXPORTERS = {
+    'mesh': os.path.join(SCRIPT_DIR, 'export_mesh_json.py'),
+    'armature': os.path.join(SCRIPT_DIR, 'export_armature_json.py'),
+}
+
+# Modules each exporter imports, a change to any of them invalidates its exports too
+EXPORTER_MODULES = {
+    'mesh': [os.path.join(SCRIPT_DIR, name) for name in ('mesh_core.py', 'export_common.py', 'export_profile.py', 'headless.py')],
+    'armature': [os.path.join(SCRIPT_DIR, name) for name in ('armature_core.py', 'export_common.py', 'export_profile.py', 'headless.py')],
+}
+
+class ExportJob:
+    def __init__(self, source, exporter, output, options):
+        self.source = source
+        self.exporter = exporter
+        self.output = output
+        self.options = options
+
+        self.returncode = None
+        self.seconds = 0.0
+        self.log = ''
+        self.skipped = False
+
+        # Files the exporter reports it wrote
+        self.written = []
+        self.record = None
+        return
+
+    def command(self, blender):
+        cmd = [blender, '-b', self.source, '--python-exit-code', '1', '--python', EXPORTERS[self.exporter],
+               '--', '--output', self.output, '--record', self.record]
+        for option in self.options:
+            cmd += ['--option', option]
+        return cmd
+
+# Expands files, directories (every .blend inside) and glob patterns, keeping the order given
+def find_sources(patterns):
+    sources = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '*.blend')))
+        else:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+
+        for match in matches:
+            match = os.path.abspath(match)
+            if match not in sources:
+                sources.append(match)
+
+    return sources
+
+# Output templates can use {name} (the .blend file name without extension) and {dir} (its folder)
+def make_jobs(sources, args):
+    outputs = (('mesh', args.mesh_output, args.mesh_option), ('armature', args.armature_output, args.armature_option))
+
+    jobs = []
+    for source in sources:
+        fields = {
+            'name': os.path.splitext(os.path.basename(source))[0],
+            'dir': os.path.dirname(source),
+        }
+
+        for exporter, template, options in outputs:
+            if template:
+                jobs.append(ExportJob(source, exporter, os.path.abspath(template.format(**fields)), options))
+
+    return jobs
+
+def run_job(job, blender, timeout):
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(job.output), exist_ok=True)
+
+    fd, job.record = tempfile.mkstemp(suffix='.json', prefix='export_')
+    os.close(fd)
+
+    try:
+        result = subprocess.run(job.command(blender), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, timeout=timeout)
+        job.returncode = result.returncode
+        job.log = result.stdout
+    except subprocess.TimeoutExpired as e:
+        job.returncode = -1
+        job.log = '{}\nTimed out after {} seconds'.format(e.output or '', timeout)
+    except OSError as e:
+        job.returncode = 127
+        job.log = 'Could not run {}: {}'.format(blender, e)
+
+    try:
+        with open(job.record) as f:
+            job.written = json.load(f)
+    except ValueError:
+        job.written = []
+    os.remove(job.record)
+
+    job.seconds = time.perf_counter() - start
+    return job
+
+def job_status(job):
+    if job.skipped:
+        return 'SKIPPED'
+    return 'OK' if job.returncode == 0 else 'FAILED'
+
+def print_summary(jobs):
+    failed = [job for job in jobs if job.returncode != 0]
+
+    print()
+    print('{:<8} {:<9} {:>8}  {}'.format('STATUS', 'EXPORTER', 'SECONDS', 'SOURCE -> OUTPUT'))
+    for job in jobs:
+        status = job_status(job)
+        print('{:<8} {:<9} {:>8.1f}  {} -> {}'.format(status, job.exporter, job.seconds, job.source, job.output))
+
+    print()
+    skipped = sum(1 for job in jobs if job.skipped)
+    print('{} export(s), {} succeeded, {} up to date, {} failed'.format(
+        len(jobs), len(jobs) - len(failed) - skipped, skipped, len(failed)))
+
+    # Show the end of the Blender output for anything that went wrong
+    for job in failed:
+        print()
+        print('--- {} ({}) exited with {} ---'.format(job.source, job.exporter, job.returncode))
+        print('\n'.join(job.log.splitlines()[-20:]))
+    return
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export meshes and armatures from .blend files in parallel')
+    parser.add_argument('sources', nargs='+', help='.blend files, folders or glob patterns')
+    parser.add_argument('--mesh-output', help='Mesh output path template, eg. assets/models/{name}.json')
+    parser.add_argument('--armature-output', help='Armature output path template, eg. assets/animations/{name}_anim.json')
+    parser.add_argument('--mesh-option', action='append', default=[], metavar='NAME=VALUE',
+                        help='Mesh exporter property, eg. export_separate_files=true')
+    parser.add_argument('--armature-option', action='append', default=[], metavar='NAME=VALUE',
+                        help='Armature exporter property, eg. keyframe_resolution=3')
+    parser.add_argument('--blender', default=os.environ.get('BLENDER', 'blender'), help='Blender executable')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Files exported at once')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before an export is abandoned')
+    parser.add_argument('--manifest', help='Build manifest used to skip exports whose inputs have not changed')
+    parser.add_argument('--force', action='store_true', help='Export everything even if the manifest says it is up to date')
+    parser.add_argument('--root', default=os.path.dirname(SCRIPT_DIR), help='Folder served to the client, containing assets/')
+    parser.add_argument('--versions', default=None, help='Asset version map to update, defaults to <root>/assets/asset-versions.json')
+    args = parser.parse_args(argv)
+
+    if not args.mesh_output and not args.armature_output:
+        parser.error('nothing to do, give --mesh-output and/or --armature-output')
+
+    jobs = make_jobs(find_sources(args.sources), args)
+
+    # Skip whatever the manifest says was already built from the same inputs
+    manifest = BuildManifest(args.manifest) if args.manifest else None
+    inputs = {}
+    if manifest:
+        for job in jobs:
+            if not os.path.exists(job.source):
+                continue
+            scripts = [EXPORTERS[job.exporter]] + EXPORTER_MODULES[job.exporter]
+            inputs[job] = manifest.inputs(job.source, scripts, job.options)
+            if not args.force and manifest.is_up_to_date(job.exporter, job.output, inputs[job]):
+                job.skipped = True
+                job.returncode = 0
+
+    pending = [job for job in jobs if not job.skipped]
+    print('Running {} export(s) on {} worker(s), {} up to date...'.format(len(pending), args.jobs, len(jobs) - len(pending)))
+
+    # Each job is its own Blender process, the threads only wait on them
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(run_job, job, args.blender, args.timeout) for job in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            job = future.result()
+            print('[{}/{}] {} {} ({}, {:.1f}s)'.format(done, len(pending), job_status(job), os.path.basename(job.source), job.exporter, job.seconds))
+
+            if manifest and job.returncode == 0 and job in inputs:
+                manifest.record(job.exporter, job.output, inputs[job], [p for p in job.written if os.path.exists(p)])
+
+    if manifest:
+        manifest.save()
+        versions = args.versions or os.path.join(args.root, 'assets', 'asset-versions.json')
+        update_versions(versions, os.path.abspath(args.root), manifest.output_hashes())
+
+    print_summary(jobs)
+    return 0 if all(job.returncode == 0 for job in jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
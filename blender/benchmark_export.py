@@ -0,0 +1,232 @@
+# Benchmarks the Blender independent exporter core (mesh_core.py, armature_core.py) on generated
+# meshes and animations, from 1K to 1M vertices (or bone keyframes). Runs on plain Python with
+# NumPy, no Blender needed, so it can run in CI:
+#   python blender/benchmark_export.py --quick --out benchmark.json
+# and to fail when anything got more than 25% slower or hungrier than a previous run:
+#   python blender/benchmark_export.py --quick --baseline benchmark.json --tolerance 0.25
+#
+# Each case is timed over a few repeats (best kept) and its peak memory measured with tracemalloc
+# in a separate run, since tracing slows everything down. Only what a case allocates itself is
+# counted, not its input. The pure Python stages are skipped above --python-limit vertices unless
+# --full is given; at 1M vertices they take minutes.
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import export_common
+from armature_core import (ArmatureExport, ArmatureStreamWriter, schedule_keyframes, reduce_keyframes,
+                           encode_bone)
+from mesh_core import SubmeshExport, MeshStreamWriter, writeBinaryMesh
+
+SIZES = (1000, 10000, 100000, 1000000)
+QUICK_SIZES = (1000, 10000)
+
+# Extra sizes single cases also run at with --quick: a split only does something past the
+# 65536 vertices a submesh holds
+QUICK_CASE_SIZES = {'mesh.split': (70000,)}
+
+# Same as the exporters' defaults
+MAX_SUBMESH_VERTICES = 65536
+PRECISION = {'verts': 5, 'norms': 3, 'uvs': 5, 'weights': 3}
+BONES = 64
+KEYFRAME_RESOLUTION = 1
+MATRIX_PRECISION = 5
+
+# Timings shorter than this are mostly noise, they are compared as if they took this long
+NOISE_SECONDS = 0.001
+
+# A square grid of about size vertices, flattened into triangle corners the way
+# export_mesh_json.py extracts them: per corner positions, uvs and flat normals, and the
+# vertex each corner came from. Flat, so every corner of a vertex welds into one
+def grid_mesh(size):
+    side = max(2, round(math.sqrt(size)))
+    x, y = np.meshgrid(np.arange(side, dtype=np.float64), np.arange(side, dtype=np.float64))
+    co = np.stack([x.ravel(), y.ravel(), np.zeros(side * side)], axis=1) / (side - 1)
+
+    # two triangles per quad
+    quad = (np.arange(side - 1)[None, :] + side * np.arange(side - 1)[:, None]).ravel()
+    corners = np.stack([quad, quad + 1, quad + side + 1, quad, quad + side + 1, quad + side], axis=1).ravel()
+
+    positions = co[corners]
+    uvs = co[corners, :2]
+    norms = np.tile([0.0, 0.0, 1.0], (len(corners), 1))
+    return side * side, positions, uvs, norms, corners
+
+def assigned_submesh(mesh):
+    _, positions, uvs, norms, corners = mesh
+    submesh = SubmeshExport('grid')
+    submesh.assign(positions, uvs, norms, corners, None, True)
+    return submesh
+
+# Poses of an animation of size bone keyframes: every bone swaying about Z, a little out of phase
+# with its parent, keyed every 5 frames. Returns the keys, the frames sampled and a pose per sampled
+# frame, as nested lists that index like mathutils matrices
+def sway_animation(size):
+    frame_count = max(2, size // BONES)
+    key_frames = list(range(0, frame_count, 5)) + [frame_count - 1]
+    frames = schedule_keyframes(key_frames, KEYFRAME_RESOLUTION)
+
+    t = np.array(frames)[:, None] * 0.1 + np.arange(BONES)[None, :] * 0.3
+    angle = np.sin(t) * 0.5
+    matrices = np.zeros((len(frames), BONES, 4, 4))
+    matrices[..., 0, 0] = matrices[..., 1, 1] = np.cos(angle)
+    matrices[..., 0, 1] = -np.sin(angle)
+    matrices[..., 1, 0] = np.sin(angle)
+    matrices[..., 2, 2] = matrices[..., 3, 3] = 1.0
+    matrices[..., 2, 3] = np.cos(t) * 0.1
+    return key_frames, frames, matrices.tolist()
+
+def mesh_append(mesh):
+    _, positions, uvs, norms, corners = mesh
+    submesh = SubmeshExport('grid')
+    for v, uv, norm in zip(positions.tolist(), uvs.tolist(), norms.tolist()):
+        submesh.append(v, uv, norm, None)
+    submesh.build(True)
+    return submesh
+
+def mesh_split(submesh):
+    return submesh.split(MAX_SUBMESH_VERTICES)
+
+def mesh_json(chunks, folder):
+    writer = MeshStreamWriter(os.path.join(folder, 'grid.json'), 'grid', PRECISION)
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.close()
+    return
+
+def anim_reduce(animation):
+    _, frames, poses = animation
+    return reduce_keyframes(frames, poses, 1e-4, 1e-4)
+
+def anim_write(animation, folder):
+    _, _, poses = animation
+    export = ArmatureExport('sway', ['bone{}'.format(i) for i in range(BONES)])
+    export.encoding = 'MAT3x4'
+    writer = ArmatureStreamWriter(os.path.join(folder, 'sway_anim.json'), export, MATRIX_PRECISION)
+    for pose in poses:
+        writer.write([x for matrix in pose for x in encode_bone(matrix, export.encoding)])
+    writer.close()
+    return
+
+# Every case: (name, whether it is pure Python, prepare(size) -> input, run(input, folder))
+CASES = (
+    ('mesh.append', True, grid_mesh, lambda mesh, folder: mesh_append(mesh)),
+    ('mesh.assign', False, grid_mesh, lambda mesh, folder: assigned_submesh(mesh)),
+    ('mesh.optimize', True, lambda size: assigned_submesh(grid_mesh(size)), lambda submesh, folder: submesh.optimize()),
+    ('mesh.split', True, lambda size: assigned_submesh(grid_mesh(size)), lambda submesh, folder: mesh_split(submesh)),
+    ('mesh.json', True, lambda size: mesh_split(assigned_submesh(grid_mesh(size))), mesh_json),
+    ('mesh.binary', True, lambda size: mesh_split(assigned_submesh(grid_mesh(size))),
+     lambda chunks, folder: writeBinaryMesh(os.path.join(folder, 'grid.json'), 'grid', 'MESH', chunks)),
+    ('anim.schedule', True, sway_animation, lambda animation, folder: schedule_keyframes(animation[0], KEYFRAME_RESOLUTION)),
+    ('anim.reduce', True, sway_animation, lambda animation, folder: anim_reduce(animation)),
+    ('anim.write', True, sway_animation, anim_write),
+)
+
+def run_case(prepare, run, size, folder, trace):
+    data = prepare(size)
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    run(data, folder)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace else 0
+    if trace:
+        tracemalloc.stop()
+
+    # the writers remember every file for batch_export.py
+    del export_common.written_files[:]
+    return seconds, peak
+
+def benchmark(cases, sizes, python_limit, repeat, case_sizes=None):
+    case_sizes = case_sizes or {}
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark_export_') as folder:
+        for size in sorted(set(sizes).union(*case_sizes.values())):
+            for name, pure_python, prepare, run in cases:
+                if size not in sizes and size not in case_sizes.get(name, ()):
+                    continue
+                if pure_python and python_limit and size > python_limit:
+                    continue
+
+                seconds = min(run_case(prepare, run, size, folder, False)[0] for _ in range(repeat))
+                _, peak = run_case(prepare, run, size, folder, True)
+                results.append({
+                    'case': name,
+                    'size': size,
+                    'seconds': round(seconds, 6),
+                    'perSecond': round(size / seconds) if seconds > 0 else None,
+                    'peakBytes': peak,
+                })
+                print('{:<14} {:>8} {:>10.4f}s {:>12}/s {:>10.1f} MB'.format(
+                    name, size, seconds, results[-1]['perSecond'] or '-', peak / (1 << 20)))
+
+    return results
+
+# Cases of the baseline that got slower or used more memory than tolerance allows
+def regressions(results, baseline, tolerance):
+    previous = {(r['case'], r['size']): r for r in baseline['results']}
+    found = []
+    for result in results:
+        before = previous.get((result['case'], result['size']))
+        if not before:
+            continue
+        for key, floor in (('seconds', NOISE_SECONDS), ('peakBytes', 0)):
+            if before[key] and max(result[key], floor) > max(before[key], floor) * (1 + tolerance):
+                found.append('{} at {}: {} went from {} to {}'.format(result['case'], result['size'], key, before[key], result[key]))
+
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the exporter core on generated meshes and animations')
+    parser.add_argument('--quick', action='store_true', help='Only the {} sizes, and {}'.format('/'.join(map(str, QUICK_SIZES)),
+                        ', '.join('{} at {}'.format(case, '/'.join(map(str, sizes))) for case, sizes in QUICK_CASE_SIZES.items())))
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=None,
+                        help='Comma separated sizes in vertices (or bone keyframes), eg. 1000,50000')
+    parser.add_argument('--case', action='append', default=[], help='Only run the cases starting with this, eg. mesh or anim.reduce')
+    parser.add_argument('--python-limit', type=int, default=100000, help='Largest size the pure Python stages run at')
+    parser.add_argument('--full', action='store_true', help='Run the pure Python stages at every size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, the fastest is kept')
+    parser.add_argument('--out', help='Writes the results as JSON, eg. to use as a later baseline')
+    parser.add_argument('--baseline', help='Results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown or memory growth over the baseline, 0.25 is 25%%')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    cases = [case for case in CASES if not args.case or any(case[0].startswith(c) for c in args.case)]
+
+    print('{:<14} {:>8} {:>11} {:>14} {:>13}'.format('CASE', 'SIZE', 'SECONDS', 'THROUGHPUT', 'PEAK'))
+    case_sizes = QUICK_CASE_SIZES if args.quick and not args.sizes else None
+    results = benchmark(cases, sizes, None if args.full else args.python_limit, max(1, args.repeat), case_sizes)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({
+                'type': 'EXPORT_BENCHMARK',
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'results': results,
+            }, f, indent=1)
+        print('Wrote benchmark results to {}'.format(args.out))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print('REGRESSION {}'.format(regression))
+        if found:
+            return 1
+        print('No regressions over {} ({:.0%} tolerance)'.format(args.baseline, args.tolerance))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
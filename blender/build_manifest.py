@@ -0,0 +1,136 @@
+# Build manifest for exported assets. Records, for every export, a hash of the source .blend,
+# of the exporter script and of the options it ran with, plus a hash of each file it wrote.
+# An export whose inputs and outputs still match is up to date and can be skipped, and the
+# output hashes become the versions of the asset version map the client fetches with.
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+# Characters of a file's sha256 used as its version
+VERSION_LENGTH = 16
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_files(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(hash_file(path).encode('ascii'))
+    return digest.hexdigest()
+
+class BuildManifest:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.root = os.path.dirname(self.path)
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('entries', {})
+        return
+
+    # Paths are stored relative to the manifest so the tree can be moved or checked out elsewhere
+    def relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def absolute(self, path):
+        return os.path.normpath(os.path.join(self.root, path))
+
+    def key(self, exporter, output):
+        return '{}:{}'.format(exporter, self.relative(output))
+
+    # scripts are the exporter and the modules it imports, hashed together
+    def inputs(self, source, scripts, options):
+        return {
+            'source': self.relative(source),
+            'sourceHash': hash_file(source),
+            'exporterHash': hash_files(scripts),
+            'options': sorted(options),
+        }
+
+    def is_up_to_date(self, exporter, output, inputs):
+        entry = self.entries.get(self.key(exporter, output))
+        if not entry:
+            return False
+
+        if any(entry.get(k) != v for k, v in inputs.items()):
+            return False
+
+        # Outputs that were edited or deleted since have to be rebuilt too
+        for path, info in entry.get('outputs', {}).items():
+            path = self.absolute(path)
+            if not os.path.exists(path) or hash_file(path) != info['sha256']:
+                return False
+
+        return bool(entry.get('outputs'))
+
+    def record(self, exporter, output, inputs, written):
+        outputs = {}
+        for path in written:
+            outputs[self.relative(path)] = {
+                'sha256': hash_file(path),
+                'bytes': os.path.getsize(path),
+            }
+
+        entry = dict(inputs)
+        entry['outputs'] = outputs
+        self.entries[self.key(exporter, output)] = entry
+        return
+
+    # Re-hashes outputs rewritten after their export, eg. by pack_atlas.py, so they still count as
+    # up to date instead of being exported again over the changes. Returns how many were recorded
+    def refresh(self, paths):
+        paths = {self.relative(path) for path in paths}
+        refreshed = 0
+        for entry in self.entries.values():
+            for path, info in entry.get('outputs', {}).items():
+                if path in paths:
+                    info['sha256'] = hash_file(self.absolute(path))
+                    info['bytes'] = os.path.getsize(self.absolute(path))
+                    refreshed += 1
+        return refreshed
+
+    # sha256 of every file the recorded exports wrote, by absolute path
+    def output_hashes(self):
+        return {self.absolute(path): info['sha256']
+                for entry in self.entries.values() for path, info in entry.get('outputs', {}).items()}
+
+    def save(self):
+        data = {'version': MANIFEST_VERSION, 'entries': self.entries}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        return
+
+# Updates the asset version map the client loads at startup (js/common/http/rest-client.js): the web
+# path of each file, relative to root (the folder the web server serves), to a short hash of its
+# content. The client puts the version in the URL, so a changed file is a new URL and the server can
+# let browsers cache assets for good. hashes are {absolute path: sha256}, entries whose file is
+# gone are dropped
+def update_versions(path, root, hashes):
+    versions = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            versions = json.load(f)
+
+    for file_path, sha256 in hashes.items():
+        web_path = '/' + os.path.relpath(os.path.abspath(file_path), root).replace(os.sep, '/')
+        versions[web_path] = sha256[:VERSION_LENGTH]
+
+    versions = {k: v for k, v in versions.items() if os.path.exists(os.path.join(root, *k.lstrip('/').split('/')))}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(versions, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+    return versions
@@ -1,60 +1,144 @@
 import bpy
-import math
-import bmesh
-import struct
 import mathutils
-import json
+import os
+import re
+import sys
 
 # ExportHelper is a helper class, defines filename and
 # invoke() function which calls the file selector.
 from bpy_extras.io_utils import ExportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty, FloatProperty
 from bpy.types import Operator
-    
+
+# The Blender independent core lives next to this script (blender -b --python runs it from anywhere)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from armature_core import (ArmatureExport, ArmatureAnimationExport, ArmatureClipExport, ArmatureStreamWriter,
+                           assemble_matrix, schedule_keyframes, reduce_keyframes, encode_bone, joint_bounds,
+                           bone_extents, skinned_points, clip_path)
+from export_common import written_files
+from export_profile import profile, report_path
+from headless import run_headless
+
 # CONVERT FROM BLENDER TO RH Y UP (like OpenGL)
 axis_basis_change = mathutils.Matrix(((1.0, 0.0, 0.0, 0.0), (0.0, 0.0, 1.0, 0.0), (0.0, -1.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0)))
 
-def assemble_matrix(armature, bone, y_is_up):
-    # compare the current pose to the bind pose to see the relative offset
-    pose = armature.matrix_world @ bone.matrix.copy()
-    bind_pose = armature.matrix_world @ bone.bone.matrix_local.copy()
-        
+def world_basis(armature, y_is_up):
     if y_is_up:
-        pose = axis_basis_change @ pose
-        bind_pose = axis_basis_change @ bind_pose
-              
-    return pose @ bind_pose.inverted_safe()
-
-class ArmatureExport:
-    def __init__(self, armature):
-        self.name = armature.name
-        self.bones = [bone.name for bone in armature.data.bones if bone.use_deform]
-        self.type = 'ARMATURE'
-        self.animations = []
-        
-        # Data is the complete transform data
-        # PER ANIMATION
-        #    PER FRAME
-        #      PER BONE
-        # flattened as a giant float array
-        self.data = []
-        return
+        return axis_basis_change @ armature.matrix_world
+    return armature.matrix_world.copy()
+
+# Bones that move the skin: the deform bones, the bones they are parented to and the bones
+# their constraints aim at (IK targets and poles), which may in turn have parents of their own
+def deforming_bones(armature):
+    bones = set()
+    pending = [bone.name for bone in armature.data.bones if bone.use_deform]
+    while pending:
+        name = pending.pop()
+        if name in bones or name not in armature.pose.bones:
+            continue
+        bones.add(name)
+        
+        bone = armature.pose.bones[name]
+        if bone.parent:
+            pending.append(bone.parent.name)
+        for constraint in bone.constraints:
+            if getattr(constraint, 'target', None) == armature:
+                pending.extend(n for n in (constraint.subtarget, getattr(constraint, 'pole_subtarget', '')) if n)
+    return bones
+
+bone_path = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]')
+
+# Whether any fcurve of the action animates one of the given bones
+def action_targets(action, bones):
+    for fcurve in action.fcurves:
+        match = bone_path.match(fcurve.data_path)
+        if match and match.group(1).replace('\\"', '"').replace('\\\\', '\\') in bones:
+            return True
+    return False
+
+# Rest pose vertices of the meshes the armature deforms, in the exported space, grouped by the
+# bone (of bone_names) they are weighted to
+def skinned_vertices(armature, bone_names, y_is_up):
+    index = {name: i for i, name in enumerate(bone_names)}
+    points = [[] for _ in bone_names]
+    basis = axis_basis_change if y_is_up else mathutils.Matrix.Identity(4)
     
-    def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+    for obj in bpy.data.objects:
+        if obj.type != 'MESH' or not any(m.type == 'ARMATURE' and m.object == armature for m in obj.modifiers):
+            continue
+        
+        groups = [index.get(group.name) for group in obj.vertex_groups]
+        matrix = basis @ obj.matrix_world
+        for vertex in obj.data.vertices:
+            co = None
+            for g in vertex.groups:
+                if g.weight > 0 and g.group < len(groups) and groups[g.group] is not None:
+                    if co is None:
+                        co = matrix @ vertex.co
+                    points[groups[g.group]].append(co)
+    return points
+
+# Frames the action has keys on, in any fcurve
+def action_frames(action):
+    return [key.co.x for fcurve in action.fcurves for key in fcurve.keyframe_points]
+
+# Samples the deform bones of an armature. Bind pose inverses are computed once and
+# constraints (IKs) are re-evaluated only until the pose stops changing
+class ArmatureSampler:
+    def __init__(self, armature, bone_names, y_is_up, max_evaluations=10, tolerance=1e-06):
+        self.armature = armature
+        self.y_is_up = y_is_up
+        self.bones = [armature.pose.bones[name] for name in bone_names]
+        self.local_inverses = [bone.bone.matrix_local.inverted_safe() for bone in self.bones]
+        self.max_evaluations = max(1, max_evaluations)
+        self.tolerance = tolerance
+        
+        # Without constraints a single evaluation resolves the pose
+        self.has_constraints = any(len(bone.constraints) for bone in armature.pose.bones)
+        self.evaluations = 0
+        return
     
-class ArmatureAnimationExport:
-    def __init__(self, name):
-        self.name = name
-        self.keyframes = []
+    def settle(self, frame):
+        scene = bpy.context.scene
+        with profile.stage('frame_set'):
+            scene.frame_set(frame)
+        self.evaluations += 1
+        
+        if not self.has_constraints:
+            return
+        
+        previous = [bone.matrix.copy() for bone in self.bones]
+        for _ in range(1, self.max_evaluations):
+            with profile.stage('frame_set'):
+                scene.frame_set(frame)
+            self.evaluations += 1
+            
+            current = [bone.matrix.copy() for bone in self.bones]
+            converged = all(abs(a[r][c] - b[r][c]) <= self.tolerance
+                            for a, b in zip(previous, current) for r in range(4) for c in range(4))
+            if converged:
+                return
+            previous = current
         return
     
-    def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+    # Returns the skinning matrix of every bone at the given frame
+    def sample(self, frame):
+        self.settle(frame)
         
+        basis = world_basis(self.armature, self.y_is_up)
+        basis_inverse = basis.inverted_safe()
+        return [assemble_matrix(basis, basis_inverse, bone.matrix, local_inverse)
+                for bone, local_inverse in zip(self.bones, self.local_inverses)]
+    
+    # Head and tail of every bone in the exported space, as posed by the last sample()
+    def joints(self):
+        basis = world_basis(self.armature, self.y_is_up)
+        return [basis @ point for bone in self.bones for point in (bone.head, bone.tail)]
+
 class ExportArmatureJSON(Operator, ExportHelper):
     """Exports Armature (with Animations) as JSON (.json) file."""
-    bl_idname = "export_json_test.invoke"  # important since its how bpy.ops.import_test.some_data is constructed
+    bl_idname = "export_json.armature"  # important since its how bpy.ops.export_json.armature is constructed
     bl_label = "Export Custom Armature JSON (.json) file"
 
     # ExportHelper mixin class uses this
@@ -80,6 +164,93 @@ class ExportArmatureJSON(Operator, ExportHelper):
         default=5
     )
 
+    ik_evaluations: IntProperty(
+        name="IK Evaluations",
+        description="Maximum number of times each frame is evaluated for constraints like IKs to settle",
+        default=10,
+        min=1,
+    )
+
+    ik_tolerance: FloatProperty(
+        name="IK Tolerance",
+        description="Bones moving less than this between evaluations are considered settled",
+        default=1e-06,
+        min=0.0,
+        precision=6,
+    )
+
+    bone_encoding: EnumProperty(
+        name="Bone Encoding",
+        description="How each bone transform is stored",
+        items=(
+            ('MAT4', "4x4 Matrix", "16 floats per bone"),
+            ('MAT3x4', "3x4 Matrix", "12 floats per bone, drops the constant bottom row"),
+            ('QUAT', "Quaternion", "8 floats per bone: rotation, translation and uniform scale"),
+        ),
+        default='MAT4',
+    )
+
+    matrix_precision: IntProperty(
+        name="Bone Data Precision",
+        description="Decimal places written for bone transforms, -1 for full precision",
+        default=6,
+        min=-1,
+        max=17,
+    )
+
+    reduce_keyframes: BoolProperty(
+        name="Reduce Keyframes",
+        description="Drops keyframes that interpolating their neighbours reproduces within the error limits",
+        default=False,
+    )
+
+    max_position_error: FloatProperty(
+        name="Max Position Error",
+        description="Largest translation difference allowed when dropping a keyframe",
+        default=0.001,
+        min=0.0,
+        precision=4,
+    )
+
+    max_rotation_error: FloatProperty(
+        name="Max Rotation Error",
+        description="Largest rotation/scale matrix difference allowed when dropping a keyframe",
+        default=0.001,
+        min=0.0,
+        precision=4,
+    )
+
+    bounds_padding: FloatProperty(
+        name="Bounds Padding",
+        description="Added around the posed skin (and bones) of the animation bounds, eg. for cloth or effects",
+        default=0.0,
+        min=0.0,
+    )
+
+    armature_actions_only: BoolProperty(
+        name="Armature Actions Only",
+        description="Skips actions that do not animate any bone moving the armature's deform bones",
+        default=True,
+    )
+
+    split_clips: BoolProperty(
+        name="Split Clips",
+        description="Writes each animation other than the resident ones to its own file, streamed in by the client after the armature",
+        default=False,
+    )
+
+    resident_clips: StringProperty(
+        name="Resident Clips",
+        description="Comma separated animations kept in the armature file when splitting clips",
+        default="Idle,Walk,Running",
+    )
+
+    export_report: BoolProperty(
+        name="Export Report",
+        description="Times each export stage per action, counts keyframes, scene evaluations and bytes and writes them to a sibling _report file",
+        default=False,
+    )
+
     def execute(self, context):
         return self.write_json(context, self.filepath)
 
@@ -87,6 +258,8 @@ class ExportArmatureJSON(Operator, ExportHelper):
     # this is not ideal per se but it is intuitive. Binary is a bit of a PIA in Python
     def write_json(self, context, filepath):
         blenderFileName = bpy.path.basename(bpy.context.blend_data.filepath).split('.')[0]
+        profile.reset(self.export_report)
+        first_file = len(written_files)
         
         # Only export from the EXPORT collection
         # if it exists. Otherwise, use collection[0]
@@ -100,13 +273,15 @@ class ExportArmatureJSON(Operator, ExportHelper):
         except:
             print('No armature found in export collection!')
             self.report({"ERROR"}, "No armature found in export collection!")
-            return {'FINISHED'}
+            return {'CANCELLED'}
         
-        armatureExport = ArmatureExport(armature)
+        armatureExport = ArmatureExport(armature.name, [bone.name for bone in armature.data.bones if bone.use_deform])
+        armatureExport.encoding = self.bone_encoding
         print('Exporting {}...'.format(armatureExport.name))
         
         # Keep track of the frame before beginning export
-        originalObjectMode = bpy.context.object.mode
+        # (there is no active object when running headless)
+        originalObjectMode = bpy.context.object.mode if bpy.context.object else 'OBJECT'
         originalFrame = bpy.context.scene.frame_current
         originalAction = armature.animation_data.action
         originalSelection = bpy.context.view_layer.objects.active
@@ -114,54 +289,88 @@ class ExportArmatureJSON(Operator, ExportHelper):
         bpy.context.view_layer.objects.active = armature
         bpy.ops.object.mode_set(mode='POSE')
         
+        writer = ArmatureStreamWriter(filepath, armatureExport, self.matrix_precision)
+        sampler = ArmatureSampler(armature, armatureExport.bones, self.y_is_up, self.ik_evaluations, self.ik_tolerance)
+        
+        # Other armatures' actions would only add rows of rest poses to the texture
+        actions = list(bpy.data.actions)
+        if self.armature_actions_only:
+            bones = deforming_bones(armature)
+            skipped = [action.name for action in actions if not action_targets(action, bones)]
+            actions = [action for action in actions if action.name not in skipped]
+            if skipped:
+                print('Skipping action(s) not animating {}: {}'.format(armatureExport.name, ', '.join(skipped)))
+        
+        resident = {name.strip().lower() for name in self.resident_clips.split(',') if name.strip()}
+        
+        # Where the skin is around each bone at rest, posed with the bone for the bounds
+        extents = bone_extents(skinned_vertices(armature, armatureExport.bones, self.y_is_up))
+        if not any(extents):
+            print('No mesh is deformed by {}, animation bounds only cover the bones'.format(armatureExport.name))
+        
         # Go through all individual actions and extract keyframes
         # this will later be joined into a single giant hex string
-        #dataValueList = []
-        for action in bpy.data.actions:
+        for action in actions:
             animationExport = ArmatureAnimationExport(action.name)
             armature.animation_data.action = action
             
             print('Exporting {}...'.format(action.name))
+            profile.begin(action.name)
+            evaluations = sampler.evaluations
+
+            # Determine the keyframes, insuring the save at the
+            # resolution requested. More keyframes means a taller texture
+            with profile.stage('schedule'):
+                animationExport.keyframes = schedule_keyframes(action_frames(action), self.keyframe_resolution)
+            profile.count('keyframes', len(animationExport.keyframes))
 
-            # Gather keyframe locations
-            for fcurve in action.fcurves:
-                # Determine the keyframes, insuring the save at the 
-                # resolution requested. More keyframes means a taller texture
-                # there may be duplicates for each object so only consider each frame once
-                for key in fcurve.keyframe_points:
-                    kf = math.floor(key.co.x)
-                    if not any(animationExport.keyframes):
-                        animationExport.keyframes.append(kf)
-
-                    elif kf not in animationExport.keyframes:
-                        last_kf = animationExport.keyframes[-1]
-                        kf_delta = kf - last_kf
-                        while kf_delta > self.keyframe_resolution:
-                            animationExport.keyframes.append(animationExport.keyframes[-1] + self.keyframe_resolution)
-                            kf_delta -= self.keyframe_resolution
-
-                        animationExport.keyframes.append(kf) 
-                        
-            animationExport.keyframes.sort()
-
-            # Gather data at each keyframe
-            for frame in animationExport.keyframes:   
-                # Set the frame a few times so that the IKs resolve    
-                for _ in range(0, 10):
-                    bpy.context.scene.frame_set(frame)
+            # Gather data at each keyframe, and where the bones and the skin reach for the bounds
+            poses = []
+            joints = []
+            with profile.stage('sample'):
+                for frame in animationExport.keyframes:
+                    poses.append(sampler.sample(frame))
+                    with profile.stage('joints'):
+                        joints.extend(sampler.joints())
+                        joints.extend(skinned_points(poses[-1], extents))
+            profile.count('evaluations', sampler.evaluations - evaluations)
+            
+            # Every sampled pose counts, even the keyframes dropped below
+            if joints:
+                animationExport.bounds = joint_bounds(joints, self.bounds_padding)
+            
+            if self.reduce_keyframes:
+                with profile.stage('reduce'):
+                    kept = reduce_keyframes(animationExport.keyframes, poses, self.max_position_error, self.max_rotation_error)
+                print('Kept {} of {} keyframe(s)'.format(len(kept), len(poses)))
+                animationExport.keyframes = [animationExport.keyframes[i] for i in kept]
+                poses = [poses[i] for i in kept]
+            
+            # Streamed clips go to their own file, the armature only lists them
+            target = writer
+            if self.split_clips and action.name.lower() not in resident:
+                path = clip_path(filepath, action.name)
+                animationExport.src = os.path.basename(path)
+                target = ArmatureStreamWriter(path, ArmatureClipExport(armatureExport, animationExport), self.matrix_precision)
+            
+            # write each bone in order, a keyframe at a time
+            written = writer.file.tell()
+            with profile.stage('write'):
+                for pose in poses:
+                    target.write([x for bind_matrix in pose for x in encode_bone(bind_matrix, self.bone_encoding)])
                 
-                # write each matrix in order
-                # these matrices are stored as a very long HEX string per keyframe
-                bones = [armature.pose.bones[bone] for bone in armatureExport.bones]
-                for bone in bones:
-                    bind_matrix = assemble_matrix(armature, bone, self.y_is_up)
-        
-                    for column in range(0, 4):
-                        for row in range(0, 4):
-                            armatureExport.data.append(bind_matrix[row][column])
+                if target is not writer:
+                    target.close()
+                    print('Wrote clip {} to {}'.format(action.name, path))
+            
+            profile.count('keyframesWritten', len(poses))
+            profile.count('bytes', os.path.getsize(path) if target is not writer else writer.file.tell() - written)
+            profile.end()
                     
             armatureExport.animations.append(animationExport)
         
+        print('Sampled {} frame(s) with {} scene evaluation(s)'.format(
+            sum(len(a.keyframes) for a in armatureExport.animations), sampler.evaluations))
         
         # Reset frame and mode
         bpy.context.scene.frame_set(originalFrame)
@@ -169,12 +378,23 @@ class ExportArmatureJSON(Operator, ExportHelper):
         armature.animation_data.action = originalAction
         bpy.context.view_layer.objects.active = originalSelection
         
-        f = open(filepath, 'w')
-        f.write(armatureExport.toJson())
-        f.close()
+        # Bounds of the armature across every animation, for culling whatever it is playing
+        bounds = [a.bounds for a in armatureExport.animations if a.bounds]
+        if bounds:
+            bounds = {
+                'min': [min(b['min'][i] for b in bounds) for i in range(3)],
+                'max': [max(b['max'][i] for b in bounds) for i in range(3)],
+            }
+        
+        with profile.stage('write'):
+            writer.close(armatureExport.animations, bounds)
         
         print('Finished writing to {}'.format(filepath))
         self.report({"INFO"}, 'Wrote {} to {}'.format(armatureExport.name, filepath))
+        
+        if self.export_report:
+            # Not added to the written files: timings change every run and nothing loads the report
+            profile.write(report_path(filepath), armatureExport.name, written_files[first_file:], 'actions')
         return {'FINISHED'}
 
 # Only needed if you want to add into a dynamic menu
@@ -195,5 +415,8 @@ def unregister():
 if __name__ == "__main__":
     register()
 
-    # test call
-bpy.ops.export_json_test.invoke('INVOKE_DEFAULT')
+    if bpy.app.background:
+        sys.exit(run_headless(__file__, bpy.ops.export_json.armature, written_files))
+    else:
+        # test call
+        bpy.ops.export_json.armature('INVOKE_DEFAULT')
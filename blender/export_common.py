@@ -0,0 +1,10 @@
+# Helpers shared by the mesh and armature exporters (mesh_core.py, armature_core.py and the
+# Blender side of both), does not need bpy
+# Every file written by the current export, reported to batch_export.py when running headless
+written_files = []
+
+# Formats floats rounded to a number of decimal places, or at full precision if negative
+def format_floats(values, precision):
+    if precision < 0:
+        return ', '.join(repr(float(v)) for v in values)
+    return ', '.join(repr(round(float(v), precision)) for v in values)
@@ -1,15 +1,34 @@
 import bpy
 import bmesh
-import struct
 import json
 import os
+import sys
 import math
+import array
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ExportHelper is a helper class, defines filename and
 # invoke() function which calls the file selector.
 from bpy_extras.io_utils import ExportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty, IntProperty
 from bpy.types import Operator
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+from mathutils.kdtree import KDTree
+
+# The Blender independent core lives next to this script (blender -b --python runs it from anywhere)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mesh_core import (MeshExport, SubmeshExport, MeshStreamWriter, TriangleIndex, writeBinaryMesh, submeshToJson,
+                       lodPath, lodList, collisionPath, looseParts)
+from export_common import written_files
+from export_profile import profile, report_path
+from headless import run_headless
 
 def getCollectionPath(root, obj):
     collection_hierarchy = []
@@ -26,131 +45,134 @@ def getCollectionPath(root, obj):
 
     return '/'.join(collection_hierarchy)
 
-class MeshExport:
-    def __init__(self, name):
-        self.name = name
-        self.type = 'MESH'
-        self.submeshes = []
-        return
-    
-    def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+# Tileset pieces are classified by name like WallSolver does, unless a tile_category custom property says otherwise
+TILE_CATEGORIES = ('floor', 'walltorch', 'wall', 'corner')
+
+def tileCategory(obj):
+    category = obj.get('tile_category')
+    if category:
+        return str(category)
     
-class SubmeshExport:
-    def __init__(self, name):
-        self.name = name
-        self.verts = []
-        self.uvs = []
-        self.norms = []
-        self.indices = []
-        
-        # weights are a list of values:
-        # Bone, Weight, Bone, Weight, Bone, Weight, Bone, Weight...
-        self.weights = []
-        self.vertexGroups = []
-        return
+    name = obj.name.lower()
+    return next((c for c in TILE_CATEGORIES if c in name), 'prop')
+
+# Converts a Blender space vector to the exported axes
+def exportSpace(v, y_is_up):
+    return Vector((v[0], v[2], -v[1])) if y_is_up else Vector((v[0], v[1], v[2]))
+
+# Head and tail of each palette bone in world space and the exported axes, like the vertices
+def paletteSegments(armatureObj, palette, y_is_up):
+    bones = armatureObj.data.bones
+    matrix = armatureObj.matrix_world
+    return [(exportSpace(matrix @ bones[name].head_local, y_is_up), exportSpace(matrix @ bones[name].tail_local, y_is_up))
+            for name in palette]
+
+# Fixed, evenly spread, cosine weighted directions around +Z so that bakes are repeatable
+def hemisphereSamples(n):
+    golden = math.pi * (3 - math.sqrt(5))
+    samples = []
+    for i in range(n):
+        r = math.sqrt((i + 0.5) / n)
+        samples.append(Vector((r * math.cos(i * golden), r * math.sin(i * golden), math.sqrt(max(0.0, 1 - r * r)))))
+    return samples
+
+# Bakes 4 bytes per vertex: the light received from lights (RGB) and how much of the hemisphere
+# above the vertex is open within distance (A). lights are (type, position or direction, color)
+def bakeVertexLighting(submesh, tree, samples, distance, lights, bias=1e-03):
+    verts, norms = submesh.verts, submesh.norms
+    submesh.bake = array.array('B')
     
-    def append(self, v1, uv1=None, norm1=None, weight1=None):
-        index = -1
+    for k in range(len(verts) // 3):
+        pos = Vector(verts[k * 3:k * 3 + 3])
+        normal = Vector(norms[k * 3:k * 3 + 3]) if norms else Vector((0.0, 0.0, 0.0))
+        if normal.length_squared == 0:
+            submesh.bake.extend((0, 0, 0, 255))
+            continue
         
-        # compare vertices by seeing if distance is within a very small number away
-        # For most rendering APIs we will need redundant verts if positions are same
-        # but UVs are different
-        for i, (v0,uv0,norm0) in enumerate(zip(self.verts, self.uvs, self.norms)):
-            v_match = abs(v0.x - v1.x) <= 1e-09 and abs(v0.y - v1.y) <= 1e-09 and abs(v0.z - v1.z) <= 1e-09
-            
-            if not uv1:
-                uv_match = True
-            else:
-                uv_match = abs(uv0.x - uv1.x) <= 1e-09 and abs(uv0.y - uv1.y) <= 1e-09
-                
-            if not norm1:
-                norm_match = True
-            else:
-                norm_match = abs(norm0.x - norm1.x) <= 1e-09 and abs(norm0.y - norm1.y) <= 1e-09 and abs(norm0.z - norm1.z) <= 1e-09
-                
-            if v_match and uv_match and norm_match:
-                index = i
-                break    
-        
-        # no match found, add new entry
-        if(index == -1):
-            index = len(self.verts)
-            self.verts.append(v1)
-            self.norms.append(norm1)
-            
-            if uv1:
-                self.uvs.append(uv1.copy())
+        normal.normalize()
+        origin = pos + normal * bias
+        
+        # Rotate the samples onto the normal
+        tangent = normal.orthogonal().normalized()
+        bitangent = normal.cross(tangent)
+        hits = sum(1 for d in samples if tree.ray_cast(origin, tangent * d.x + bitangent * d.y + normal * d.z, distance)[0] is not None)
+        visibility = 1.0 - hits / len(samples) if samples else 1.0
+        
+        light = Vector((0.0, 0.0, 0.0))
+        for kind, vector, color in lights:
+            if kind == 'SUN':
+                toLight, reach, falloff = -vector, 1e+06, 1.0
             else:
-                self.uvs.append(None)
-                
-            self.weights.append(weight1)
-            
-        self.indices.append(index)
-        return
-                
-    # Flatten the vertex data
-    def build(self, y_is_up):
-        flattened = [] 
-        
-        if(y_is_up):
-            for v in self.verts:
-                flattened.append(v[0])
-                flattened.append(v[2])
-                flattened.append(-v[1])            
-        else:
-            for v in self.verts:
-                flattened.append(v[0])
-                flattened.append(v[1])
-                flattened.append(v[2])
-            
-        self.verts = flattened;
-        
-        flattened = []
-        if any(self.uvs):
-            for uv in self.uvs:
-                if not uv:
-                    print('NO UV')
-                    uv = Vector([0,0])
-                    
-                #Round to 3 decimal places
-                flattened.append(round(uv.x, 3))
-                flattened.append(round(uv.y, 3))
+                toLight = vector - origin
+                reach = toLight.length
+                falloff = 1.0 / max(reach * reach, 1e-06)
             
-        self.uvs = flattened
+            toLight = toLight.normalized()
+            facing = normal.dot(toLight)
+            if facing <= 0 or tree.ray_cast(origin, toLight, reach)[0] is not None:
+                continue
+            light += color * (facing * falloff)
+        
+        submesh.bake.extend([min(255, int(c * 255)) for c in light] + [int(visibility * 255)])
+    return
 
+# Convex hull of the vertices with faces within angleLimit of each other merged, as a SubmeshExport
+# holding only verts and indices. Flat objects (floors) have no volume and keep their own triangles
+def convexHull(name, verts, polygons, angleLimit):
+    bm = bmesh.new()
+    for co in verts:
+        bm.verts.new(co)
+    bm.verts.ensure_lookup_table()
+    
+    result = bmesh.ops.convex_hull(bm, input=bm.verts[:])
+    bmesh.ops.delete(bm, geom=[g for g in result['geom_interior'] + result['geom_unused'] if isinstance(g, bmesh.types.BMVert)], context='VERTS')
+    
+    if not bm.faces:
+        bm.free()
+        bm = bmesh.new()
+        for co in verts:
+            bm.verts.new(co)
+        bm.verts.ensure_lookup_table()
+        for polygon in polygons:
+            try:
+                bm.faces.new([bm.verts[i] for i in polygon])
+            except ValueError:
+                pass
+        bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=1e-06)
+    
+    bmesh.ops.dissolve_limit(bm, angle_limit=angleLimit, verts=bm.verts[:], edges=bm.edges[:])
+    bmesh.ops.triangulate(bm, faces=bm.faces[:])
+    
+    # drop vertices nothing uses any more
+    bmesh.ops.delete(bm, geom=[v for v in bm.verts if not v.link_faces], context='VERTS')
+    bm.verts.index_update()
+    
+    hull = SubmeshExport(name)
+    hull.verts = array.array('f', (x for v in bm.verts for x in v.co))
+    hull.indices = array.array('I', (v.index for f in bm.faces for v in f.verts))
+    bm.free()
+    return hull
 
-        flattened = []    
-        if any(self.norms):
-            if(y_is_up):
-                for norm in self.norms:
-                    if not norm:
-                        norm = Vector([0,0,0])
-                        
-                    flattened.append(norm[0])
-                    flattened.append(norm[2])
-                    flattened.append(-norm[1])
-            else:       
-                for norm in self.norms:
-                    if not norm:
-                        norm = Vector([0,0,0])
-                        
-                    flattened.append(norm[0])
-                    flattened.append(norm[1])
-                    flattened.append(norm[2])
-            
-        self.norms = flattened
-        
-        return
+# Largest distance from a vertex of the full mesh to the closest vertex of a level of detail,
+# a cheap stand in for the Hausdorff distance between the two surfaces
+def lodDeviation(verts, lodVerts):
+    tree = KDTree(sum(len(v) // 3 for v in lodVerts))
+    n = 0
+    for values in lodVerts:
+        for i in range(0, len(values), 3):
+            tree.insert(values[i:i + 3], n)
+            n += 1
+    tree.balance()
     
-    def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+    if not n:
+        return 0.0
+    return max(tree.find(verts[i:i + 3])[2] for i in range(0, len(verts), 3))
 
 # An exporter that writes mesh data in JSON format.
 # this is not ideal per se but it is intuitive. Binary is a bit of a PIA in Python
 class ExportJSON(Operator, ExportHelper):
     """Exports mesh as JSON (.json) file."""
-    bl_idname = "export_json_test.invoke"  # important since its how bpy.ops.import_test.some_data is constructed
+    bl_idname = "export_json.mesh"  # important since its how bpy.ops.export_json.mesh is constructed
     bl_label = "Export Custom Mesh JSON (.json) file"
 
     # ExportHelper mixin class uses this
@@ -188,8 +210,222 @@ class ExportJSON(Operator, ExportHelper):
         default=True,
     )
 
+    output_format: EnumProperty(
+        name="Format",
+        description="How vertex data is written",
+        items=(
+            ('JSON', "JSON", "Vertex data as JSON arrays"),
+            ('BINARY', "Binary", "JSON header with interleaved vertex and index data in a sibling .bin file"),
+        ),
+        default='JSON',
+    )
+
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorders triangles for the GPU's post-transform cache and vertices for sequential fetch",
+        default=True,
+    )
+
+    max_submesh_vertices: IntProperty(
+        name="Max Vertices per Submesh",
+        description="Submeshes with more vertices are split into chunks that can be indexed with 16 bits",
+        default=65536,
+        min=3,
+        max=65536,
+    )
+
+    limit_influences: BoolProperty(
+        name="Limit Bone Influences",
+        description="Keeps the strongest influences per vertex, renormalized and remapped to the armature's deform bones",
+        default=True,
+    )
+
+    max_influences: IntProperty(
+        name="Max Influences",
+        description="Bone influences kept per vertex",
+        default=4,
+        min=1,
+        max=4,
+    )
+
+    position_precision: IntProperty(
+        name="Position Precision",
+        description="Decimal places written for positions, -1 for full precision",
+        default=5,
+        min=-1,
+        max=17,
+    )
+
+    normal_precision: IntProperty(
+        name="Normal Precision",
+        description="Decimal places written for normals, -1 for full precision",
+        default=3,
+        min=-1,
+        max=17,
+    )
+
+    uv_precision: IntProperty(
+        name="UV Precision",
+        description="Decimal places written for UVs, -1 for full precision",
+        default=5,
+        min=-1,
+        max=17,
+    )
+
+    weight_precision: IntProperty(
+        name="Weight Precision",
+        description="Decimal places written for unquantized bone weights, -1 for full precision",
+        default=3,
+        min=-1,
+        max=17,
+    )
+
+    use_vectorized: BoolProperty(
+        name="Vectorized Extraction",
+        description="Reads mesh data in bulk with NumPy instead of walking every loop. Falls back to bmesh if NumPy is unavailable",
+        default=True,
+    )
+
+    weld_tolerance: FloatProperty(
+        name="Weld Tolerance",
+        description="Maximum difference in position, UV and normal for two vertices to be merged",
+        default=1e-09,
+        min=0.0,
+        precision=9,
+    )
+
+    triangle_bvh: BoolProperty(
+        name="Triangle BVH",
+        description="Adds a bounding volume hierarchy over the triangles of static single file exports for culling and raycasts",
+        default=False,
+    )
+
+    bvh_leaf_size: IntProperty(
+        name="BVH Leaf Size",
+        description="Most triangles kept in a leaf of the triangle BVH",
+        default=8,
+        min=1,
+        max=64,
+    )
+
+    tileset_mode: BoolProperty(
+        name="Tileset",
+        description="Exports each piece in the local space of its tile cell, with its category, pivot and footprint. Pieces are baked alone: no ambient occlusion where they meet their neighbours and only the lights parented to them",
+        default=False,
+    )
+
+    tile_size: FloatProperty(
+        name="Tile Size",
+        description="Width and depth of one tile cell",
+        default=32.0,
+        min=0.001,
+    )
+
+    bake_ao: BoolProperty(
+        name="Bake Ambient Occlusion",
+        description="Bakes per vertex ambient occlusion into static (not skinned) submeshes",
+        default=False,
+    )
+
+    ao_samples: IntProperty(
+        name="AO Samples",
+        description="Rays cast per vertex for ambient occlusion",
+        default=32,
+        min=1,
+        max=1024,
+    )
+
+    ao_distance: FloatProperty(
+        name="AO Distance",
+        description="Geometry further than this does not occlude",
+        default=8.0,
+        min=0.001,
+    )
+
+    bake_lights: BoolProperty(
+        name="Bake Static Lights",
+        description="Bakes the light from the export collection's lights into static submeshes, in tileset mode only the lights parented to each piece. Lights added at runtime should not be in it",
+        default=False,
+    )
+
+    light_intensity: FloatProperty(
+        name="Baked Light Intensity",
+        description="Scales the baked light of Blender lights (power over distance squared, strength for suns)",
+        default=1.0,
+        min=0.0,
+    )
+
+    export_report: BoolProperty(
+        name="Export Report",
+        description="Times each export stage per object, counts vertices, triangles and bytes and writes them to a sibling _report file",
+        default=False,
+    )
+
+    export_collision: BoolProperty(
+        name="Export Collision",
+        description="Writes convex hulls of the loose parts of objects with a \"collision\" property (every piece in tileset mode) and a walkable grid to a sibling _collision file",
+        default=False,
+    )
+
+    hull_angle_limit: FloatProperty(
+        name="Hull Angle Limit",
+        description="Collision hull faces closer than this angle are merged",
+        default=math.radians(5.0),
+        min=0.0,
+        max=math.pi,
+        subtype='ANGLE',
+    )
+
+    nav_cell_size: FloatProperty(
+        name="Nav Cell Size",
+        description="Width of a cell of the walkable grid",
+        default=4.0,
+        min=0.001,
+    )
+
+    agent_height: FloatProperty(
+        name="Agent Height",
+        description="Room needed above a cell for it to be walkable",
+        default=16.0,
+        min=0.0,
+    )
+
+    max_slope: FloatProperty(
+        name="Max Slope",
+        description="Steepest ground that is walkable",
+        default=math.radians(45.0),
+        min=0.0,
+        max=math.pi / 2,
+        subtype='ANGLE',
+    )
+
+    max_walkable_height: FloatProperty(
+        name="Max Walkable Height",
+        description="Surfaces higher than this above the bottom of the geometry, like the tops of walls, are not walkable",
+        default=8.0,
+        min=0.0,
+    )
+
+    lod_levels: IntProperty(
+        name="LOD Levels",
+        description="Decimated levels of detail written next to the full mesh, each in a sibling _lodN file. Only for meshes deformed by an armature, the client draws static geometry at full detail",
+        default=0,
+        min=0,
+        max=4,
+    )
+
+    lod_ratio: FloatProperty(
+        name="LOD Ratio",
+        description="Fraction of the triangles each level of detail keeps from the one before",
+        default=0.5,
+        min=0.05,
+        max=0.95,
+    )
+
     def write_json(self, context, filepath, y_is_up):
         blenderFileName = bpy.path.basename(bpy.context.blend_data.filepath).split('.')[0]
+        profile.reset(self.export_report)
+        firstFile = len(written_files)
         
         # Keep track of the frame before beginning export
         if bpy.context.object:
@@ -216,99 +452,186 @@ class ExportJSON(Operator, ExportHelper):
         meshes      = list(filter(lambda m: m.type == 'MESH', exportCollection.all_objects))
         meshCount   = len(meshes)
         
+        precision = {
+            'verts': self.position_precision,
+            'norms': self.normal_precision,
+            'uvs': self.uv_precision,
+            'weights': self.weight_precision,
+        }
+        
+        # Bounds and the BVH are rounded like the vertices they contain
+        boundsPrecision = -1 if self.output_format == 'BINARY' else self.position_precision
+        
+        # The BVH covers the whole file, so it is only built for static single file exports
+        triangleIndex = None
+        if self.triangle_bvh:
+            if self.export_separate_files:
+                self.report({'WARNING'}, 'The triangle BVH is only built when exporting to a single file')
+            else:
+                triangleIndex = TriangleIndex(self.bvh_leaf_size, self.output_format == 'BINARY')
+        
+        # Submesh indices of each tile category, for instancing repeated pieces
+        tileset = None
+        if self.tileset_mode and not self.export_separate_files:
+            tileset = {
+                'tileSize': self.tile_size,
+                'pivot': self.tile_pivot(y_is_up),
+                'categories': {}
+            }
+        
+        # Everything static in the export occludes everything else, except tileset pieces which
+        # only occlude themselves since they all share the same tile. Pieces are placed next to each
+        # other at runtime, so the occlusion where they touch is not baked. A piece is instanced
+        # anywhere in the level too, so it only gets the lights that move with it: its children
+        bake = self.bake_ao or self.bake_lights
+        if bake:
+            samples = hemisphereSamples(self.ao_samples) if self.bake_ao else []
+            lights = []
+            if self.bake_lights and not self.tileset_mode:
+                lights = self.static_lights(exportCollection.all_objects, y_is_up)
+            if not self.tileset_mode:
+                with profile.stage('occluders'):
+                    occluders = self.occluder_tree(meshes, bpy.context.evaluated_depsgraph_get(), y_is_up)
+        
+        # The client only switches actors to a level of detail. Static geometry is uploaded into one
+        # shared vertex buffer, so only files with a mesh deformed by an armature get levels
+        deformed = [obj for obj in meshes if True in (m.type=='ARMATURE' for m in obj.modifiers)]
+        lodLevels = self.lod_levels if deformed else 0
+        if self.lod_levels and not deformed:
+            self.report({'WARNING'}, 'Levels of detail are only exported for meshes deformed by an armature')
+        
+        # Level of detail n goes to a sibling file, eg. level.json -> level_lod1.json
+        lodErrors = [0.0] * lodLevels
+        
         if not self.export_separate_files:
-            export = MeshExport(blenderFileName)
+            if self.output_format == 'BINARY':
+                export = MeshExport(blenderFileName)
+                lodExports = [MeshExport('{}_lod{}'.format(blenderFileName, level)) for level in range(1, lodLevels + 1)]
+            else:
+                print('Writing Mesh as JSON to File {}...'.format(filepath))
+                writer = MeshStreamWriter(filepath, blenderFileName, precision)
+                lodWriters = [MeshStreamWriter(lodPath(filepath, level), '{}_lod{}'.format(blenderFileName, level), precision)
+                              for level in range(1, lodLevels + 1)]
         
         for obj in meshes:
             bpy.context.view_layer.objects.active = obj
-            bpy.ops.object.mode_set(mode='EDIT')
             print('Exporting: {}'.format(obj.name))
-            submeshExport = SubmeshExport(obj.name)
+            submeshExport = SubmeshExport(obj.name, self.weld_tolerance)
+            profile.begin(obj.name)
+            objectFile = len(written_files)
             
             # see if an armature modifies this mesh
+            armatures = [m.object for m in obj.modifiers if m.type=='ARMATURE' and m.object]
             hasDeforms = True in (m.type=='ARMATURE' for m in obj.modifiers)
             if(hasDeforms):
                 print('{} is deformed by an armature. Weights will be included.'.format(obj.name))
                 submeshExport.vertexGroups = [g.name for g in obj.vertex_groups]
             else:
                 print('{} is not deformed by an armature. Weight data will be empty.'.format(obj.name))
+            
+            # Same deform-only bone list (and order) that the armature exporter writes
+            palette = None
+            boneSegments = None
+            if self.limit_influences and hasDeforms and armatures:
+                palette = [bone.name for bone in armatures[0].data.bones if bone.use_deform]
+                boneSegments = paletteSegments(armatures[0], palette, y_is_up)
                 
             # Let the dependency graph take care of applying modifiers; deforms should stay intact
             depsgraph = bpy.context.evaluated_depsgraph_get()
-            bm = bmesh.new()
-            bm.from_object( obj, depsgraph )
-
-            # layers should work properly
-            bm.verts.ensure_lookup_table()
+            with profile.stage('extract'):
+                self.extract(obj, depsgraph, submeshExport, hasDeforms, y_is_up)
             
-            # We need triangles! Not even optional.
-            bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method='BEAUTY', ngon_method='BEAUTY')
-            uv = bm.loops.layers.uv.active
-
-            if hasDeforms:
-                bm.verts.layers.deform.verify()
-                deform = bm.verts.layers.deform.active
-            
-                if not deform:
-                    self.report({'WARNING'}, '{} has armature modifier but no vertex weights'.format(obj.name))
-                    hasDeforms = False
-
-            # Go every face in the now-triangulated mesh and gather properties per vertex
-            for face in bm.faces:
-                for loop in face.loops:
-                    # transform vertex to world transform for this object
-                    vert_pos = (obj.matrix_world @ loop.vert.co)
-                    
-                    # Get bone deforms that actually influence this vertex, let engine decide what to keep
-                    weight = []
-                    
-                    if(hasDeforms):
-                        deforms = loop.vert[deform].items()
-                        for g, w in deforms:
-                            if(w > 1e-09):
-                                weight.append(g)
-                                weight.append(w)
-                                
-                    # UV is attached to the loop
-                    if uv:
-                        uv_coord = loop[uv].uv
-                        if math.isnan(uv_coord.x) or math.isnan(uv_coord.y):
-                            # assume this is a bad vertex and don't even output it
-                            continue
-                    else:
-                        uv_coord = None
-                        
-                    # Normals have to be computed at each point
-                    normal = loop.calc_normal()
-
-                    submeshExport.append(vert_pos, uv1=uv_coord, weight1=weight, norm1=normal)
+            # every triangle corner is a vertex until welded
+            profile.count('corners', len(submeshExport.indices))
+            profile.count('vertices', len(submeshExport.verts) // 3)
+            profile.count('triangles', len(submeshExport.indices) // 3)
             
-            # release extra mesh data from memory
-            bm.free()
+            chunks = self.finish_submesh(submeshExport, palette, boundsPrecision, boneSegments)
+            profile.count('chunks', len(chunks))
+            with profile.stage('lods'):
+                # static objects in a file of their own never get levels, see lodLevels
+                levelCount = lodLevels if hasDeforms or not self.export_separate_files else 0
+                lods = self.extract_lods(obj, chunks, levelCount, hasDeforms, palette, boundsPrecision, y_is_up, boneSegments)
+            for level, (lodChunks, error) in enumerate(lods):
+                lodErrors[level] = max(lodErrors[level], error)
             
-            # Add compiled data to output
-            submeshExport.build(y_is_up)
+            if triangleIndex and hasDeforms:
+                print('{} is skinned, leaving out the triangle BVH'.format(obj.name))
+                triangleIndex = None
+            
+            if self.tileset_mode:
+                tile = self.tile_metadata(obj, chunks, y_is_up)
+                for chunk in chunks:
+                    chunk.tile = tile
+            
+            if bake and not hasDeforms:
+                pieceLights = lights
+                if self.tileset_mode:
+                    occluders = self.piece_tree(chunks)
+                    origin = Vector(self.tile_origin(obj, y_is_up))
+                    pieceLights = self.static_lights(obj.children, y_is_up) if self.bake_lights else []
+                    pieceLights = [(kind, v if kind == 'SUN' else v - origin, color) for kind, v, color in pieceLights]
+                
+                with profile.stage('bake'):
+                    for chunk in chunks + [c for lodChunks, _ in lods for c in lodChunks]:
+                        bakeVertexLighting(chunk, occluders, samples, self.ao_distance, pieceLights)
+            
+            if triangleIndex or tileset:
+                submeshCount = len(export.submeshes) if self.output_format == 'BINARY' else writer.count
+                for i, chunk in enumerate(chunks):
+                    if triangleIndex:
+                        triangleIndex.add(submeshCount + i, chunk)
+                    if tileset:
+                        tileset['categories'].setdefault(chunk.tile['category'], []).append(submeshCount + i)
             
             if self.export_separate_files:
-                submeshExport.type = 'SUBMESH'
                 print(filepath)
 
                 if self.collections_to_subfolders:
                     subfolder_path = getCollectionPath(exportCollection, obj);
-                    folder = os.path.dirname(filepath) + '\\' + subfolder_path
+                    folder = os.path.join(os.path.dirname(filepath), *subfolder_path.split('/'))
                     if not os.path.exists(folder):
                         os.makedirs(folder)
                         
-                    submeshPath = '{}\{}.json'.format(folder, submeshExport.name)
+                    submeshPath = os.path.join(folder, '{}.json'.format(submeshExport.name))
                 else:
-                    submeshPath = os.path.dirname(filepath) + '\{}.json'.format(submeshExport.name)
+                    submeshPath = os.path.join(os.path.dirname(filepath), '{}.json'.format(submeshExport.name))
 
-                f = open(submeshPath, 'w')
-                f.write(submeshExport.toJson())
-                f.close()
+                with profile.stage('write'):
+                    for level, (lodChunks, _) in enumerate(lods, 1):
+                        self.write_separate(lodPath(submeshPath, level), '{}_lod{}'.format(submeshExport.name, level), lodChunks, precision)
+                    
+                    extra = {'lods': lodList(submeshPath, [error for _, error in lods])} if lods else None
+                    self.write_separate(submeshPath, submeshExport.name, chunks, precision, extra)
                 self.report({"INFO"}, 'Exported {}'.format(submeshPath))
+                profile.count('bytes', sum(os.path.getsize(path) for path in written_files[objectFile:]))
+                
+                for chunk in chunks + [c for lodChunks, _ in lods for c in lodChunks]:
+                    chunk.release()
+            elif self.output_format == 'BINARY':
+                export.submeshes.extend(chunks)
+                for level, (lodChunks, _) in enumerate(lods):
+                    lodExports[level].submeshes.extend(lodChunks)
             else:
-                export.submeshes.append(submeshExport)
+                written = sum(w.file.tell() for w in [writer] + lodWriters)
+                
+                # written out straight away so the submesh can be released
+                with profile.stage('write'):
+                    for chunk in chunks:
+                        writer.write(chunk)
+                        chunk.release()
+                        
+                    for level, (lodChunks, _) in enumerate(lods):
+                        for chunk in lodChunks:
+                            lodWriters[level].write(chunk)
+                            chunk.release()
+                profile.count('bytes', sum(w.file.tell() for w in [writer] + lodWriters) - written)
+            
+            profile.end()
+        
+        if self.export_collision:
+            with profile.stage('collision'):
+                self.write_collision(collisionPath(filepath), blenderFileName, meshes, y_is_up)
         
         # Reset frame and mode
         bpy.context.scene.frame_set(originalFrame)
@@ -317,17 +640,488 @@ class ExportJSON(Operator, ExportHelper):
             bpy.ops.object.mode_set(mode=originalObjectMode)
             
         if not self.export_separate_files:
-            # actually write the mesh JSON to disc
-            print('Writing Mesh as JSON to File {}...'.format(filepath))
-            f = open(filepath, 'w')
-            f.write(export.toJson())
-            f.close()
+            extra = {}
+            with profile.stage('bvh'):
+                bvh = triangleIndex.build(boundsPrecision) if triangleIndex else None
+            if bvh:
+                print('Triangle BVH: {} node(s) over {} triangle(s)'.format(len(bvh['nodes']) // 8, len(bvh['triangles']) // 2))
+                extra['bvh'] = bvh
+            
+            if lodLevels:
+                extra['lods'] = lodList(filepath, lodErrors)
+            
+            if tileset:
+                extra['tileset'] = tileset
+            
+            with profile.stage('write'):
+                if self.output_format == 'BINARY':
+                    # actually write the mesh to disc
+                    for level, lodExport in enumerate(lodExports, 1):
+                        writeBinaryMesh(lodPath(filepath, level), lodExport.name, lodExport.type, lodExport.submeshes)
+                    writeBinaryMesh(filepath, export.name, export.type, export.submeshes, extra)
+                else:
+                    for lodWriter in lodWriters:
+                        lodWriter.close()
+                    writer.close(extra)
             
             print('Finished writing to {}'.format(filepath))
             self.report({"INFO"}, 'Wrote to {}'.format(filepath))
+        
+        if self.export_report:
+            # Not added to the written files: timings change every run and nothing loads the report
+            profile.write(report_path(filepath), blenderFileName, written_files[firstFile:], 'objects')
             
         return {'FINISHED'}
 
+    # Reads the evaluated mesh into submeshExport, in bulk when NumPy is available
+    def extract(self, obj, depsgraph, submeshExport, hasDeforms, y_is_up):
+        if self.use_vectorized and np is not None:
+            bpy.ops.object.mode_set(mode='OBJECT')
+            self.extract_vectorized(obj, depsgraph, submeshExport, hasDeforms, y_is_up)
+        else:
+            bpy.ops.object.mode_set(mode='EDIT')
+            self.extract_bmesh(obj, depsgraph, submeshExport, hasDeforms)
+            
+            # Add compiled data to output
+            with profile.stage('build'):
+                submeshExport.build(y_is_up)
+        
+        if self.tileset_mode:
+            submeshExport.translate([-x for x in self.tile_origin(obj, y_is_up)])
+        return
+    
+    # Evaluated vertices and polygons of every static object in the exported space, moved by offset
+    def static_geometry(self, meshes, depsgraph, y_is_up, offset=(0.0, 0.0, 0.0)):
+        verts = []
+        polygons = []
+        offset = Vector(offset)
+        for obj in meshes:
+            if any(m.type == 'ARMATURE' for m in obj.modifiers):
+                continue
+            
+            evaluated = obj.evaluated_get(depsgraph)
+            mesh = evaluated.to_mesh()
+            first = len(verts)
+            verts.extend(exportSpace(obj.matrix_world @ v.co, y_is_up) + offset for v in mesh.vertices)
+            polygons.extend([first + i for i in p.vertices] for p in mesh.polygons)
+            evaluated.to_mesh_clear()
+            
+        return verts, polygons
+    
+    # Raycasting tree over every static object in the export, in the exported space
+    def occluder_tree(self, meshes, depsgraph, y_is_up):
+        return BVHTree.FromPolygons(*self.static_geometry(meshes, depsgraph, y_is_up))
+    
+    # Raycasting tree over the exported triangles of a single piece
+    def piece_tree(self, chunks):
+        verts = []
+        polygons = []
+        for chunk in chunks:
+            offset = len(verts)
+            verts.extend(chunk.verts[i:i + 3] for i in range(0, len(chunk.verts), 3))
+            polygons.extend([offset + v for v in chunk.indices[t:t + 3]] for t in range(0, len(chunk.indices), 3))
+        return BVHTree.FromPolygons(verts, polygons)
+    
+    # Lights among objects as (type, position or direction, color) in the exported space.
+    # Point, spot and area lights are all treated as points spreading their power over a sphere
+    def static_lights(self, objects, y_is_up):
+        lights = []
+        for obj in objects:
+            if obj.type != 'LIGHT':
+                continue
+            
+            color = Vector(obj.data.color) * obj.data.energy * self.light_intensity
+            if obj.data.type == 'SUN':
+                direction = obj.matrix_world.to_quaternion() @ Vector((0.0, 0.0, -1.0))
+                lights.append(('SUN', exportSpace(direction, y_is_up), color))
+            else:
+                lights.append(('POINT', exportSpace(obj.matrix_world.translation, y_is_up), color / (4 * math.pi)))
+        return lights
+    
+    # Writes the gameplay geometry of the export: low poly convex hulls of each object tagged with a
+    # "collision" custom property (every piece in tileset mode) indexed by a BVH, and a walkable grid.
+    # A hull per loose part, so that concave pieces (corners, wall torches) made of separate parts
+    # don't fill in the space between them. parts holds the first triangle and triangle count of each.
+    # Tileset pieces are in tile local space with a grid of their own each
+    def write_collision(self, filepath, name, meshes, y_is_up):
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        bpy.ops.object.mode_set(mode='OBJECT')
+        precision = self.position_precision
+        up = 1 if y_is_up else 2
+        
+        hulls = []
+        hullIndex = None if self.tileset_mode else TriangleIndex(self.bvh_leaf_size)
+        for obj in meshes:
+            if not self.tileset_mode and not obj.get('collision'):
+                continue
+            
+            offset = [-x for x in self.tile_origin(obj, y_is_up)] if self.tileset_mode else (0.0, 0.0, 0.0)
+            verts, polygons = self.static_geometry([obj], depsgraph, y_is_up, offset)
+            if not polygons:
+                continue
+            
+            hull = SubmeshExport(obj.name)
+            parts = []
+            for partVertices, partPolygons in looseParts(polygons):
+                part = convexHull(obj.name, [verts[v] for v in partVertices], partPolygons, self.hull_angle_limit)
+                parts.append([len(hull.indices) // 3, len(part.indices) // 3])
+                hull.indices.extend(i + len(hull.verts) // 3 for i in part.indices)
+                hull.verts.extend(part.verts)
+            hull.computeBounds(precision)
+            if hullIndex:
+                hullIndex.add(len(hulls), hull)
+            
+            entry = {
+                'name': obj.name,
+                'verts': [round(v, precision) for v in hull.verts] if precision >= 0 else hull.verts.tolist(),
+                'indices': hull.indices.tolist(),
+                'parts': parts,
+                'bounds': hull.bounds
+            }
+            
+            if self.tileset_mode:
+                size = self.tile_size
+                entry['category'] = tileCategory(obj)
+                footprint = [max(1, math.ceil(hull.bounds['max'][a] / size - 1e-06)) for a in self.tile_axes(y_is_up)]
+                entry['nav'] = self.nav_grid(BVHTree.FromPolygons(verts, polygons), (0.0, 0.0),
+                                             (footprint[0] * size, footprint[1] * size), hull.bounds['min'][up], y_is_up)
+            
+            hulls.append(entry)
+            print('Collision hull for {}: {} part(s), {} triangle(s)'.format(obj.name, len(parts), len(hull.indices) // 3))
+        
+        collision = {'name': name, 'type': 'COLLISION', 'hulls': hulls}
+        
+        if hullIndex:
+            collision['bvh'] = hullIndex.build(precision)
+        
+        # The whole level gets one walkable grid, over everything static in it
+        if not self.tileset_mode:
+            verts, polygons = self.static_geometry(meshes, depsgraph, y_is_up)
+            if polygons:
+                axes = self.tile_axes(y_is_up)
+                collision['nav'] = self.nav_grid(BVHTree.FromPolygons(verts, polygons),
+                                                 [min(v[a] for v in verts) for a in axes],
+                                                 [max(v[a] for v in verts) for a in axes],
+                                                 min(v[up] for v in verts), y_is_up)
+        
+        f = open(filepath, 'w')
+        f.write(json.dumps(collision))
+        f.close()
+        written_files.append(filepath)
+        
+        print('Wrote collision data to {}'.format(filepath))
+        return
+    
+    # Walkable cells over the horizontal rectangle lo-hi. Rays are cast down through the centre of
+    # each cell and the lowest surface no steeper than max_slope, with agent_height of room above
+    # it and at most max_walkable_height above the bottom of the geometry is walkable.
+    #   heights:  where the walkable surface is in each cell, 0 if there is none
+    #   walkable: one bit per cell, row major, 8 cells to a byte
+    def nav_grid(self, tree, lo, hi, bottom, y_is_up):
+        size = self.nav_cell_size
+        axes = self.tile_axes(y_is_up)
+        up = 1 if y_is_up else 2
+        w = max(1, math.ceil((hi[0] - lo[0]) / size - 1e-06))
+        h = max(1, math.ceil((hi[1] - lo[1]) / size - 1e-06))
+        
+        upward = Vector([1.0 if a == up else 0.0 for a in range(3)])
+        minFacing = math.cos(self.max_slope)
+        
+        heights = []
+        walkable = bytearray((w * h + 7) // 8)
+        for y in range(h):
+            for x in range(w):
+                origin = [0.0] * 3
+                origin[axes[0]] = lo[0] + (x + 0.5) * size
+                origin[axes[1]] = lo[1] + (y + 0.5) * size
+                origin[up] = 1e+05
+                origin = Vector(origin)
+                
+                # Collect every surface down the column
+                surfaces = []
+                while True:
+                    location, normal, _, distance = tree.ray_cast(origin, -upward, 2e+05)
+                    if location is None:
+                        break
+                    surfaces.append((location, normal))
+                    origin = location - upward * 1e-03
+                
+                ground = None
+                for location, normal in reversed(surfaces):
+                    # ceilings and the undersides of overhangs face down, they are never ground
+                    if normal.dot(upward) < minFacing or location[up] - bottom > self.max_walkable_height:
+                        continue
+                    if tree.ray_cast(location + upward * 1e-03, upward, self.agent_height)[0] is None:
+                        ground = location[up]
+                        break
+                
+                if ground is None:
+                    heights.append(0.0)
+                    continue
+                
+                i = x + y * w
+                walkable[i >> 3] |= 1 << (i & 7)
+                heights.append(round(ground, self.position_precision) if self.position_precision >= 0 else ground)
+        
+        return {
+            'cellSize': size,
+            'origin': list(lo),
+            'w': w,
+            'h': h,
+            'heights': heights,
+            'walkable': list(walkable)
+        }
+    
+    # Horizontal axes of the exported space
+    def tile_axes(self, y_is_up):
+        return (0, 2) if y_is_up else (0, 1)
+    
+    # Corner of the tile cell the object's origin is in, in the exported space. Subtracting it puts
+    # every piece in the same tile local space wherever it was laid out in the .blend
+    def tile_origin(self, obj, y_is_up):
+        x, y, z = obj.matrix_world.translation
+        origin = (x, z, -y) if y_is_up else (x, y, z)
+        axes = self.tile_axes(y_is_up)
+        return [math.floor(origin[a] / self.tile_size) * self.tile_size if a in axes else 0.0 for a in range(3)]
+    
+    # Pieces are rotated about the centre of their tile
+    def tile_pivot(self, y_is_up):
+        axes = self.tile_axes(y_is_up)
+        return [self.tile_size / 2 if a in axes else 0.0 for a in range(3)]
+    
+    # Category, rotation pivot and footprint (in tiles along both horizontal axes) of a piece
+    def tile_metadata(self, obj, chunks, y_is_up):
+        bounds = [c.bounds for c in chunks if hasattr(c, 'bounds')]
+        footprint = [1, 1]
+        if bounds:
+            footprint = [max(1, math.ceil(max(b['max'][a] for b in bounds) / self.tile_size - 1e-06))
+                         for a in self.tile_axes(y_is_up)]
+        
+        return {
+            'category': tileCategory(obj),
+            'pivot': self.tile_pivot(y_is_up),
+            'footprint': footprint
+        }
+    
+    # Cache optimization, splitting, influence limits and bounds of an extracted submesh
+    # Returns the chunks to write
+    def finish_submesh(self, submeshExport, palette, boundsPrecision, boneSegments=None):
+        if self.optimize_vertex_cache:
+            with profile.stage('optimize'):
+                (acmr0, atvr0), (acmr1, atvr1) = submeshExport.optimize()
+            print('{} ACMR: {:.3f} -> {:.3f}, ATVR: {:.3f} -> {:.3f}'.format(submeshExport.name, acmr0, acmr1, atvr0, atvr1))
+        
+        with profile.stage('split'):
+            chunks = submeshExport.split(self.max_submesh_vertices, sortByLocality=not self.optimize_vertex_cache)
+        if len(chunks) > 1:
+            print('{} split into {} chunks of at most {} vertices'.format(submeshExport.name, len(chunks), self.max_submesh_vertices))
+        
+        with profile.stage('influences'):
+            if palette:
+                unweighted = sum(chunk.limitInfluences(palette, self.max_influences, boneSegments) for chunk in chunks)
+                if unweighted:
+                    self.report({'WARNING'}, '{}: {} vertices have no deform bone weights, bound to the nearest deform bone'.format(submeshExport.name, unweighted))
+        
+        with profile.stage('bounds'):
+            for chunk in chunks:
+                chunk.computeBounds(boundsPrecision)
+            
+        return chunks
+    
+    # Extracts the object again through a collapse Decimate modifier for every level of detail.
+    # The modifier goes first in the stack so the rest shape is decimated before the armature
+    # deforms it, vertex groups are carried through the collapse and seams and UV islands are kept.
+    # Returns (chunks, error) per level, error being the furthest a vertex of the full mesh is from
+    # the level, in world units
+    def extract_lods(self, obj, chunks, levelCount, hasDeforms, palette, boundsPrecision, y_is_up, boneSegments=None):
+        levels = []
+        if not levelCount:
+            return levels
+        
+        verts = array.array('f')
+        for chunk in chunks:
+            verts.extend(chunk.verts)
+        
+        error = 0.0
+        for level in range(1, levelCount + 1):
+            bpy.ops.object.mode_set(mode='OBJECT')
+            decimate = obj.modifiers.new('EXPORT_LOD', 'DECIMATE')
+            decimate.decimate_type = 'COLLAPSE'
+            decimate.ratio = self.lod_ratio ** level
+            decimate.use_collapse_triangulate = True
+            decimate.delimit = {'SEAM', 'UV'}
+            bpy.ops.object.modifier_move_to_index(modifier=decimate.name, index=0)
+            
+            lod = SubmeshExport('{}_lod{}'.format(obj.name, level), self.weld_tolerance)
+            if hasDeforms:
+                lod.vertexGroups = [g.name for g in obj.vertex_groups]
+            
+            try:
+                with profile.stage('extract'):
+                    self.extract(obj, bpy.context.evaluated_depsgraph_get(), lod, hasDeforms, y_is_up)
+            finally:
+                bpy.ops.object.mode_set(mode='OBJECT')
+                obj.modifiers.remove(decimate)
+            
+            lodChunks = self.finish_submesh(lod, palette, boundsPrecision, boneSegments)
+            
+            # a coarser level is never more accurate than the one before
+            with profile.stage('deviation'):
+                error = max(error, lodDeviation(verts, [c.verts for c in lodChunks]))
+            print('{} LOD {}: {} triangle(s), error {:.5f}'.format(obj.name, level, sum(len(c.indices) for c in lodChunks) // 3, error))
+            levels.append((lodChunks, error))
+            
+        return levels
+    
+    # Writes the chunks of one object to a file of its own
+    def write_separate(self, path, name, chunks, precision, extra=None):
+        # Chunks of one object go in the same file so they are drawn together
+        assetType = 'MESH' if len(chunks) > 1 else 'SUBMESH'
+        
+        if self.output_format == 'BINARY':
+            writeBinaryMesh(path, name, assetType, chunks, extra)
+        elif len(chunks) > 1 or extra:
+            writer = MeshStreamWriter(path, name, precision)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close(extra)
+        else:
+            chunks[0].type = assetType
+            f = open(path, 'w')
+            f.write(submeshToJson(chunks[0], precision))
+            f.close()
+            written_files.append(path)
+        return
+
+    # Walks every loop of the triangulated bmesh in Python. Slow, but works without NumPy
+    def extract_bmesh(self, obj, depsgraph, submeshExport, hasDeforms):
+        bm = bmesh.new()
+        with profile.stage('from_object'):
+            bm.from_object( obj, depsgraph )
+
+        # layers should work properly
+        bm.verts.ensure_lookup_table()
+        
+        # We need triangles! Not even optional.
+        with profile.stage('triangulate'):
+            bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method='BEAUTY', ngon_method='BEAUTY')
+        uv = bm.loops.layers.uv.active
+
+        if hasDeforms:
+            bm.verts.layers.deform.verify()
+            deform = bm.verts.layers.deform.active
+        
+            if not deform:
+                self.report({'WARNING'}, '{} has armature modifier but no vertex weights'.format(obj.name))
+                hasDeforms = False
+
+        # Welding happens as each corner is appended, so it is timed call by call
+        timeWelds = profile.enabled
+        weldSeconds = 0.0
+        start = time.perf_counter()
+        
+        # Go every face in the now-triangulated mesh and gather properties per vertex
+        for face in bm.faces:
+            for loop in face.loops:
+                # transform vertex to world transform for this object
+                vert_pos = (obj.matrix_world @ loop.vert.co)
+                
+                # Get bone deforms that actually influence this vertex, let engine decide what to keep
+                weight = []
+                
+                if(hasDeforms):
+                    deforms = loop.vert[deform].items()
+                    for g, w in deforms:
+                        if(w > 1e-09):
+                            weight.append(g)
+                            weight.append(w)
+                            
+                # UV is attached to the loop
+                if uv:
+                    uv_coord = loop[uv].uv
+                    if math.isnan(uv_coord.x) or math.isnan(uv_coord.y):
+                        # assume this is a bad vertex and don't even output it
+                        continue
+                else:
+                    uv_coord = None
+                    
+                # Normals have to be computed at each point
+                normal = loop.calc_normal()
+
+                if timeWelds:
+                    t = time.perf_counter()
+                    submeshExport.append(vert_pos, uv1=uv_coord, weight1=weight, norm1=normal)
+                    weldSeconds += time.perf_counter() - t
+                else:
+                    submeshExport.append(vert_pos, uv1=uv_coord, weight1=weight, norm1=normal)
+        
+        profile.record('loops', time.perf_counter() - start - weldSeconds)
+        profile.record('weld', weldSeconds)
+        
+        # release extra mesh data from memory
+        bm.free()
+        return
+    
+    # Reads the evaluated mesh's loop triangles with foreach_get and does the
+    # transform, axis swap, UV filtering and welding as batched array operations
+    def extract_vectorized(self, obj, depsgraph, submeshExport, hasDeforms, y_is_up):
+        evaluated = obj.evaluated_get(depsgraph)
+        with profile.stage('to_mesh'):
+            mesh = evaluated.to_mesh()
+            mesh.calc_loop_triangles()
+        
+        # Reading and transforming the corners stands in for the loop walk
+        start = time.perf_counter()
+        nTris = len(mesh.loop_triangles)
+        loops = np.empty(nTris * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('loops', loops)
+        corners = np.empty(nTris * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('vertices', corners)
+        
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get('co', co)
+        co = co.reshape(-1, 3)
+        
+        if mesh.uv_layers.active:
+            uvs = np.empty(len(mesh.loops) * 2, dtype=np.float64)
+            mesh.uv_layers.active.data.foreach_get('uv', uvs)
+            uvs = uvs.reshape(-1, 2)[loops]
+        else:
+            uvs = None
+            
+        weights = None
+        if hasDeforms:
+            if not any(len(v.groups) for v in mesh.vertices):
+                self.report({'WARNING'}, '{} has armature modifier but no vertex weights'.format(obj.name))
+            else:
+                # Variable length per vertex so there is no foreach_get for these, but it is per vertex and not per loop
+                weights = [[x for g in v.groups if g.weight > 1e-09 for x in (g.group, g.weight)] for v in mesh.vertices]
+        
+        evaluated.to_mesh_clear()
+        
+        # Triangles with bad UVs are dropped entirely
+        if uvs is not None:
+            valid = ~np.isnan(uvs).reshape(-1, 6).any(axis=1)
+            if not valid.all():
+                keep = np.repeat(valid, 3)
+                corners = corners[keep]
+                uvs = uvs[keep]
+        
+        # Flat normals of each triangle in object space, same as BMLoop.calc_normal on triangles
+        tri = co[corners].reshape(-1, 3, 3)
+        norms = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        lengths = np.linalg.norm(norms, axis=1, keepdims=True)
+        norms = np.repeat(np.divide(norms, lengths, out=np.zeros_like(norms), where=lengths > 0), 3, axis=0)
+        
+        # transform vertices to world transform for this object
+        matrix = np.array(obj.matrix_world)
+        positions = co[corners] @ matrix[:3, :3].T + matrix[:3, 3]
+        profile.record('loops', time.perf_counter() - start)
+        
+        with profile.stage('weld'):
+            submeshExport.assign(positions, uvs, norms, corners, weights, y_is_up)
+        return
+
     def execute(self, context):
         return self.write_json(context, self.filepath, self.y_is_up)
 
@@ -350,5 +1144,8 @@ def unregister():
 if __name__ == "__main__":
     register()
 
-# test call
-bpy.ops.export_json_test.invoke('INVOKE_DEFAULT')
+    if bpy.app.background:
+        sys.exit(run_headless(__file__, bpy.ops.export_json.mesh, written_files))
+    else:
+        # test call
+        bpy.ops.export_json.mesh('INVOKE_DEFAULT')
@@ -0,0 +1,102 @@
+# Stage timings and counts of an export, written as a JSON report next to the exported file when
+# the exporters run with export_report on. Shared by export_mesh_json.py and export_armature_json.py
+import contextlib
+import json
+import os
+import time
+
+# Path of the export report written next to an exported file
+def report_path(filepath):
+    root, ext = os.path.splitext(filepath)
+    return '{}_report{}'.format(root, ext)
+
+# Times the stages of an export and counts what it produced, per entry (object or action) and in
+# total. Stages nest, eg. lods.extract.loops is the loop walk of a level of detail
+class ExportProfile:
+    def __init__(self):
+        self.reset(False)
+        return
+
+    def reset(self, enabled):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.entries = []
+        self.entry = None
+        self.seconds = {}
+        self.counts = {}
+        self._stages = []
+        return
+
+    # Stages and counts from here on also go to the named entry, until end()
+    def begin(self, name):
+        self.entry = {'name': name, 'seconds': {}, 'counts': {}}
+        if self.enabled:
+            self.entries.append(self.entry)
+        return
+
+    def end(self):
+        self.entry = None
+        return
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        self._stages.append(name)
+        try:
+            yield
+        finally:
+            self._stages.pop()
+            self.record(name, time.perf_counter() - start)
+
+    # Adds time measured by the caller to a stage nested in the current one
+    def record(self, name, elapsed):
+        if not self.enabled:
+            return
+
+        key = '.'.join(self._stages + [name])
+        for seconds in (self.seconds, self.entry['seconds'] if self.entry else None):
+            if seconds is not None:
+                seconds[key] = seconds.get(key, 0.0) + elapsed
+        return
+
+    def count(self, name, n):
+        if not self.enabled:
+            return
+        for counts in (self.counts, self.entry['counts'] if self.entry else None):
+            if counts is not None:
+                counts[name] = counts.get(name, 0) + n
+        return
+
+    # files are listed relative to root, the folder the report is written to, and the entries
+    # under entries_key, eg. 'objects' or 'actions'
+    def report(self, name, files, root, entries_key):
+        return {
+            'name': name,
+            'type': 'EXPORT_REPORT',
+            'seconds': round(time.perf_counter() - self.started, 6),
+            'stages': {k: round(v, 6) for k, v in self.seconds.items()},
+            'counts': self.counts,
+            'files': [{'path': os.path.relpath(path, root).replace(os.sep, '/'), 'bytes': os.path.getsize(path)}
+                      for path in files if os.path.exists(path)],
+            entries_key: [dict(e, seconds={k: round(v, 6) for k, v in e['seconds'].items()}) for e in self.entries]
+        }
+
+    # Writes the report, with the bytes of every file written, and prints the slowest stages
+    def write(self, filepath, name, files, entries_key):
+        report = self.report(name, files, os.path.dirname(filepath), entries_key)
+        report['counts']['bytes'] = sum(f['bytes'] for f in report['files'])
+
+        with open(filepath, 'w') as f:
+            f.write(json.dumps(report, indent=1))
+
+        slowest = sorted(report['stages'].items(), key=lambda s: -s[1])[:5]
+        print('Export took {:.2f}s, slowest stages: {}'.format(report['seconds'], ', '.join('{} {:.2f}s'.format(*s) for s in slowest)))
+        print('Wrote export report to {}'.format(filepath))
+        return report
+
+# Profile of the current export, only recording when the export report is on
+profile = ExportProfile()
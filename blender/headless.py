@@ -0,0 +1,41 @@
+# Command line of the exporters when Blender runs them in background mode, eg. from batch_export.py:
+#   blender -b file.blend --python export_mesh_json.py -- --output out.json --option y_is_up=true
+# Shared by export_mesh_json.py and export_armature_json.py, does not need bpy itself
+import argparse
+import json
+import os
+import sys
+
+# Exporter properties given as NAME=VALUE, values parsed as JSON if possible
+def parse_options(options):
+    parsed = {}
+    for option in options:
+        name, _, value = option.partition('=')
+        try:
+            parsed[name] = json.loads(value)
+        except ValueError:
+            parsed[name] = value
+    return parsed
+
+# Runs an export operator (eg. bpy.ops.export_json.mesh) on the arguments after '--' and reports
+# the files it wrote, collected in written, to --record. Returns the process exit code
+def run_headless(script, operator, written, argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(script))
+    parser.add_argument('--output', required=True, help='File to export to')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='Exporter property, value parsed as JSON if possible')
+    parser.add_argument('--record', help='Writes the list of exported files to this JSON file')
+    args = parser.parse_args(argv)
+
+    del written[:]
+    result = operator('EXEC_DEFAULT', filepath=os.path.abspath(args.output), **parse_options(args.option))
+
+    if args.record:
+        f = open(args.record, 'w')
+        f.write(json.dumps(written))
+        f.close()
+
+    return 0 if 'FINISHED' in result else 1
@@ -0,0 +1,834 @@
+# The part of the mesh exporter that does not need Blender: welding, flattening and axis conversion
+# of the extracted vertices, cache optimization, splitting, bounds and the JSON / binary writers.
+# export_mesh_json.py reads the meshes out of Blender and hands them to it; benchmark_export.py
+# runs it on generated meshes. Only needs NumPy for SubmeshExport.assign.
+import struct
+import json
+import os
+import sys
+import math
+import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from export_common import format_floats, written_files
+
+# Serializes the public attributes of export objects, skipping working state like the weld index
+def publicAttributes(o):
+    attributes = {}
+    for k in getattr(o, '__slots__', None) or o.__dict__:
+        if k.startswith('_') or not hasattr(o, k):
+            continue
+        
+        v = getattr(o, k)
+        attributes[k] = v.tolist() if isinstance(v, array.array) else v
+    return attributes
+
+class MeshExport:
+    __slots__ = ('name', 'type', 'submeshes')
+    
+    def __init__(self, name):
+        self.name = name
+        self.type = 'MESH'
+        self.submeshes = []
+        return
+    
+    def toJson(self):
+        return json.dumps(self, default=publicAttributes)
+    
+# Pairs of rows of values ([position, uv, normal] per row) that are all within tol of each other,
+# as (i, [lower rows]) in increasing i. Rows are bucketed by their position on a grid of cells the
+# size of tol, anything within tolerance is in the same or a neighbouring cell. Cells are hashed
+# into one integer, collisions only add candidates that the tolerance check drops again
+def weldCandidates(values, tol):
+    cells = np.floor(values[:, :3] / tol).astype(np.int64)
+    
+    def cellHash(c):
+        return c[:, 0] * 73856093 ^ c[:, 1] * 19349663 ^ c[:, 2] * 83492791
+    
+    hashes = cellHash(cells)
+    order = np.argsort(hashes, kind='stable')
+    sortedHashes = hashes[order]
+    
+    # half of the neighbourhood is enough, every pair is found from one of its ends
+    offsets = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1) if (x, y, z) >= (0, 0, 0)]
+    pairs = []
+    for offset in offsets:
+        neighbours = cellHash(cells + np.array(offset, dtype=np.int64))
+        lo = np.searchsorted(sortedHashes, neighbours, 'left')
+        counts = np.searchsorted(sortedHashes, neighbours, 'right') - lo
+        
+        a = np.repeat(np.arange(len(values)), counts)
+        b = order[np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        close = (a != b) & (np.abs(values[a] - values[b]) <= tol).all(axis=1)
+        pairs.append(np.stack([np.maximum(a, b)[close], np.minimum(a, b)[close]], axis=1))
+    
+    pairs = np.unique(np.concatenate(pairs), axis=0)
+    if not len(pairs):
+        return
+    
+    for group in np.split(pairs, np.flatnonzero(np.diff(pairs[:, 0])) + 1):
+        yield int(group[0, 0]), group[:, 1].tolist()
+
+# Vertex data is kept flattened in typed arrays (float32 like the runtime) rather than as lists of
+# Vectors, and __slots__ keeps the per-object overhead down. Optional attributes like the chunk
+# and influence data are only serialized once they are set
+class SubmeshExport:
+    __slots__ = ('name', 'type', 'verts', 'uvs', 'norms', 'indices', 'weights', 'vertexGroups',
+                 'chunkOf', 'chunk', 'influences', 'boneGroups', 'boneWeights', 'bounds', 'tile', 'bake',
+                 '_weldTolerance', '_weldGrid', '_hasUVs', '_hasNorms')
+    
+    def __init__(self, name, weld_tolerance=1e-09):
+        self.name = name
+        self.verts = array.array('f')
+        self.uvs = array.array('f')
+        self.norms = array.array('f')
+        self.indices = array.array('I')
+        
+        # weights are a list of values:
+        # Bone, Weight, Bone, Weight, Bone, Weight, Bone, Weight...
+        self.weights = []
+        self.vertexGroups = []
+        
+        # Welding index: vertex positions are bucketed into a grid with cells
+        # the size of the tolerance so that each append only has to look at
+        # neighbouring cells instead of every vertex in the submesh
+        self._weldTolerance = weld_tolerance
+        self._weldGrid = {}
+        self._hasUVs = False
+        self._hasNorms = False
+        return
+    
+    def _weldCell(self, v):
+        if self._weldTolerance <= 0:
+            return tuple(v)
+        
+        return (math.floor(v[0] / self._weldTolerance),
+                math.floor(v[1] / self._weldTolerance),
+                math.floor(v[2] / self._weldTolerance))
+    
+    def _weldCandidates(self, cell):
+        if self._weldTolerance <= 0:
+            return self._weldGrid.get(cell, ())
+        
+        # Anything within tolerance is at most one cell away on each axis
+        cx, cy, cz = cell
+        candidates = []
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                for z in (cz - 1, cz, cz + 1):
+                    bucket = self._weldGrid.get((x, y, z))
+                    if bucket:
+                        candidates.extend(bucket)
+                        
+        return candidates
+    
+    def append(self, v1, uv1=None, norm1=None, weight1=None):
+        index = -1
+        tol = self._weldTolerance
+        verts, uvs, norms = self.verts, self.uvs, self.norms
+        
+        # compare at the precision the values are stored with
+        # (anything indexable will do, mathutils Vectors or tuples)
+        v1 = array.array('f', v1[:3])
+        uv1 = array.array('f', uv1[:2]) if uv1 is not None else None
+        norm1 = array.array('f', norm1[:3]) if norm1 is not None else None
+        cell = self._weldCell(v1)
+        
+        # compare vertices by seeing if distance is within a very small number away
+        # For most rendering APIs we will need redundant verts if positions are same
+        # but UVs are different. The lowest matching index wins, same as a linear scan
+        for i in self._weldCandidates(cell):
+            if index != -1 and i > index:
+                continue
+            
+            v_match = abs(verts[i * 3] - v1[0]) <= tol and abs(verts[i * 3 + 1] - v1[1]) <= tol and abs(verts[i * 3 + 2] - v1[2]) <= tol
+            
+            if not uv1:
+                uv_match = True
+            else:
+                uv_match = abs(uvs[i * 2] - uv1[0]) <= tol and abs(uvs[i * 2 + 1] - uv1[1]) <= tol
+                
+            if not norm1:
+                norm_match = True
+            else:
+                norm_match = abs(norms[i * 3] - norm1[0]) <= tol and abs(norms[i * 3 + 1] - norm1[1]) <= tol and abs(norms[i * 3 + 2] - norm1[2]) <= tol
+                
+            if v_match and uv_match and norm_match:
+                index = i
+        
+        # no match found, add new entry
+        if(index == -1):
+            index = len(verts) // 3
+            verts.extend(v1)
+            
+            if norm1:
+                norms.extend(norm1)
+                self._hasNorms = True
+            else:
+                norms.extend((0.0, 0.0, 0.0))
+            
+            if uv1:
+                uvs.extend(uv1)
+                self._hasUVs = True
+            else:
+                uvs.extend((0.0, 0.0))
+                
+            self.weights.append(weight1)
+            self._weldGrid.setdefault(cell, []).append(index)
+            
+        self.indices.append(index)
+        return
+                
+    # Finish the vertex data: convert axes and drop attributes that no vertex had
+    def build(self, y_is_up):
+        if(y_is_up):
+            for values in (self.verts, self.norms):
+                for i in range(0, len(values), 3):
+                    values[i + 1], values[i + 2] = values[i + 2], -values[i + 1]
+        
+        if not self._hasUVs:
+            self.uvs = array.array('f')
+        if not self._hasNorms:
+            self.norms = array.array('f')
+        
+        # Welding is done, release the index
+        self._weldGrid = {}
+        return
+    
+    # Fills in already flattened data from per-corner arrays (3 corners per triangle), welding in
+    # batches with the same result as appending every corner: exact duplicates are merged first,
+    # then the distinct values are welded to the lowest earlier vertex within tolerance, looking
+    # at the neighbouring cells of the tolerance grid like append does
+    def assign(self, positions, uvs, norms, corners, weights, y_is_up):
+        tol = self._weldTolerance
+        
+        # compare at the precision the values are stored with
+        keys = np.hstack([positions, norms] if uvs is None else [positions, uvs, norms]).astype(np.float32)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        distinct = first[order]
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        inverse = rank[inverse.reshape(-1)]
+        
+        # distinct value each one is welded to, themselves unless a lower one is within tolerance
+        target = np.arange(len(distinct))
+        if tol > 0:
+            values = keys[distinct].astype(np.float64)
+            for i, candidates in weldCandidates(values, tol):
+                matches = [j for j in candidates if target[j] == j]
+                if matches:
+                    target[i] = min(matches)
+        
+        kept = np.flatnonzero(target == np.arange(len(distinct)))
+        renumber = np.empty(len(distinct), dtype=np.int64)
+        renumber[kept] = np.arange(len(kept))
+        unique = distinct[kept]
+        self.indices = array.array('I', renumber[target[inverse]].astype(np.uint32).tobytes())
+        
+        positions = positions[unique]
+        norms = norms[unique]
+        if y_is_up:
+            positions = positions[:, [0, 2, 1]] * (1, 1, -1)
+            norms = norms[:, [0, 2, 1]] * (1, 1, -1)
+            
+        self.verts = array.array('f', positions.astype(np.float32).tobytes())
+        self.norms = array.array('f', norms.astype(np.float32).tobytes())
+        
+        if uvs is not None:
+            self.uvs = array.array('f', uvs[unique].astype(np.float32).tobytes())
+        
+        if weights is None:
+            self.weights = [[] for _ in unique]
+        else:
+            self.weights = [weights[corners[i]] for i in unique]
+        return
+    
+    # Reorders the flattened triangles for the post-transform cache, then the vertices for fetch
+    # Returns the ACMR/ATVR before and after
+    def optimize(self):
+        nVertices = len(self.verts) // 3
+        
+        # The loaders draw indices back to front, so optimize the order they are actually drawn in
+        drawn = self.indices[::-1]
+        before = simulateVertexCache(drawn, nVertices)
+        
+        drawn = optimizeVertexCache(drawn, nVertices)
+        drawn, order = optimizeVertexFetch(drawn, nVertices)
+        after = simulateVertexCache(drawn, len(order))
+        
+        self.indices = array.array('I', drawn[::-1])
+        self.verts = array.array('f', (x for v in order for x in self.verts[v * 3:v * 3 + 3]))
+        if self.uvs:
+            self.uvs = array.array('f', (x for v in order for x in self.uvs[v * 2:v * 2 + 2]))
+        if self.norms:
+            self.norms = array.array('f', (x for v in order for x in self.norms[v * 3:v * 3 + 3]))
+        if self.weights:
+            self.weights = [self.weights[v] for v in order]
+        
+        return before, after
+    
+    # Splits the flattened submesh into ordered chunks that each fit in maxVertices so that
+    # their local indices stay within 16 bits. Returns [self] if it already fits
+    def split(self, maxVertices, sortByLocality=False):
+        nVertices = len(self.verts) // 3
+        if nVertices <= maxVertices:
+            return [self]
+        
+        # Work in draw order (back to front) so chunks are drawn in sequence
+        drawn = self.indices[::-1]
+        tris = [drawn[t * 3:t * 3 + 3] for t in range(len(drawn) // 3)]
+        
+        # Without the cache optimizer the triangles are in face order, group them spatially instead
+        if sortByLocality:
+            lo = [min(self.verts[a::3]) for a in range(3)]
+            hi = [max(self.verts[a::3]) for a in range(3)]
+            tris.sort(key=lambda tri: mortonCode([sum(self.verts[v * 3 + a] for v in tri) / 3 for a in range(3)], lo, hi))
+        
+        chunks = []
+        for tri in tris:
+            newVerts = len(set(v for v in tri if not chunks or v not in chunks[-1][0]))
+            if not chunks or len(chunks[-1][0]) + newVerts > maxVertices:
+                chunks.append(({}, []))
+                
+            remap, chunkDrawn = chunks[-1]
+            for v in tri:
+                if v not in remap:
+                    remap[v] = len(remap)
+                chunkDrawn.append(remap[v])
+        
+        result = []
+        for i, (remap, chunkDrawn) in enumerate(chunks):
+            chunk = SubmeshExport('{}_{}'.format(self.name, i), self._weldTolerance)
+            chunk.chunkOf = self.name
+            chunk.chunk = [i, len(chunks)]
+            chunk.vertexGroups = self.vertexGroups
+            
+            order = list(remap)
+            chunk.indices = array.array('I', chunkDrawn[::-1])
+            chunk.verts = array.array('f', (x for v in order for x in self.verts[v * 3:v * 3 + 3]))
+            chunk.uvs = array.array('f', (x for v in order for x in self.uvs[v * 2:v * 2 + 2]))
+            chunk.norms = array.array('f', (x for v in order for x in self.norms[v * 3:v * 3 + 3]))
+            chunk.weights = [self.weights[v] for v in order] if self.weights else []
+            result.append(chunk)
+            
+        return result
+    
+    # Replaces the variable length [group, weight, ...] lists with fixed width boneGroups/boneWeights,
+    # maxInfluences per vertex. Groups are remapped to the armature's deform bone palette and
+    # weights are quantized to bytes that sum to 255. Vertices left without any deform influence
+    # would collapse to the origin, they follow the nearest of boneSegments, (head, tail) of each
+    # palette bone in the same space as the vertices, instead. Returns how many vertices did
+    def limitInfluences(self, palette, maxInfluences, boneSegments=None):
+        paletteIndex = {name: i for i, name in enumerate(palette)}
+        groupRemap = [paletteIndex.get(name, -1) for name in self.vertexGroups]
+        
+        self.influences = maxInfluences
+        self.boneGroups = array.array('B')
+        self.boneWeights = array.array('B')
+        unweighted = 0
+        
+        for k, weights in enumerate(self.weights):
+            influences = []
+            for g, w in zip(weights[0::2], weights[1::2]):
+                # vertex groups that are not deform bones do not affect skinning
+                if groupRemap[g] >= 0:
+                    influences.append((w, groupRemap[g]))
+            
+            if not any(w > 0 for w, _ in influences):
+                unweighted += 1
+                if boneSegments:
+                    influences = [(1.0, nearestSegment(self.verts[k * 3:k * 3 + 3], boneSegments))]
+                    
+            influences.sort(reverse=True)
+            groups, amounts = quantizeInfluences(influences[:maxInfluences], maxInfluences)
+            self.boneGroups.extend(groups)
+            self.boneWeights.extend(amounts)
+        
+        self.weights = []
+        self.vertexGroups = list(palette)
+        return unweighted
+    
+    # Moves every vertex by offset, eg. into tile local space
+    def translate(self, offset):
+        verts = self.verts
+        for i in range(0, len(verts), 3):
+            verts[i] += offset[0]
+            verts[i + 1] += offset[1]
+            verts[i + 2] += offset[2]
+        return
+    
+    # Axis aligned box and bounding sphere of the final (axis converted) vertices, rounded outwards
+    # so they still hold the vertices once those are written at the given precision
+    def computeBounds(self, precision=-1):
+        verts = self.verts
+        if not verts:
+            return
+        
+        lo, hi = roundBounds([min(verts[a::3]) for a in range(3)], [max(verts[a::3]) for a in range(3)], precision)
+        center = [(l + h) / 2 for l, h in zip(lo, hi)]
+        if precision >= 0:
+            center = [round(c, precision + 1) for c in center]
+        radius = math.sqrt(max((verts[i] - center[0]) ** 2 + (verts[i + 1] - center[1]) ** 2 + (verts[i + 2] - center[2]) ** 2
+                               for i in range(0, len(verts), 3)))
+        
+        # rounding moves a vertex less than one unit of the last decimal place
+        if precision >= 0:
+            radius = math.ceil(radius * 10 ** precision) / 10 ** precision + 10 ** -precision
+        
+        self.bounds = {'min': lo, 'max': hi, 'center': center, 'radius': radius}
+        return
+    
+    # Drops the vertex data once it has been written
+    def release(self):
+        self.verts = self.uvs = self.norms = array.array('f')
+        self.indices = array.array('I')
+        self.weights = []
+        if hasattr(self, 'boneWeights'):
+            self.boneGroups = self.boneWeights = array.array('B')
+        if hasattr(self, 'bake'):
+            self.bake = array.array('B')
+        return
+    
+    def toJson(self):
+        return json.dumps(self, default=publicAttributes)
+
+# Path of the gameplay geometry written next to the mesh
+def collisionPath(filepath):
+    root, ext = os.path.splitext(filepath)
+    return '{}_collision{}'.format(root, ext)
+
+# Splits polygons (lists of vertex indices) into the loose parts they make up, polygons sharing a
+# vertex being in the same part. Returns each part as (its vertex indices, its polygons indexing them)
+def looseParts(polygons):
+    parent = {}
+    
+    def find(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+    
+    for polygon in polygons:
+        for v in polygon:
+            parent.setdefault(v, v)
+        root = find(polygon[0])
+        for v in polygon[1:]:
+            parent[find(v)] = root
+    
+    parts = {}
+    for polygon in polygons:
+        parts.setdefault(find(polygon[0]), []).append(polygon)
+    
+    result = []
+    for partPolygons in parts.values():
+        vertices = sorted(set(v for polygon in partPolygons for v in polygon))
+        local = {v: i for i, v in enumerate(vertices)}
+        result.append((vertices, [[local[v] for v in polygon] for polygon in partPolygons]))
+    return result
+
+# Rounds the corners of a box outwards to a number of decimal places, or keeps them if negative
+def roundBounds(lo, hi, precision):
+    if precision < 0:
+        return [float(v) for v in lo], [float(v) for v in hi]
+    
+    scale = 10 ** precision
+    return ([round(math.floor(v * scale) / scale, precision) for v in lo],
+            [round(math.ceil(v * scale) / scale, precision) for v in hi])
+
+# Bounding volume hierarchy over the triangles of every submesh of a static export, so the runtime
+# can cull and raycast against level geometry without testing every triangle
+#   nodes:     min x, y, z, max x, y, z, first, count per node, depth first. Leaves (count > 0) hold
+#              triangles[first:first + count], otherwise the children are the next node and node first
+#   triangles: submesh, triangle pairs, the triangle being indices[t * 3:t * 3 + 3] of that submesh.
+#              With reversedIndices, for writeBinaryMesh which stores each index buffer back to front,
+#              t is the triangle at that place in the .bin buffer, corners in the order stored there
+class TriangleIndex:
+    def __init__(self, leafSize=8, reversedIndices=False):
+        self.leafSize = leafSize
+        self.reversedIndices = reversedIndices
+        self.triangles = []
+        self.boxes = []
+        return
+    
+    # Triangle bounds are gathered as submeshes are finished so they can still be released
+    def add(self, submeshIndex, submesh):
+        verts, indices = submesh.verts, submesh.indices
+        nTriangles = len(indices) // 3
+        for t in range(nTriangles):
+            corners = [indices[t * 3 + c] * 3 for c in range(3)]
+            self.triangles.append((submeshIndex, nTriangles - 1 - t if self.reversedIndices else t))
+            self.boxes.append(([min(verts[v + a] for v in corners) for a in range(3)],
+                               [max(verts[v + a] for v in corners) for a in range(3)]))
+        return
+    
+    def build(self, precision=-1):
+        if not self.triangles:
+            return None
+        
+        nodes = []
+        order = []
+        boxes = self.boxes
+        
+        def buildNode(tris):
+            lo, hi = roundBounds([min(boxes[t][0][a] for t in tris) for a in range(3)],
+                                 [max(boxes[t][1][a] for t in tris) for a in range(3)], precision)
+            node = len(nodes)
+            nodes.extend(lo + hi + [len(order), 0])
+            
+            if len(tris) <= self.leafSize:
+                nodes[node + 7] = len(tris)
+                order.extend(tris)
+                return
+            
+            # Median split of the centroids along the longest axis
+            axis = max(range(3), key=lambda a: hi[a] - lo[a])
+            tris.sort(key=lambda t: boxes[t][0][axis] + boxes[t][1][axis])
+            middle = len(tris) // 2
+            
+            buildNode(tris[:middle])
+            nodes[node + 6] = len(nodes) // 8
+            buildNode(tris[middle:])
+            return
+        
+        buildNode(list(range(len(self.triangles))))
+        
+        return {
+            'leafSize': self.leafSize,
+            'nodes': nodes,
+            'triangles': [x for t in order for x in self.triangles[t]]
+        }
+
+# Path of the file holding a level of detail, next to the full mesh
+def lodPath(filepath, level):
+    root, ext = os.path.splitext(filepath)
+    return '{}_lod{}{}'.format(root, level, ext)
+
+# The "lods" field of a mesh: its levels of detail, finest first, relative to the mesh file
+def lodList(filepath, errors):
+    return [{'src': os.path.basename(lodPath(filepath, level)), 'error': error} for level, error in enumerate(errors, 1)]
+
+# Serializes a submesh to JSON text with the precision configured for each attribute
+# precision maps attribute names to decimal places, eg. {'verts': 5, 'uvs': 5, ...}
+def submeshToJson(submesh, precision):
+    fields = []
+    for key, value in publicAttributes(submesh).items():
+        if key in precision and key != 'weights':
+            text = '[{}]'.format(format_floats(value, precision[key]))
+        elif key == 'weights':
+            # [group, weight, group, weight, ...] per vertex, only the weights are floats
+            text = '[{}]'.format(', '.join(
+                '[{}]'.format(', '.join(str(int(x)) if i % 2 == 0 else format_floats([x], precision.get('weights', -1)) for i, x in enumerate(w or [])))
+                for w in value))
+        else:
+            text = json.dumps(value)
+        fields.append('{}: {}'.format(json.dumps(key), text))
+        
+    return '{{{}}}'.format(', '.join(fields))
+
+# Writes a MESH document one submesh at a time so that finished submeshes can be released
+class MeshStreamWriter:
+    def __init__(self, filepath, name, precision):
+        self.precision = precision
+        self.count = 0
+        self.file = open(filepath, 'w')
+        self.file.write('{{"name": {}, "type": "MESH", "submeshes": ['.format(json.dumps(name)))
+        written_files.append(filepath)
+        return
+    
+    def write(self, submesh):
+        if self.count:
+            self.file.write(', ')
+        self.file.write(submeshToJson(submesh, self.precision))
+        self.count += 1
+        return
+    
+    # extra holds document level fields only known at the end, like the BVH
+    def close(self, extra=None):
+        self.file.write(']')
+        for key, value in (extra or {}).items():
+            self.file.write(', {}: {}'.format(json.dumps(key), json.dumps(value)))
+        self.file.write('}')
+        self.file.close()
+        return
+
+# Index of the segment, a (head, tail) pair of points, nearest to a point
+def nearestSegment(p, segments):
+    def distance(segment):
+        head, tail = segment
+        axis = [t - h for h, t in zip(head, tail)]
+        length = sum(a * a for a in axis)
+        t = 0.0 if length == 0 else max(0.0, min(1.0, sum((x - h) * a for x, h, a in zip(p, head, axis)) / length))
+        return sum((x - h - a * t) ** 2 for x, h, a in zip(p, head, axis))
+    
+    return min(range(len(segments)), key=lambda i: distance(segments[i]))
+
+# Quantizes (weight, group) pairs to bytes summing to 255 using largest remainders, padded to width
+def quantizeInfluences(influences, width):
+    total = sum(w for w, _ in influences)
+    if total <= 0:
+        return [0] * width, [0] * width
+    
+    scaled = [w / total * 0xFF for w, _ in influences]
+    amounts = [int(x) for x in scaled]
+    
+    byRemainder = sorted(range(len(scaled)), key=lambda i: amounts[i] - scaled[i])
+    for i in byRemainder[:0xFF - sum(amounts)]:
+        amounts[i] += 1
+        
+    groups = [g for _, g in influences]
+    padding = width - len(influences)
+    return groups + [0] * padding, amounts + [0] * padding
+
+# Interleaves the bits of a position quantized to 10 bits per axis within [lo, hi]
+def mortonCode(p, lo, hi):
+    code = 0
+    q = [int((p[a] - lo[a]) / (hi[a] - lo[a]) * 1023) if hi[a] > lo[a] else 0 for a in range(3)]
+    for bit in range(10):
+        for a in range(3):
+            code |= ((q[a] >> bit) & 1) << (bit * 3 + a)
+    return code
+
+# Tom Forsyth's linear-speed vertex cache optimization. Reorders triangles so that
+# vertices are reused while they are still in the post-transform cache
+FORSYTH_CACHE_SIZE = 32
+
+def forsythVertexScore(cachePos, remaining, cacheSize):
+    if remaining == 0:
+        return -1.0
+        
+    score = 0.0
+    if cachePos >= 0:
+        if cachePos < 3:
+            # the last triangle's vertices are scored flat, no point in favouring one
+            score = 0.75
+        else:
+            score = (1.0 - (cachePos - 3) / (cacheSize - 3)) ** 1.5
+    
+    # Boost vertices with few triangles left so they are finished off
+    return score + 2.0 * remaining ** -0.5
+
+def optimizeVertexCache(indices, nVertices, cacheSize=FORSYTH_CACHE_SIZE):
+    nTris = len(indices) // 3
+    vertexTris = [[] for _ in range(nVertices)]
+    for t in range(nTris):
+        for v in indices[t * 3:t * 3 + 3]:
+            vertexTris[v].append(t)
+    
+    remaining = [len(tris) for tris in vertexTris]
+    cachePos = [-1] * nVertices
+    vertexScore = [forsythVertexScore(-1, remaining[v], cacheSize) for v in range(nVertices)]
+    triScore = [sum(vertexScore[v] for v in indices[t * 3:t * 3 + 3]) for t in range(nTris)]
+    triAdded = [False] * nTris
+    
+    cache = []
+    output = []
+    best = max(range(nTris), key=triScore.__getitem__) if nTris else -1
+    scan = 0
+    
+    for _ in range(nTris):
+        if best < 0:
+            # Nothing in the cache touches a pending triangle, continue from the first one left
+            while triAdded[scan]:
+                scan += 1
+            best = scan
+        
+        tri = indices[best * 3:best * 3 + 3]
+        output.extend(tri)
+        triAdded[best] = True
+        triScore[best] = -1.0
+        
+        for v in tri:
+            remaining[v] -= 1
+            vertexTris[v].remove(best)
+        
+        # Most recently used vertices move to the front, the overflow drops out
+        newCache = list(tri) + [v for v in cache if v not in tri]
+        evicted = newCache[cacheSize:]
+        cache = newCache[:cacheSize]
+        
+        for v in evicted:
+            cachePos[v] = -1
+        for i, v in enumerate(cache):
+            cachePos[v] = i
+        
+        touched = set()
+        for v in cache + evicted:
+            vertexScore[v] = forsythVertexScore(cachePos[v], remaining[v], cacheSize)
+            touched.update(vertexTris[v])
+        
+        best = -1
+        bestScore = -1.0
+        for t in touched:
+            triScore[t] = sum(vertexScore[v] for v in indices[t * 3:t * 3 + 3])
+            if cachePos[indices[t * 3]] >= 0 or cachePos[indices[t * 3 + 1]] >= 0 or cachePos[indices[t * 3 + 2]] >= 0:
+                if triScore[t] > bestScore:
+                    best = t
+                    bestScore = triScore[t]
+    
+    return output
+
+# Renumbers vertices in the order they are first referenced so vertex fetch is sequential
+# returns the remapped indices and the old vertex index for each new one
+def optimizeVertexFetch(indices, nVertices):
+    remap = [-1] * nVertices
+    order = []
+    for v in indices:
+        if remap[v] < 0:
+            remap[v] = len(order)
+            order.append(v)
+            
+    return [remap[v] for v in indices], order
+
+# Average cache miss ratio (transformed vertices per triangle) and average transform to
+# vertex ratio for a FIFO post-transform cache like the ones found in most GPUs
+def simulateVertexCache(indices, nVertices, cacheSize=16):
+    cache = []
+    misses = 0
+    for v in indices:
+        if v not in cache:
+            misses += 1
+            cache.append(v)
+            if len(cache) > cacheSize:
+                cache.pop(0)
+    
+    nTris = max(len(indices) // 3, 1)
+    return misses / nTris, misses / max(nVertices, 1)
+
+# Vertex layouts matching VERTEX_STRIDE_ACTORS / VERTEX_STRIDE_STATIC in mesh-constants.js
+# ACTOR:  3 * float32 POSITION, 4 * uint8 GROUP, 4 * uint8 WEIGHT, 2 * uint16 UV, 4 * int8 NORMAL+PAD (28)
+# STATIC: 3 * float32 POSITION, 2 * uint16 UV, 4 * int8 NORMAL+PAD, 4 * uint8 BAKE (24)
+VERTEX_WEIGHT_AFFECTORS = 4
+actorVertexFormat = struct.Struct('<3f4B4B2H4b')
+staticVertexFormat = struct.Struct('<3f2H4b4B')
+
+# Mirror the float -> normalized integer conversions of BufferWrapper (DataView truncates and wraps)
+def floatAsUint8(v):
+    return int(v * 0xFF) % 0x100
+
+def floatAsUint16(v):
+    return int(v * 0xFFFF) % 0x10000
+
+def floatAsInt8(v):
+    i = int(v * 0x7F) % 0x100
+    return i - 0x100 if i >= 0x80 else i
+
+def isSkinned(submeshes):
+    hasUVs = any(len(s.uvs) for s in submeshes)
+    hasWeights = any(w for s in submeshes for w in s.weights) or any(getattr(s, 'boneWeights', None) for s in submeshes)
+    return hasUVs and hasWeights
+
+def packVertices(submesh, skinned):
+    nVertices = len(submesh.verts) // 3
+    vertexFormat = actorVertexFormat if skinned else staticVertexFormat
+    data = bytearray(nVertices * vertexFormat.size)
+    
+    for k in range(nVertices):
+        pos = submesh.verts[k * 3:k * 3 + 3]
+        
+        if submesh.uvs:
+            uv = (floatAsUint16(submesh.uvs[k * 2]), floatAsUint16(submesh.uvs[k * 2 + 1]))
+        else:
+            uv = (0, 0)
+            
+        if submesh.norms:
+            norm = (floatAsInt8(submesh.norms[k * 3]), floatAsInt8(submesh.norms[k * 3 + 1]), floatAsInt8(submesh.norms[k * 3 + 2]), 0)
+        else:
+            norm = (0, 0, 0, 0)
+        
+        if skinned and hasattr(submesh, 'boneWeights'):
+            # Fixed width influences are already quantized
+            n = submesh.influences
+            groups = submesh.boneGroups[k * n:k * n + VERTEX_WEIGHT_AFFECTORS]
+            amounts = submesh.boneWeights[k * n:k * n + VERTEX_WEIGHT_AFFECTORS]
+            padding = [0] * (VERTEX_WEIGHT_AFFECTORS - len(groups))
+            vertexFormat.pack_into(data, k * vertexFormat.size, *pos, *groups, *padding, *amounts, *padding, *uv, *norm)
+        elif skinned:
+            # Only the first affectors in file order are kept, same as parseActorMeshes
+            weights = (submesh.weights[k] if k < len(submesh.weights) else None) or []
+            groups = [int(weights[g]) if g < len(weights) else 0 for g in range(0, VERTEX_WEIGHT_AFFECTORS * 2, 2)]
+            amounts = [floatAsUint8(weights[g]) if g < len(weights) else 0 for g in range(1, VERTEX_WEIGHT_AFFECTORS * 2, 2)]
+            vertexFormat.pack_into(data, k * vertexFormat.size, *pos, *groups, *amounts, *uv, *norm)
+        else:
+            # Baked light and ambient visibility, unlit and unoccluded without a bake
+            bake = submesh.bake[k * 4:k * 4 + 4] if getattr(submesh, 'bake', None) else (0, 0, 0, 255)
+            vertexFormat.pack_into(data, k * vertexFormat.size, *pos, *uv, *norm, *bake)
+            
+    return data
+
+# Writes a small JSON header to filepath and the interleaved vertex data followed by a Uint16 index
+# buffer to a sibling .bin file, so that the client can upload slices of it directly to the VBO/IBO
+def writeBinaryMesh(filepath, name, assetType, submeshes, extra=None):
+    skinned = isSkinned(submeshes)
+    binPath = os.path.splitext(filepath)[0] + '.bin'
+    
+    header = {
+        'name': name,
+        'type': assetType,
+        'format': 'BINARY',
+        'layout': 'ACTOR' if skinned else 'STATIC',
+        'stride': (actorVertexFormat if skinned else staticVertexFormat).size,
+        'src': os.path.basename(binPath),
+        'submeshes': []
+    }
+    
+    vertexData = bytearray()
+    indexData = array.array('H')
+    
+    # Indices are local to each submesh (or chunk), the loaders draw it from its first vertex,
+    # vertexOffset / stride, so only a single submesh has to fit in 16 bits
+    for submesh in submeshes:
+        nVertices = len(submesh.verts) // 3
+        if nVertices > 0x10000:
+            raise ValueError('{}:{} does not fit in 16 bit indices ({} vertices), split it'.format(name, submesh.name, nVertices))
+        
+        submeshHeader = {
+            'name': submesh.name,
+            'vertexCount': nVertices,
+            'vertexOffset': len(vertexData),
+            'indexCount': len(submesh.indices),
+            'indexOffset': len(indexData) * indexData.itemsize,
+            'vertexGroups': submesh.vertexGroups
+        }
+        
+        if hasattr(submesh, 'chunkOf'):
+            submeshHeader['chunkOf'] = submesh.chunkOf
+            submeshHeader['chunk'] = submesh.chunk
+        
+        if hasattr(submesh, 'bounds'):
+            submeshHeader['bounds'] = submesh.bounds
+            
+        if hasattr(submesh, 'tile'):
+            submeshHeader['tile'] = submesh.tile
+            
+        header['submeshes'].append(submeshHeader)
+        
+        vertexData += packVertices(submesh, skinned)
+        
+        # The loaders draw indices back to front
+        indexData.extend(reversed(submesh.indices))
+    
+    if sys.byteorder != 'little':
+        indexData.byteswap()
+        
+    header['vertexBytes'] = len(vertexData)
+    header['indexCount'] = len(indexData)
+    if extra:
+        header.update(extra)
+    
+    f = open(binPath, 'wb')
+    f.write(vertexData)
+    f.write(indexData.tobytes())
+    f.close()
+    
+    f = open(filepath, 'w')
+    f.write(json.dumps(header))
+    f.close()
+    
+    written_files.extend((binPath, filepath))
+    return binPath
+
@@ -0,0 +1,363 @@
+# Packs the diffuse textures of a set of meshes into texture atlases, moves each mesh's UVs into
+# the region its texture landed in and points the materials at the atlas. Every material packed
+# together then shares one texture, so a character and all of its gear draw without a texture switch.
+#
+# Runs inside Blender, which does the image reading and writing:
+#   blender -b --python blender/pack_atlas.py -- --name gear
+# packs every gear def, and to add the player's skin to the same atlas:
+#   blender -b --python blender/pack_atlas.py -- --name gear assets/gear_defs/*.json \
+#       --pair /assets/models/player/head0.json=/assets/materials/human0.json
+#
+# Meshes (with their levels of detail) and materials are rewritten in place. Both remember the
+# region they were moved to (and the material its original image) under "atlas", so packing again
+# starts from the original UVs. Textures whose meshes wrap their UVs outside 0-1 tile and cannot be
+# packed; they are left alone.
+#
+# Every rewritten file is re-recorded in the build manifest, so batch_export.py does not export the
+# mesh again over its packed UVs, and gets a new version in the asset version map for the client.
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+
+import numpy
+
+# Only needed to read and write images, the UV remapping runs anywhere
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+# build_manifest.py lives next to this script (blender -b --python runs it from anywhere)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from build_manifest import BuildManifest, hash_file, update_versions
+
+DEF_FOLDERS = ('gear_defs',)
+
+# Offset of the uint16 UV pair in each binary vertex layout (see packVertices in mesh_core.py)
+BINARY_UV_OFFSETS = {'ACTOR': 20, 'STATIC': 12}
+uvFormat = struct.Struct('<2H')
+
+# Free rectangles of a bin, every placement splits the ones it overlaps (MaxRects, best short side fit)
+class MaxRectsBin:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free = [(0, 0, width, height)]
+        return
+
+    def insert(self, w, h):
+        best = None
+        for x, y, fw, fh in self.free:
+            if w <= fw and h <= fh:
+                fit = (min(fw - w, fh - h), max(fw - w, fh - h))
+                if best is None or fit < best[0]:
+                    best = (fit, x, y)
+
+        if best is None:
+            return None
+
+        _, x, y = best
+        self.split(x, y, w, h)
+        return x, y
+
+    def split(self, x, y, w, h):
+        free = []
+        for fx, fy, fw, fh in self.free:
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                free.append((fx, fy, fw, fh))
+                continue
+
+            # whatever is left of the free rectangle on each side of the placed one
+            if x > fx:
+                free.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                free.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                free.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                free.append((fx, y + h, fw, fy + fh - y - h))
+
+        # drop rectangles contained in others, and duplicates
+        self.free = [a for i, a in enumerate(free)
+                     if not any(contains(b, a) and (a != b or j < i) for j, b in enumerate(free) if j != i)]
+        return
+
+def contains(outer, inner):
+    return (inner[0] >= outer[0] and inner[1] >= outer[1]
+            and inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3])
+
+# Packs rectangles {key: (w, h)} into as few square power of two bins of at most max_size as it
+# can, largest first. Returns [(size, {key: (x, y)})]
+def pack_rects(sizes, max_size):
+    pending = sorted(sizes, key=lambda k: (-max(sizes[k]), -min(sizes[k]), k))
+    for key in pending:
+        if max(sizes[key]) > max_size:
+            raise ValueError('{} ({}x{}) does not fit in a {} atlas'.format(key, *sizes[key], max_size))
+
+    bins = []
+    while pending:
+        # smallest size that could hold everything left, grown until it does or the limit is hit
+        area = sum(sizes[k][0] * sizes[k][1] for k in pending)
+        size = 1
+        while size * size < area or size < max(max(sizes[k]) for k in pending):
+            size *= 2
+        size = min(size, max_size)
+
+        while True:
+            rects = MaxRectsBin(size, size)
+            placed = {}
+            for key in pending:
+                position = rects.insert(*sizes[key])
+                if position:
+                    placed[key] = position
+            if len(placed) == len(pending) or size >= max_size:
+                break
+            size *= 2
+
+        bins.append((size, placed))
+        pending = [k for k in pending if k not in placed]
+
+    return bins
+
+# Moves UVs into the region [u0, v0, u1, v1], undoing the region of a previous pack first
+def remap_uv(u, v, region, previous=None):
+    if previous:
+        u = (u - previous[0]) / (previous[2] - previous[0])
+        v = (v - previous[1]) / (previous[3] - previous[1])
+    return region[0] + u * (region[2] - region[0]), region[1] + v * (region[3] - region[1])
+
+class AtlasPacker:
+    def __init__(self, root, max_size, padding):
+        # root is the folder the web server serves, ie. the one containing assets/
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.padding = padding
+
+        # absolute paths of every file written, for the manifest and the version map
+        self.written = []
+        return
+
+    def file_path(self, web_path):
+        return os.path.join(self.root, *web_path.lstrip('/').split('/'))
+
+    def load_json(self, web_path):
+        with open(self.file_path(web_path)) as f:
+            return json.load(f)
+
+    def save_json(self, web_path, asset):
+        with open(self.file_path(web_path), 'w') as f:
+            json.dump(asset, f)
+        self.written.append(self.file_path(web_path))
+        return
+
+    # Original image of a material, even if it already points at an atlas
+    def source_image(self, material):
+        atlas = material.get('atlas')
+        return atlas['source'] if atlas else material['textures']['diffuse']['src']
+
+    # Current UVs of a mesh, as (u, v) pairs, from its JSON or its .bin
+    def mesh_uvs(self, mesh_path):
+        mesh = self.load_json(mesh_path)
+        if mesh.get('format') == 'BINARY':
+            data = self.load_binary(mesh_path, mesh)
+            offset = BINARY_UV_OFFSETS[mesh['layout']]
+            for start in range(0, mesh['vertexBytes'], mesh['stride']):
+                u, v = uvFormat.unpack_from(data, start + offset)
+                yield u / 0xFFFF, v / 0xFFFF
+            return
+
+        for submesh in mesh.get('submeshes') or [mesh]:
+            uvs = submesh.get('uvs') or []
+            for i in range(0, len(uvs) - 1, 2):
+                yield uvs[i], uvs[i + 1]
+
+    def binary_path(self, mesh_path, mesh):
+        return '{}/{}'.format(mesh_path.rsplit('/', 1)[0], mesh['src'])
+
+    def load_binary(self, mesh_path, mesh):
+        with open(self.file_path(self.binary_path(mesh_path, mesh)), 'rb') as f:
+            return bytearray(f.read())
+
+    # Moves the UVs of a mesh and of each of its levels of detail into region
+    def remap_mesh(self, mesh_path, material_name, region):
+        mesh = self.load_json(mesh_path)
+        previous = mesh['atlas']['region'] if mesh.get('atlas') else None
+
+        if mesh.get('format') == 'BINARY':
+            data = self.load_binary(mesh_path, mesh)
+            offset = BINARY_UV_OFFSETS[mesh['layout']]
+            for start in range(0, mesh['vertexBytes'], mesh['stride']):
+                u, v = uvFormat.unpack_from(data, start + offset)
+                u, v = remap_uv(u / 0xFFFF, v / 0xFFFF, region, previous)
+                uvFormat.pack_into(data, start + offset, *(min(0xFFFF, max(0, round(x * 0xFFFF))) for x in (u, v)))
+            with open(self.file_path(self.binary_path(mesh_path, mesh)), 'wb') as f:
+                f.write(data)
+            self.written.append(self.file_path(self.binary_path(mesh_path, mesh)))
+        else:
+            for submesh in mesh.get('submeshes') or [mesh]:
+                uvs = submesh.get('uvs') or []
+                for i in range(0, len(uvs) - 1, 2):
+                    uvs[i], uvs[i + 1] = (round(x, 6) for x in remap_uv(uvs[i], uvs[i + 1], region, previous))
+
+        mesh['atlas'] = {'material': material_name, 'region': region}
+        self.save_json(mesh_path, mesh)
+
+        folder = mesh_path.rsplit('/', 1)[0]
+        for lod in mesh.get('lods') or []:
+            self.remap_mesh('{}/{}'.format(folder, lod['src']), material_name, region)
+        return
+
+    # Image as a bottom up (height, width, 4) float array, the way Blender and the UVs count rows
+    def load_image(self, web_path):
+        image = bpy.data.images.load(self.file_path(web_path), check_existing=False)
+        w, h = image.size
+        pixels = numpy.empty(w * h * 4, dtype=numpy.float32)
+        image.pixels.foreach_get(pixels)
+        bpy.data.images.remove(image)
+        return pixels.reshape(h, w, 4)
+
+    def save_image(self, web_path, pixels):
+        h, w, _ = pixels.shape
+        image = bpy.data.images.new(os.path.basename(web_path), w, h, alpha=True)
+        image.pixels.foreach_set(pixels.ravel())
+        image.filepath_raw = self.file_path(web_path)
+        image.file_format = 'PNG'
+        image.save()
+        bpy.data.images.remove(image)
+        self.written.append(self.file_path(web_path))
+        return
+
+    # pairs is a list of (mesh web path, material web path)
+    def pack(self, name, pairs, output):
+        materials = {path: self.load_json(path) for path in sorted({material for _, material in pairs})}
+
+        # Each image is packed once, however many materials and meshes use it
+        meshes_of = {}
+        for mesh_path, material_path in pairs:
+            meshes_of.setdefault(self.source_image(materials[material_path]), set()).add(mesh_path)
+
+        images = {}
+        for src, mesh_paths in sorted(meshes_of.items()):
+            # Repeating textures would sample their neighbours in the atlas
+            for mesh_path in sorted(mesh_paths):
+                previous = (self.load_json(mesh_path).get('atlas') or {}).get('region')
+                uvs = (remap_uv(u, v, (0.0, 0.0, 1.0, 1.0), previous) for u, v in self.mesh_uvs(mesh_path))
+                if any(not -1e-03 <= x <= 1.001 for uv in uvs for x in uv):
+                    print('Skipping {}: {} has UVs outside 0-1'.format(src, mesh_path))
+                    break
+            else:
+                images[src] = self.load_image(src)
+
+        pad = self.padding
+        bins = pack_rects({src: (pixels.shape[1] + pad * 2, pixels.shape[0] + pad * 2) for src, pixels in images.items()}, self.max_size)
+
+        regions = {}
+        for n, (size, placed) in enumerate(bins):
+            atlas_path = output if len(bins) == 1 else '{}_{}{}'.format(os.path.splitext(output)[0], n, os.path.splitext(output)[1])
+            pixels = numpy.zeros((size, size, 4), dtype=numpy.float32)
+
+            for src, (x, y) in placed.items():
+                # the padding repeats the edge pixels so filtering and mipmaps do not bleed into neighbours
+                image = images[src]
+                h, w, _ = image.shape
+                pixels[y:y + h + pad * 2, x:x + w + pad * 2] = numpy.pad(image, ((pad, pad), (pad, pad), (0, 0)), mode='edge')
+                regions[src] = (atlas_path, [round(v, 6) for v in ((x + pad) / size, (y + pad) / size, (x + pad + w) / size, (y + pad + h) / size)])
+
+            self.save_image(atlas_path, pixels)
+            print('{}: {} texture(s) in {}x{} -> {}'.format(name, len(placed), size, size, atlas_path))
+
+        for material_path, material in materials.items():
+            src = self.source_image(material)
+            if src not in regions:
+                continue
+
+            atlas_path, region = regions[src]
+            material['textures']['diffuse']['src'] = atlas_path
+            material['atlas'] = {'name': name, 'source': src, 'region': region}
+            self.save_json(material_path, material)
+
+            for mesh_path in sorted(meshes_of[src]):
+                self.remap_mesh(mesh_path, material['name'], region)
+
+        return regions
+
+# Keeps batch_export.py from exporting the rewritten meshes again and gives them new versions, also
+# after a failed pack since some files may already have been rewritten
+def record_written(packer, manifest_path, versions_path):
+    written = sorted(set(path for path in packer.written if os.path.exists(path)))
+    if not written:
+        return
+
+    manifest_path = manifest_path or os.path.join(packer.root, 'assets', 'build-manifest.json')
+    if os.path.exists(manifest_path):
+        manifest = BuildManifest(manifest_path)
+        print('Re-recorded {} output(s) in {}'.format(manifest.refresh(written), manifest_path))
+        manifest.save()
+
+    update_versions(versions_path or os.path.join(packer.root, 'assets', 'asset-versions.json'), packer.root,
+                    {path: hash_file(path) for path in written})
+    return
+
+def main(argv=None):
+    default_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__), description='Pack the textures of asset defs into texture atlases')
+    parser.add_argument('defs', nargs='*', help='Asset def files whose mesh and material are packed, defaults to every gear def')
+    parser.add_argument('--name', required=True, help='Atlas name')
+    parser.add_argument('--root', default=default_root, help='Folder served to the client, containing assets/')
+    parser.add_argument('--out', default=None, help='Atlas image web path, defaults to /assets/img/atlas_<name>.png')
+    parser.add_argument('--pair', action='append', default=[], metavar='MESH=MATERIAL',
+                        help='Extra mesh and material web paths packed with the defs, eg. the player skin')
+    parser.add_argument('--max-size', type=int, default=2048, help='Largest atlas, more atlases are made if needed')
+    parser.add_argument('--padding', type=int, default=4, help='Pixels of edge around each texture')
+    parser.add_argument('--manifest', default=None, help='Build manifest to re-record the rewritten meshes in, defaults to <root>/assets/build-manifest.json if it exists')
+    parser.add_argument('--versions', default=None, help='Asset version map to update, defaults to <root>/assets/asset-versions.json')
+    args = parser.parse_args(argv)
+
+    packer = AtlasPacker(args.root, args.max_size, args.padding)
+
+    defs = args.defs
+    if not defs:
+        for folder in DEF_FOLDERS:
+            defs += sorted(glob.glob(os.path.join(packer.root, 'assets', folder, '*.json')))
+
+    pairs = []
+    for def_path in defs:
+        with open(def_path) as f:
+            asset = json.load(f)
+        if asset.get('mesh') and asset.get('mat'):
+            pairs.append((asset['mesh'], asset['mat']))
+
+    for pair in args.pair:
+        mesh, _, material = pair.partition('=')
+        pairs.append((mesh, material))
+
+    missing = [path for pair in pairs for path in pair if not os.path.exists(packer.file_path(path))]
+    for path in sorted(set(missing)):
+        print('Skipping {}: not found'.format(path))
+    pairs = [pair for pair in pairs if not any(path in missing for path in pair)]
+
+    # A mesh has one set of UVs, so it can only follow one material
+    materials = {}
+    for mesh, material in pairs:
+        if materials.setdefault(mesh, material) != material:
+            print('{} is used with both {} and {}'.format(mesh, materials[mesh], material))
+            return 1
+
+    try:
+        packer.pack(args.name, sorted(set(pairs)), args.out or '/assets/img/atlas_{}.png'.format(args.name))
+    except (OSError, ValueError) as e:
+        print('FAILED {}: {}'.format(args.name, e))
+        return 1
+    finally:
+        record_written(packer, args.manifest, args.versions)
+    return 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
@@ -0,0 +1,194 @@
+# Packs everything an actor, piece of gear or level needs into one bundle file so the client
+# makes one request instead of a waterfall of small ones (asset def -> mesh -> material -> armature).
+#
+# Bundle layout (little endian):
+#   4 bytes  magic 'WDBN'
+#   uint32   version
+#   uint32   length of the table in bytes (padded to 4)
+#   table    UTF-8 JSON: {"name", "type": "BUNDLE", "entries": [{"path", "offset", "length", "sha256"}]}
+#   data     entry payloads, offsets relative to the end of the table and aligned to 4 bytes
+#
+# Entries are keyed by the web path the client would otherwise fetch, eg. /assets/materials/crabby.json.
+# Textures are not bundled; the browser decodes and caches images on its own. Neither is the def
+# a bundle is made for: the client has already fetched it by the time it reads "bundle" from it.
+#
+# eg. bundle every actor and gear def, and point the defs at their bundles:
+#   python blender/pack_bundles.py --link
+# and a level, on top of those:
+#   python blender/pack_bundles.py --bundle dungeon2=/assets/tilesets/dungeon2.json,/assets/materials/dungeon2.json
+#
+# The core bundle, everything every session needs, is always packed from the list the client loads
+# (js/common/io/core-assets.json). Bundles are added to the asset version map, the client only
+# fetches the core bundle when it is listed there.
+import argparse
+import glob
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from build_manifest import hash_file, update_versions
+
+BUNDLE_MAGIC = b'WDBN'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<4sII')
+
+DEF_FOLDERS = ('actor_defs', 'gear_defs')
+DEF_REFERENCES = ('mesh', 'mat', 'arm')
+
+# Assets the client loads at startup, packed as the core bundle
+CORE_ASSETS = ('js', 'common', 'io', 'core-assets.json')
+CORE_BUNDLE = 'core'
+
+def align(n, alignment=4):
+    return (n + alignment - 1) // alignment * alignment
+
+class BundlePacker:
+    def __init__(self, root):
+        # root is the folder the web server serves, ie. the one containing assets/
+        self.root = os.path.abspath(root)
+        return
+
+    def file_path(self, web_path):
+        return os.path.join(self.root, *web_path.lstrip('/').split('/'))
+
+    def web_path(self, file_path):
+        return '/' + os.path.relpath(os.path.abspath(file_path), self.root).replace(os.sep, '/')
+
+    # The asset itself plus whatever it points to: the .bin of binary meshes, levels of detail.
+    # Streamed animation clips are left out, the client fetches them after the armature
+    def dependencies(self, web_path):
+        paths = [web_path]
+
+        with open(self.file_path(web_path), 'rb') as f:
+            try:
+                asset = json.loads(f.read().decode('utf-8'))
+            except ValueError:
+                return paths
+
+        if isinstance(asset, dict):
+            if asset.get('type') == 'ASSETDEF':
+                for key in DEF_REFERENCES:
+                    if asset.get(key):
+                        paths.extend(self.dependencies(asset[key]))
+
+            folder = web_path.rsplit('/', 1)[0]
+            if asset.get('format') == 'BINARY' and asset.get('src'):
+                paths.append('{}/{}'.format(folder, asset['src']))
+
+            for lod in asset.get('lods') or []:
+                paths.extend(self.dependencies('{}/{}'.format(folder, lod['src'])))
+
+        return paths
+
+    def pack(self, name, web_paths, output):
+        entries = []
+        payloads = []
+        offset = 0
+
+        for web_path in web_paths:
+            if any(e['path'] == web_path for e in entries):
+                continue
+
+            with open(self.file_path(web_path), 'rb') as f:
+                payload = f.read()
+
+            entries.append({
+                'path': web_path,
+                'offset': offset,
+                'length': len(payload),
+                'sha256': hashlib.sha256(payload).hexdigest(),
+            })
+            payloads.append(payload + b'\0' * (align(len(payload)) - len(payload)))
+            offset += align(len(payload))
+
+        table = json.dumps({'name': name, 'type': 'BUNDLE', 'entries': entries}).encode('utf-8')
+        table += b' ' * (align(len(table)) - len(table))
+
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'wb') as f:
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(table)))
+            f.write(table)
+            for payload in payloads:
+                f.write(payload)
+
+        return entries
+
+# Adds (or updates) "bundle" in an asset def so the client loads the bundle before the rest
+def link_def(def_path, bundle_web_path):
+    with open(def_path) as f:
+        asset = json.load(f)
+
+    if asset.get('bundle') == bundle_web_path:
+        return
+
+    asset['bundle'] = bundle_web_path
+    with open(def_path, 'w') as f:
+        json.dump(asset, f, indent='\t')
+    return
+
+def main(argv=None):
+    default_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description='Pack asset defs and their meshes, materials and armatures into bundles')
+    parser.add_argument('defs', nargs='*', help='Asset def files to bundle, defaults to every actor and gear def')
+    parser.add_argument('--root', default=default_root, help='Folder served to the client, containing assets/')
+    parser.add_argument('--out', default=None, help='Output folder, defaults to <root>/assets/bundles')
+    parser.add_argument('--bundle', action='append', default=[], metavar='NAME=PATH,PATH...',
+                        help='Extra bundle made of the given web paths, eg. for a level or the core assets')
+    parser.add_argument('--link', action='store_true', help='Writes the bundle path into each asset def')
+    parser.add_argument('--no-core', action='store_true', help='Does not pack the core bundle')
+    parser.add_argument('--versions', default=None, help='Asset version map to update, defaults to <root>/assets/asset-versions.json')
+    args = parser.parse_args(argv)
+
+    packer = BundlePacker(args.root)
+    out = args.out or os.path.join(packer.root, 'assets', 'bundles')
+
+    defs = args.defs
+    if not defs:
+        for folder in DEF_FOLDERS:
+            defs += sorted(glob.glob(os.path.join(packer.root, 'assets', folder, '*.json')))
+
+    bundles = []
+    for def_path in defs:
+        category = os.path.basename(os.path.dirname(os.path.abspath(def_path)))
+        name = os.path.splitext(os.path.basename(def_path))[0]
+        bundles.append((name, [packer.web_path(def_path)], os.path.join(out, category, name + '.bundle'), def_path))
+
+    if not args.no_core:
+        with open(os.path.join(packer.root, *CORE_ASSETS)) as f:
+            bundles.append((CORE_BUNDLE, json.load(f), os.path.join(out, CORE_BUNDLE + '.bundle'), None))
+
+    for bundle in args.bundle:
+        name, _, paths = bundle.partition('=')
+        bundles.append((name, [path for path in paths.split(',') if path], os.path.join(out, name + '.bundle'), None))
+
+    failed = 0
+    packed = {}
+    for name, web_paths, output, def_path in bundles:
+        try:
+            web_paths = [p for path in web_paths for p in packer.dependencies(path)]
+            if def_path:
+                web_paths = [p for p in web_paths if p != packer.web_path(def_path)]
+            entries = packer.pack(name, web_paths, output)
+        except OSError as e:
+            print('FAILED {}: {}'.format(name, e))
+            failed += 1
+            continue
+
+        size = sum(e['length'] for e in entries)
+        print('{}: {} file(s), {} bytes -> {}'.format(name, len(entries), size, output))
+        packed[output] = hash_file(output)
+
+        if args.link and def_path:
+            link_def(def_path, packer.web_path(output))
+
+    if packed:
+        update_versions(args.versions or os.path.join(packer.root, 'assets', 'asset-versions.json'), packer.root, packed)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
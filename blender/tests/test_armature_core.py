@@ -0,0 +1,107 @@
+# Tests for armature_core.py, the Blender independent part of the armature exporter. Runs on
+# plain Python:
+#   python -m pytest blender/tests
+import json
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_common
+from armature_core import (ArmatureExport, ArmatureAnimationExport, ArmatureStreamWriter, reduce_keyframes,
+                           schedule_keyframes, encode_bone)
+
+BONES = 4
+
+# Poses of bones swaying about Z at different speeds, a list of 4x4 matrices per frame
+def sway_poses(frames):
+    poses = []
+    for frame in frames:
+        pose = []
+        for bone in range(BONES):
+            angle = math.sin(frame * 0.05 * (bone + 1)) * 0.5
+            c, s = math.cos(angle), math.sin(angle)
+            pose.append([[c, -s, 0.0, 0.0], [s, c, 0.0, 0.0], [0.0, 0.0, 1.0, math.cos(frame * 0.1) * 0.1], [0.0, 0.0, 0.0, 1.0]])
+        poses.append(pose)
+    return poses
+
+class ReduceKeyframesTest(unittest.TestCase):
+    # every dropped pose is within the error of the interpolation between the kept ones around it
+    def test_error_bound(self):
+        frames = schedule_keyframes(list(range(0, 120, 10)) + [119], 1)
+        poses = sway_poses(frames)
+        for max_position_error, max_rotation_error in ((1e-4, 1e-4), (1e-2, 1e-3), (0.05, 0.05)):
+            kept = reduce_keyframes(frames, poses, max_position_error, max_rotation_error)
+            self.assertEqual(kept, sorted(set(kept)))
+            self.assertEqual((kept[0], kept[-1]), (0, len(frames) - 1))
+
+            for i, j in zip(kept, kept[1:]):
+                for k in range(i + 1, j):
+                    t = (frames[k] - frames[i]) / (frames[j] - frames[i])
+                    for a, b, actual in zip(poses[i], poses[j], poses[k]):
+                        for row in range(3):
+                            for column in range(4):
+                                error = abs(a[row][column] + (b[row][column] - a[row][column]) * t - actual[row][column])
+                                limit = max_position_error if column == 3 else max_rotation_error
+                                self.assertLessEqual(error, limit)
+
+    def test_looser_bound_keeps_fewer(self):
+        frames = schedule_keyframes(list(range(120)), 1)
+        poses = sway_poses(frames)
+        tight = reduce_keyframes(frames, poses, 1e-5, 1e-5)
+        loose = reduce_keyframes(frames, poses, 1e-2, 1e-2)
+        self.assertLess(len(loose), len(tight))
+
+    def test_short_animations_are_kept(self):
+        self.assertEqual(reduce_keyframes([0], sway_poses([0]), 1.0, 1.0), [0])
+        self.assertEqual(reduce_keyframes([0, 1], sway_poses([0, 1]), 1.0, 1.0), [0, 1])
+
+class ArmatureStreamWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory(prefix='test_armature_core_')
+
+    def tearDown(self):
+        self.folder.cleanup()
+        del export_common.written_files[:]
+
+    def test_round_trip(self):
+        path = os.path.join(self.folder.name, 'sway.json')
+        export = ArmatureExport('sway', ['bone{}'.format(i) for i in range(BONES)])
+        export.encoding = 'MAT3x4'
+        animation = ArmatureAnimationExport('Sway')
+        animation.keyframes = [1, 11]
+        poses = sway_poses([0, 10])
+
+        writer = ArmatureStreamWriter(path, export, -1)
+        for pose in poses:
+            writer.write([x for matrix in pose for x in encode_bone(matrix, export.encoding)])
+        writer.write([])
+        writer.close([animation], [[-1.0, -1.0, -1.0], [1.0, 1.0, 1.0]])
+
+        with open(path) as f:
+            armature = json.load(f)
+        self.assertEqual((armature['name'], armature['type'], armature['encoding']), ('sway', 'ARMATURE', 'MAT3x4'))
+        self.assertEqual(armature['bones'], export.bones)
+        self.assertEqual(armature['data'], [x for pose in poses for matrix in pose for x in encode_bone(matrix, 'MAT3x4')])
+        self.assertEqual(len(armature['data']), writer.count)
+        self.assertEqual(armature['animations'], [{'name': 'Sway', 'keyframes': [1, 11], 'bounds': None, 'src': None}])
+        self.assertEqual(armature['bounds'], [[-1.0, -1.0, -1.0], [1.0, 1.0, 1.0]])
+        self.assertEqual(export_common.written_files, [path])
+
+    def test_precision_rounds_data(self):
+        path = os.path.join(self.folder.name, 'rounded.json')
+        writer = ArmatureStreamWriter(path, ArmatureExport('rounded', ['bone']), 2)
+        writer.write([0.12345, 1.0 / 3.0])
+        writer.close()
+
+        with open(path) as f:
+            armature = json.load(f)
+        self.assertEqual(armature['data'], [0.12, 0.33])
+        self.assertNotIn('animations', armature)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+# Tests for mesh_core.py, the Blender independent part of the mesh exporter. Runs on plain
+# Python with NumPy:
+#   python -m pytest blender/tests
+import json
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_common
+from mesh_core import (SubmeshExport, MeshStreamWriter, TriangleIndex, quantizeInfluences, writeBinaryMesh,
+                       looseParts, staticVertexFormat)
+
+# Triangle corners of a square grid of side * side vertices in the z = 0 plane, as extracted
+# from Blender: per corner positions, uvs and normals and the vertex each corner came from
+def gridCorners(side):
+    x, y = np.meshgrid(np.arange(side, dtype=np.float64), np.arange(side, dtype=np.float64))
+    co = np.stack([x.ravel(), y.ravel(), np.zeros(side * side)], axis=1) / (side - 1)
+
+    quad = (np.arange(side - 1)[None, :] + side * np.arange(side - 1)[:, None]).ravel()
+    corners = np.stack([quad, quad + 1, quad + side + 1, quad, quad + side + 1, quad + side], axis=1).ravel()
+    return co[corners], co[corners, :2], np.tile([0.0, 0.0, 1.0], (len(corners), 1)), corners
+
+def appended(positions, uvs, norms, tolerance):
+    submesh = SubmeshExport('appended', tolerance)
+    for v, uv, norm in zip(positions.tolist(), uvs.tolist(), norms.tolist()):
+        submesh.append(v, uv, norm, None)
+    submesh.build(True)
+    return submesh
+
+def assigned(positions, uvs, norms, tolerance):
+    submesh = SubmeshExport('assigned', tolerance)
+    submesh.assign(positions, uvs, norms, np.arange(len(positions)), None, True)
+    return submesh
+
+# Every triangle as the set of its corner positions, to compare meshes indexed differently
+def triangleSet(submesh):
+    verts = submesh.verts
+    corners = [tuple(verts[i * 3:i * 3 + 3]) for i in submesh.indices]
+    return sorted(tuple(sorted(corners[t:t + 3])) for t in range(0, len(corners), 3))
+
+class WeldTest(unittest.TestCase):
+    def tearDown(self):
+        del export_common.written_files[:]
+
+    # assign is the vectorized append, both weld the same vertices in the same order
+    def test_assign_matches_append(self):
+        rng = np.random.default_rng(1)
+        for tolerance in (0.0, 1e-9, 0.01, 0.05):
+            positions = np.round(rng.random((300, 3)) * 0.05, 2) + rng.random((300, 3)) * 0.004
+            uvs = np.round(rng.random((300, 2)) * 0.2, 1)
+            norms = np.zeros((300, 3)) + np.round(rng.random((300, 1)))
+
+            a = appended(positions, uvs, norms, tolerance)
+            b = assigned(positions, uvs, norms, tolerance)
+            self.assertEqual(list(a.indices), list(b.indices), tolerance)
+            self.assertEqual(list(a.verts), list(b.verts), tolerance)
+            self.assertEqual(list(a.uvs), list(b.uvs), tolerance)
+            self.assertEqual(list(a.norms), list(b.norms), tolerance)
+            if tolerance >= 0.01:
+                self.assertLess(len(a.verts) // 3, 300)
+
+    # neighbours closer than the tolerance weld even in different grid cells
+    def test_assign_welds_across_cells(self):
+        positions = np.array([[0.0099, 0.0, 0.0], [0.0101, 0.0, 0.0], [0.5, 0.0, 0.0]])
+        uvs = np.zeros((3, 2))
+        norms = np.tile([0.0, 0.0, 1.0], (3, 1))
+
+        submesh = assigned(positions, uvs, norms, 0.01)
+        self.assertEqual(list(submesh.indices), [0, 0, 1])
+        self.assertEqual(len(submesh.verts) // 3, 2)
+
+    def test_flat_grid_welds_corners(self):
+        submesh = assigned(*gridCorners(10)[:3], 1e-9)
+        self.assertEqual(len(submesh.verts) // 3, 100)
+        self.assertEqual(len(submesh.indices), 81 * 6)
+
+class SplitTest(unittest.TestCase):
+    def test_small_submesh_is_not_split(self):
+        submesh = assigned(*gridCorners(10)[:3], 1e-9)
+        self.assertEqual(submesh.split(100), [submesh])
+
+    # every chunk fits the budget with local indices and together they draw every triangle once
+    def test_chunks_fit_budget_and_cover_mesh(self):
+        submesh = assigned(*gridCorners(40)[:3], 1e-9)
+        for sortByLocality in (False, True):
+            chunks = submesh.split(300, sortByLocality)
+            self.assertGreater(len(chunks), 1)
+
+            triangles = []
+            for i, chunk in enumerate(chunks):
+                nVertices = len(chunk.verts) // 3
+                self.assertLessEqual(nVertices, 300)
+                self.assertLess(max(chunk.indices), nVertices)
+                self.assertEqual(chunk.chunk, [i, len(chunks)])
+                self.assertEqual(chunk.chunkOf, submesh.name)
+                triangles.extend(triangleSet(chunk))
+
+            self.assertEqual(sorted(triangles), triangleSet(submesh))
+
+class QuantizeInfluencesTest(unittest.TestCase):
+    def test_weights_sum_to_255(self):
+        rng = np.random.default_rng(2)
+        for count in range(1, 5):
+            for _ in range(200):
+                influences = [(w, g) for g, w in enumerate(rng.random(count).tolist())]
+                groups, amounts = quantizeInfluences(influences, 4)
+                self.assertEqual(sum(amounts), 255)
+                self.assertEqual(len(groups), 4)
+                self.assertEqual(groups[:count], list(range(count)))
+                self.assertTrue(all(0 <= a <= 255 for a in amounts))
+
+    def test_equal_weights_stay_within_one(self):
+        _, amounts = quantizeInfluences([(1.0, 0), (1.0, 1), (1.0, 2)], 4)
+        self.assertLessEqual(max(amounts[:3]) - min(amounts[:3]), 1)
+        self.assertEqual(amounts[3], 0)
+
+    def test_no_weight_is_left_empty(self):
+        self.assertEqual(quantizeInfluences([(0.0, 3)], 4), ([0] * 4, [0] * 4))
+
+class LoosePartsTest(unittest.TestCase):
+    # the two walls of a corner piece are hulled apart, the quads of each one stay together
+    def test_parts_do_not_share_vertices(self):
+        polygons = [[0, 1, 2, 3], [2, 3, 4, 5], [10, 11, 12], [12, 13, 10], [20, 21, 22]]
+        parts = sorted(looseParts(polygons))
+        self.assertEqual(parts, [
+            ([0, 1, 2, 3, 4, 5], [[0, 1, 2, 3], [2, 3, 4, 5]]),
+            ([10, 11, 12, 13], [[0, 1, 2], [2, 3, 0]]),
+            ([20, 21, 22], [[0, 1, 2]]),
+        ])
+
+    def test_polygon_joining_parts_merges_them(self):
+        parts = looseParts([[0, 1, 2], [3, 4, 5], [2, 3, 6]])
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(parts[0][0], [0, 1, 2, 3, 4, 5, 6])
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory(prefix='test_mesh_core_')
+        self.chunks = assigned(*gridCorners(20)[:3], 1e-9).split(150)
+
+    def tearDown(self):
+        self.folder.cleanup()
+        del export_common.written_files[:]
+
+    def test_json_round_trip(self):
+        path = os.path.join(self.folder.name, 'grid.json')
+        writer = MeshStreamWriter(path, 'grid', {'verts': -1, 'norms': -1, 'uvs': -1, 'weights': -1})
+        for chunk in self.chunks:
+            writer.write(chunk)
+        writer.close({'lods': []})
+
+        with open(path) as f:
+            mesh = json.load(f)
+        self.assertEqual((mesh['name'], mesh['type'], mesh['lods']), ('grid', 'MESH', []))
+        self.assertEqual(len(mesh['submeshes']), len(self.chunks))
+        for written, chunk in zip(mesh['submeshes'], self.chunks):
+            self.assertEqual(written['name'], chunk.name)
+            self.assertEqual(written['indices'], list(chunk.indices))
+            self.assertEqual(written['verts'], list(chunk.verts))
+            self.assertEqual(written['uvs'], list(chunk.uvs))
+            self.assertEqual(written['norms'], list(chunk.norms))
+        self.assertEqual(export_common.written_files, [path])
+
+    # indices are local to their chunk, the header says where its vertices start
+    def test_binary_round_trip(self):
+        path = os.path.join(self.folder.name, 'grid.json')
+        binPath = writeBinaryMesh(path, 'grid', 'MESH', self.chunks)
+
+        with open(path) as f:
+            header = json.load(f)
+        with open(binPath, 'rb') as f:
+            data = f.read()
+        self.assertEqual((header['layout'], header['stride']), ('STATIC', staticVertexFormat.size))
+        self.assertEqual(export_common.written_files, [binPath, path])
+
+        indexData = data[header['vertexBytes']:]
+        for written, chunk in zip(header['submeshes'], self.chunks):
+            nVertices = len(chunk.verts) // 3
+            self.assertEqual(written['vertexCount'], nVertices)
+
+            start = written['indexOffset']
+            indices = struct.unpack_from('<{}H'.format(written['indexCount']), indexData, start)
+            self.assertEqual(list(reversed(indices)), list(chunk.indices))
+
+            for k in range(nVertices):
+                position = staticVertexFormat.unpack_from(data, written['vertexOffset'] + k * header['stride'])[:3]
+                self.assertEqual(list(position), list(chunk.verts[k * 3:k * 3 + 3]))
+
+    # BVH triangle ids of a binary export point into the .bin index buffer, which is back to front
+    def test_binary_bvh_triangles(self):
+        index = TriangleIndex(4, reversedIndices=True)
+        for i, chunk in enumerate(self.chunks):
+            index.add(i, chunk)
+        bvh = index.build()
+
+        path = os.path.join(self.folder.name, 'grid.json')
+        binPath = writeBinaryMesh(path, 'grid', 'MESH', self.chunks, {'bvh': bvh})
+        with open(path) as f:
+            header = json.load(f)
+        with open(binPath, 'rb') as f:
+            data = f.read()
+
+        def position(submesh, k):
+            return staticVertexFormat.unpack_from(data, submesh['vertexOffset'] + k * header['stride'])[:3]
+
+        nodes, triangles = header['bvh']['nodes'], header['bvh']['triangles']
+        found = []
+        for n in range(0, len(nodes), 8):
+            lo, hi, first, count = nodes[n:n + 3], nodes[n + 3:n + 6], nodes[n + 6], nodes[n + 7]
+            for s, t in zip(triangles[first * 2:(first + count) * 2:2], triangles[first * 2 + 1:(first + count) * 2:2]):
+                submesh = header['submeshes'][s]
+                corners = struct.unpack_from('<3H', data, header['vertexBytes'] + submesh['indexOffset'] + t * 6)
+
+                # the same triangle, drawn with the same winding, as the one added
+                chunk = self.chunks[s]
+                added = len(chunk.indices) // 3 - 1 - t
+                self.assertEqual(list(corners), list(reversed(chunk.indices[added * 3:added * 3 + 3])))
+
+                for k in corners:
+                    for a, x in enumerate(position(submesh, k)):
+                        self.assertTrue(lo[a] <= x <= hi[a])
+                found.append((s, t))
+
+        self.assertEqual(sorted(found), sorted((s, t) for s, chunk in enumerate(self.chunks) for t in range(len(chunk.indices) // 3)))
+
+    def test_binary_rejects_oversized_submesh(self):
+        submesh = SubmeshExport('huge')
+        submesh.verts.extend([0.0] * 3 * 0x10001)
+        submesh.indices.extend([0, 1, 0x10000])
+        with self.assertRaises(ValueError):
+            writeBinaryMesh(os.path.join(self.folder.name, 'huge.json'), 'huge', 'SUBMESH', [submesh])
+
+
+if __name__ == "__main__":
+    unittest.main()
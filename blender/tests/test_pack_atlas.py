@@ -0,0 +1,106 @@
+# Tests for the UV remapping and bookkeeping of pack_atlas.py, which run without Blender:
+#   python -m pytest blender/tests
+import json
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_common
+from build_manifest import BuildManifest
+from mesh_core import SubmeshExport, writeBinaryMesh
+from pack_atlas import AtlasPacker, BINARY_UV_OFFSETS, record_written
+
+REGION = [0.5, 0.25, 0.75, 0.5]
+
+# A quad with UVs over the whole texture
+def quad(name):
+    submesh = SubmeshExport(name)
+    submesh.verts.extend([0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 1.0, 0.0, 0.0, 1.0, 0.0])
+    submesh.uvs.extend([0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 0.0, 1.0])
+    submesh.norms.extend([0.0, 0.0, 1.0] * 4)
+    submesh.indices.extend([0, 1, 2, 0, 2, 3])
+    return submesh
+
+class PackAtlasTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory(prefix='test_pack_atlas_')
+        self.root = self.folder.name
+        os.makedirs(os.path.join(self.root, 'assets', 'models'))
+        self.packer = AtlasPacker(self.root, 2048, 4)
+
+    def tearDown(self):
+        self.folder.cleanup()
+        del export_common.written_files[:]
+
+    def path(self, name):
+        return os.path.join(self.root, 'assets', 'models', name)
+
+    def write_json(self, name, asset):
+        with open(self.path(name), 'w') as f:
+            json.dump(asset, f)
+
+    def read_json(self, name):
+        with open(self.path(name)) as f:
+            return json.load(f)
+
+    def test_json_lods_are_remapped(self):
+        uvs = [0.0, 0.0, 1.0, 0.0, 1.0, 1.0]
+        self.write_json('gear.json', {'name': 'gear', 'type': 'SUBMESH', 'uvs': uvs, 'lods': [{'src': 'gear_lod1.json', 'error': 0.1}]})
+        self.write_json('gear_lod1.json', {'name': 'gear_lod1', 'type': 'SUBMESH', 'uvs': uvs})
+
+        self.packer.remap_mesh('/assets/models/gear.json', 'gear', REGION)
+        # packing again starts from the original UVs
+        self.packer.remap_mesh('/assets/models/gear.json', 'gear', REGION)
+
+        for name in ('gear.json', 'gear_lod1.json'):
+            mesh = self.read_json(name)
+            self.assertEqual(mesh['uvs'], [0.5, 0.25, 0.75, 0.25, 0.75, 0.5], name)
+            self.assertEqual(mesh['atlas'], {'material': 'gear', 'region': REGION})
+
+    def test_binary_lods_are_remapped(self):
+        writeBinaryMesh(self.path('gear_lod1.json'), 'gear_lod1', 'SUBMESH', [quad('gear_lod1')])
+        writeBinaryMesh(self.path('gear.json'), 'gear', 'SUBMESH', [quad('gear')], {'lods': [{'src': 'gear_lod1.json', 'error': 0.1}]})
+
+        self.packer.remap_mesh('/assets/models/gear.json', 'gear', REGION)
+
+        lod = self.read_json('gear_lod1.json')
+        with open(self.path(lod['src']), 'rb') as f:
+            data = f.read()
+        offset = BINARY_UV_OFFSETS[lod['layout']]
+        uvs = [struct.unpack_from('<2H', data, start + offset) for start in range(0, lod['vertexBytes'], lod['stride'])]
+        self.assertEqual([(round(u / 0xFFFF, 4), round(v / 0xFFFF, 4)) for u, v in uvs],
+                         [(0.5, 0.25), (0.75, 0.25), (0.75, 0.5), (0.5, 0.5)])
+        self.assertEqual(sorted(os.path.basename(p) for p in self.packer.written),
+                         ['gear.bin', 'gear.json', 'gear_lod1.bin', 'gear_lod1.json'])
+
+    # the rewritten outputs stay up to date in the manifest and get new versions
+    def test_written_files_are_recorded(self):
+        uvs = [0.0, 0.0, 1.0, 1.0]
+        self.write_json('gear.json', {'name': 'gear', 'type': 'SUBMESH', 'uvs': uvs})
+        source = os.path.join(self.root, 'gear.blend')
+        with open(source, 'w') as f:
+            f.write('blend')
+
+        manifest_path = os.path.join(self.root, 'assets', 'build-manifest.json')
+        manifest = BuildManifest(manifest_path)
+        inputs = manifest.inputs(source, [source], [])
+        manifest.record('mesh', self.path('gear.json'), inputs, [self.path('gear.json')])
+        manifest.save()
+
+        self.packer.remap_mesh('/assets/models/gear.json', 'gear', REGION)
+        self.assertFalse(BuildManifest(manifest_path).is_up_to_date('mesh', self.path('gear.json'), inputs))
+
+        record_written(self.packer, None, None)
+        self.assertTrue(BuildManifest(manifest_path).is_up_to_date('mesh', self.path('gear.json'), inputs))
+
+        with open(os.path.join(self.root, 'assets', 'asset-versions.json')) as f:
+            versions = json.load(f)
+        self.assertEqual(list(versions), ['/assets/models/gear.json'])
+
+
+if __name__ == "__main__":
+    unittest.main()
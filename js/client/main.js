@@ -1,6 +1,6 @@
 import { vec3, quat, mat4 } from "gl-matrix"
 import { Renderer } from "../common/renderer";
-import { coreAssetList } from "../common/io/assets";
+import { coreAssetList, coreBundle, assetVersions } from "../common/io/assets";
 import { Scene } from "../common/scene/scene";
 import { MessageBus } from "../common/messaging/message-bus";
 import { MessageType } from "../common/messaging/message-type";
@@ -45,6 +45,13 @@ console.log('END MATRICES');
         renderer = new Renderer(d.getElementById('main-viewport'));
         renderer.init();
 
+        //Versions first, every asset is fetched by its versioned URL
+        await RestClient.loadVersions(assetVersions).catch(e => console.warn(e.message));
+
+        //One request for the core assets when they are bundled, one per asset otherwise
+        if(RestClient.hasVersion(coreBundle))
+            await RestClient.loadBundle(coreBundle).catch(e => console.warn(e.message));
+
         let i = coreAssetList.length;
         while(i--){
             const asset = await RestClient.getJSON(coreAssetList[i]);   
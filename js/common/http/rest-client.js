@@ -1,15 +1,119 @@
+const BUNDLE_MAGIC = 0x4E424457; //'WDBN'
+const BUNDLE_HEADER_SIZE = 12;
+
 class RestClientSingleton{
     constructor(){
-        
+        //Files unpacked from bundles, by path, served instead of fetching them once
+        this.bundled = new Map();
+
+        //Content version of each exported file by path, see blender/build_manifest.py
+        this.versions = {};
+    }
+
+    //Loads the asset version map. Versioned URLs change with the content, so the server can
+    //let browsers cache them for good
+    async loadVersions(path){
+        const response = await fetch(path, { cache: 'no-cache' });
+        if(!response.ok)
+            throw new Error(`Could not load asset versions ${path}: ${response.status}`);
+
+        this.versions = await response.json();
+        return this.versions;
+    }
+
+    //Whether a file was published with a version, ie. it was built and can be fetched
+    hasVersion(path){
+        return !!this.versions[this.toPath(path)];
+    }
+
+    //Takes a file out of the loaded bundles, so its payload is not kept once it has been parsed
+    takeBundled(path){
+        const key = this.toPath(path);
+        const bundled = this.bundled.get(key);
+        if(bundled)
+            this.bundled.delete(key);
+        return bundled;
+    }
+
+    //URL to fetch a file from, with its content version if it has one
+    versioned(path){
+        const url = new URL(path, location.href);
+        const version = this.versions[url.pathname];
+        if(version)
+            url.searchParams.set('v', version);
+        return url.href;
     }
 
     async getJSON(path){
-        const response = await fetch(path);
-        const asset = await response.json();
+        let asset, baseUrl;
+
+        const bundled = this.takeBundled(path);
+        if(bundled){
+            asset = JSON.parse(new TextDecoder().decode(bundled));
+            baseUrl = new URL(path, location.href);
+        }
+        else{
+            const response = await fetch(this.versioned(path));
+            asset = await response.json();
+            baseUrl = response.url;
+        }
+
         asset.category = asset.category || path.match(/assets\/(.*)\//)[1];
 
+        //Binary assets only have a header in JSON, the data lives next to it
+        if(asset.format === 'BINARY'){
+            asset.blob = await this.getArrayBuffer(new URL(asset.src, baseUrl));
+        }
+
+        //Levels of detail live in sibling files, finest first, fetched once the renderer wants them
+        if(!!asset.lods){
+            asset.lods.forEach(lod => lod.url = this.toPath(new URL(lod.src, baseUrl)));
+        }
+
+        //Streamed animation clips are fetched later, by whoever needs them
+        if(asset.type === 'ARMATURE'){
+            asset.animations.filter(anim => !!anim.src)
+                .forEach(anim => anim.url = this.toPath(new URL(anim.src, baseUrl)));
+        }
+
         return asset;
     }
+
+    async getArrayBuffer(path){
+        const bundled = this.takeBundled(path);
+        if(bundled)
+            return bundled;
+
+        const response = await fetch(this.versioned(path));
+        return await response.arrayBuffer();
+    }
+
+    //Fetches a bundle made by blender/pack_bundles.py in one request, later requests for its files are served from memory
+    async loadBundle(path){
+        const response = await fetch(this.versioned(path));
+        if(!response.ok)
+            throw new Error(`Could not load bundle ${path}: ${response.status}`);
+
+        const buffer = await response.arrayBuffer();
+        const view = new DataView(buffer);
+        if(view.getUint32(0, true) !== BUNDLE_MAGIC)
+            throw new Error(`${path} is not a bundle`);
+
+        const tableLength = view.getUint32(8, true);
+        const table = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, BUNDLE_HEADER_SIZE, tableLength)));
+        const dataOffset = BUNDLE_HEADER_SIZE + tableLength;
+
+        table.entries.forEach(entry => {
+            const start = dataOffset + entry.offset;
+            this.bundled.set(entry.path, buffer.slice(start, start + entry.length));
+        });
+
+        return table;
+    }
+
+    toPath(path){
+        return new URL(path, location.href).pathname;
+    }
 }
 
-export const RestClient = new RestClientSingleton();
\ No newline at end of file
+export const RestClient = new RestClientSingleton();
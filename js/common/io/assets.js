@@ -1,11 +1,11 @@
+import coreAssets from './core-assets.json';
+
 //These are assets we should always have handy
-export const coreAssetList = [
-    '/assets/animations/dungeon_player_anim.json',
-    '/assets/models/player/head0.json',
-    '/assets/models/player/arms0.json',
-    '/assets/materials/human0.json',
-    '/assets/materials/dungeon2.json',
-    '/assets/tilesets/dungeon2.json',
-    '/assets/materials/blood0.json',
-    '/assets/materials/fire0.json'
-]
\ No newline at end of file
+//Kept in JSON so that blender/pack_bundles.py bundles the same list
+export const coreAssetList = coreAssets;
+
+//Content versions of the exported files, written by blender/batch_export.py
+export const assetVersions = '/assets/asset-versions.json';
+
+//Packed coreAssetList, see blender/pack_bundles.py. Loaded first if the asset versions list it
+export const coreBundle = '/assets/bundles/core.bundle';
@@ -2,6 +2,7 @@ import { mat4, vec3, quat } from 'gl-matrix'
 import { WebGLResourceManager } from './rendering/resource-management';
 import { VERTEX_STRIDE_ACTORS, VERTEX_STRIDE_PARTICLES, VERTEX_STRIDE_STATIC } from './rendering/mesh/mesh-constants';
 import { makeParticleBuffer, ParticleDefs } from './rendering/particles';
+import { DegToRad } from './math';
 
 
 var gl = null;
@@ -34,6 +35,10 @@ mat4.perspective(matLightProj, 140 * Math.PI / 180, 1, 0.1, 400);
 const matLightView = mat4.create();
 
 
+//Levels of detail are switched once their error would show as less than this many pixels
+const LOD_PIXEL_ERROR = 1;
+var lodScale = 1; //pixels per world unit at a distance of 1
+
 const MAX_TO_RENDER = 512;
 var pvs = new Array(MAX_TO_RENDER);
 
@@ -46,6 +51,10 @@ const PARTICLE_EL_CNT = MAX_PARTICLES * 6;
 
 var particleBuffers;
 
+//Vertex attributes of each layout as [location, size, type, normalized, byte offset]
+var actorAttributes = null;
+var staticAttributes = null;
+
 //Variables we will use
 let i = 0;
 
@@ -75,6 +84,20 @@ export class Renderer{
         //Create shadow framebuffer
         this.shadowFBO = this.createDepthFBO(SHADOWMAP_SIZE);
         particleBuffers = makeParticleBuffer(gl, MAX_PARTICLES);
+
+        actorAttributes = [
+            [0, 3, gl.FLOAT, false, 0],             //POS
+            [1, 4, gl.UNSIGNED_BYTE, false, 12],    // VERTEX GROUPS (BONES)
+            [2, 4, gl.UNSIGNED_BYTE, true, 16],     // WEIGHTS
+            [3, 2, gl.UNSIGNED_SHORT, true, 20],    // UVs
+            [4, 3, gl.BYTE, true, 24]               // NORMALS
+        ];
+        staticAttributes = [
+            [0, 3, gl.FLOAT, false, 0],             //POS
+            [1, 2, gl.UNSIGNED_SHORT, true, 12],    // UVs
+            [2, 3, gl.BYTE, true, 16],              // NORMALS
+            [3, 4, gl.UNSIGNED_BYTE, true, 20]      // BAKED LIGHT + AO
+        ];
     }
 
     render(scene, camera, time, dT){
@@ -90,6 +113,8 @@ export class Renderer{
         let shader;
         let arm;
 
+        lodScale = h / (2 * Math.tan(camera.fov * DegToRad / 2));
+
         if(w !== frameWidth || h !== frameHeight){
             //this will resize the main frame buffer
             this.canvas.setAttribute('width', '' + w);
@@ -157,9 +182,7 @@ export class Renderer{
             gl.enableVertexAttribArray(1);
             gl.enableVertexAttribArray(2);
             gl.disableVertexAttribArray(3);
-            gl.vertexAttribPointer(0, 3, gl.FLOAT, false, VERTEX_STRIDE_ACTORS, 0); //POS
-            gl.vertexAttribPointer(1, 4, gl.UNSIGNED_BYTE, false, VERTEX_STRIDE_ACTORS, 12); // VERTEX GROUPS (BONES)
-            gl.vertexAttribPointer(2, 4, gl.UNSIGNED_BYTE, true, VERTEX_STRIDE_ACTORS, 16); // WEIGHTS
+            this.useVertices(actorAttributes, VERTEX_STRIDE_ACTORS);
 
             gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, this.resources.actorsIBuffer.buffer);
 
@@ -216,7 +239,7 @@ export class Renderer{
                 gl.uniform3fv(shader.uniformLocations.keyframes, e.anim.tween);
     
                 this.updateShaderArmature(shader, a.arm);
-                this.drawMesh(a.mesh);
+                this.drawMesh(this.selectLod(a.mesh, e.pos, e.s[0], camera));
             }
         }
         gl.disable(gl.SCISSOR_TEST);
@@ -247,11 +270,7 @@ export class Renderer{
         //gl.enableVertexAttribArray(2);
         gl.enableVertexAttribArray(3);
         gl.enableVertexAttribArray(4);
-        gl.vertexAttribPointer(0, 3, gl.FLOAT, false, VERTEX_STRIDE_ACTORS, 0); //POS
-        gl.vertexAttribPointer(1, 4, gl.UNSIGNED_BYTE, false, VERTEX_STRIDE_ACTORS, 12); // VERTEX GROUPS (BONES)
-        gl.vertexAttribPointer(2, 4, gl.UNSIGNED_BYTE, true, VERTEX_STRIDE_ACTORS, 16); // WEIGHTS
-        gl.vertexAttribPointer(3, 2, gl.UNSIGNED_SHORT, true, VERTEX_STRIDE_ACTORS, 20); // UVs
-        gl.vertexAttribPointer(4, 3, gl.BYTE, true, VERTEX_STRIDE_ACTORS, 24); // NORMALS
+        this.useVertices(actorAttributes, VERTEX_STRIDE_ACTORS);
 
         gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, this.resources.actorsIBuffer.buffer);
 
@@ -281,9 +300,13 @@ export class Renderer{
             gl.uniform3fv(shader.uniformLocations.keyframes, p.anim.tween);
 
             //Base skin for face/arms/etc.
+            //Skin and gear packed into one atlas (blender/pack_atlas.py) share the texture
             let mat = this.resources.materials[p.skin]
-            if(!!mat)
-                gl.bindTexture(gl.TEXTURE_2D, mat.diffuse);
+            let bound = null;
+            if(!!mat){
+                bound = mat.diffuse;
+                gl.bindTexture(gl.TEXTURE_2D, bound);
+            }
 
             this.drawMesh(this.resources.meshes[p.head]);
             this.drawMesh(this.resources.meshes[p.body]);
@@ -298,7 +321,10 @@ export class Renderer{
                 if(!a)
                     continue;
                 
-                gl.bindTexture(gl.TEXTURE_2D, a.mat.diffuse);
+                if(a.mat.diffuse !== bound){
+                    bound = a.mat.diffuse;
+                    gl.bindTexture(gl.TEXTURE_2D, bound);
+                }
                 this.drawMesh(a.mesh);
             }
         }
@@ -321,7 +347,7 @@ export class Renderer{
 
             gl.activeTexture(gl.TEXTURE0);
             gl.bindTexture(gl.TEXTURE_2D, a.mat.diffuse);
-            this.drawMesh(a.mesh);
+            this.drawMesh(this.selectLod(a.mesh, e.pos, e.s[0], camera));
         }
 
         /////////////////////////////////////////////////////////////
@@ -331,12 +357,8 @@ export class Renderer{
         gl.useProgram(shader.program);
 
         gl.bindBuffer(gl.ARRAY_BUFFER, this.resources.staticVBuffer);
-        gl.disableVertexAttribArray(3);
         gl.disableVertexAttribArray(4);
-
-        gl.vertexAttribPointer(0, 3, gl.FLOAT, false, VERTEX_STRIDE_STATIC, 0); //POS
-        gl.vertexAttribPointer(1, 2, gl.UNSIGNED_SHORT, true, VERTEX_STRIDE_STATIC, 12); // UVs
-        gl.vertexAttribPointer(2, 3, gl.BYTE, true, VERTEX_STRIDE_STATIC, 16); // NORMALS
+        this.useVertices(staticAttributes, VERTEX_STRIDE_STATIC);
 
         gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, this.resources.staticIBuffer);
 
@@ -372,7 +394,7 @@ export class Renderer{
 
                         this.updateShaderLights(shader, scene, x << scene.level.spacing, y << scene.level.spacing);
                         gl.uniform3f(shader.uniformLocations.offset, x << scene.level.spacing, y << scene.level.spacing, scene.level.tiles[i+1]);
-                        gl.drawElements(gl.TRIANGLES, m[t][0], gl.UNSIGNED_SHORT, m[t][1]);
+                        this.drawSubmesh(m[t]);
                     }
                 }
             }
@@ -382,6 +404,7 @@ export class Renderer{
         // PARTICLE EFFECTS
         //////////////////////////////////////////////////////////
         shader = shaders[3];
+        gl.disableVertexAttribArray(3);
         gl.depthMask(false);
         gl.enable(gl.BLEND);
         gl.blendFunc(gl.SRC_ALPHA, gl.ONE_MINUS_SRC_ALPHA);
@@ -432,10 +455,52 @@ export class Renderer{
         gl.disable(gl.BLEND);
     }
 
+    //Coarsest level of detail whose error stays under LOD_PIXEL_ERROR pixels on screen. A level
+    //that is not downloaded yet starts loading and the finer one is drawn meanwhile
+    selectLod(m, pos, scale, camera){
+        if(!m || !m.lods) return m;
+
+        const distance = vec3.distance(pos, camera.pos);
+        let selected = m;
+        for(let l = 0; l < m.lods.length; ++l){
+            const lod = m.lods[l];
+            if(lod.error * scale * lodScale > LOD_PIXEL_ERROR * distance)
+                break;
+            if(!lod.mesh){
+                this.resources.loadLod(lod);
+                break;
+            }
+            selected = lod.mesh;
+        }
+        return selected;
+    }
+
+    //Points the attributes at the vertex buffer bound now, from the first vertex of a submesh
+    useVertices(attributes, stride, baseVertex = 0){
+        const offset = baseVertex * stride;
+        let a = attributes.length;
+        while(a--){
+            const [location, size, type, normalized, byteOffset] = attributes[a];
+            gl.vertexAttribPointer(location, size, type, normalized, stride, byteOffset + offset);
+        }
+
+        this.vertexAttributes = attributes;
+        this.vertexStride = stride;
+        this.baseVertex = baseVertex;
+    }
+
+    //Submeshes are [index count, index byte offset, base vertex], their indices are local to
+    //the base vertex so that chunks of a mesh too big for 16 bit indices draw in sequence
+    drawSubmesh(s){
+        if(s[2] !== this.baseVertex)
+            this.useVertices(this.vertexAttributes, this.vertexStride, s[2]);
+        gl.drawElements(gl.TRIANGLES, s[0], gl.UNSIGNED_SHORT, s[1]);
+    }
+
     drawMesh(m){
         if(!m) return;
         let s = m.length; //s for submesh
-        while(s--) gl.drawElements(gl.TRIANGLES, m[s][0], gl.UNSIGNED_SHORT, m[s][1]);
+        while(s--) this.drawSubmesh(m[s]);
     }
 
     createDepthFBO(texSize){
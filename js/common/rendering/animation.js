@@ -1,3 +1,5 @@
+import { mat4 } from "gl-matrix";
+
 class AnimationController{
     constructor(animations){
         this.animations = animations;
@@ -5,6 +7,9 @@ class AnimationController{
         this.speed = 1.;
         this.isPlaying = false;
 
+        //Streamed track asked for before it arrived, switched to once it has
+        this.pending = null;
+
         this.tween = new Float32Array(3);
     }
 
@@ -13,18 +18,50 @@ class AnimationController{
      * @param {string} trackName 
      */
     set(trackName, speed){
-        this.anim = this.animations[trackName];
+        const anim = this.animations[trackName];
+        this.pending = null;
+
+        //Streamed clips that have not arrived yet have empty rows, the current track keeps playing
+        //until they do. Without one, the first resident track stands in
+        if(!!anim && !anim.loaded){
+            this.pending = { trackName: trackName, speed: speed };
+            if(!this.anim)
+                this.start(Object.values(this.animations).find(a => a.loaded) || anim, speed);
+            return;
+        }
+
+        this.start(anim, speed);
+    }
+
+    start(anim, speed){
+        this.anim = anim;
         this.frame = 0;
         this.isPlaying = true;
         if(!!speed)
             this.speed = speed
     }
 
+    /**
+     * Switches to the pending track once Animations.clipLoaded marked it loaded
+     */
+    update(){
+        if(!this.pending)
+            return;
+
+        const anim = this.animations[this.pending.trackName];
+        if(!!anim && anim.loaded){
+            this.start(anim, this.pending.speed);
+            this.pending = null;
+        }
+    }
+
     /**
      * returns vec3 with frames to interpolate in [0] and [1] and interpolation amount in [2]
      * @param {number} delta delta time in MS
      */
     loop(delta){
+        this.update();
+
         //should technically never hit the last frame directly
         this.frame = (this.frame + delta * this.speed) % this.anim.maxFrame;
         for(let i = this.anim.keyframes.length - 2; i >= 0; --i){
@@ -45,6 +82,7 @@ class AnimationController{
      * @param {number} delta delta time in MS
      */
     play(delta){
+        this.update();
         if(!this.isPlaying)
             return this.tween;
         
@@ -95,7 +133,8 @@ class AnimationSingleton{
                     animations[anim.name] = {
                         keyframes: anim.keyframes.map(kf => kf - 1),
                         maxFrame: anim.keyframes.reduce((p, c) => Math.max(p, c - 1), 0),
-                        rowOffset: rowOffset
+                        rowOffset: rowOffset,
+                        loaded: !anim.src
                     }
 
                     rowOffset += anim.keyframes.length;
@@ -107,6 +146,12 @@ class AnimationSingleton{
             });
     }
 
+    clipLoaded(armatureName, trackName){
+        const animations = this.animations[armatureName];
+        if(!!animations && !!animations[trackName])
+            animations[trackName].loaded = true;
+    }
+
     getInstance(animationName){
         return new AnimationController(this.animations[animationName]);
     }
@@ -116,4 +161,47 @@ class AnimationSingleton{
     }
 }
 
-export const Animations = new AnimationSingleton();
\ No newline at end of file
+export const Animations = new AnimationSingleton();
+
+/**
+ * Expands the bone transforms of an armature asset to 4x4 column major matrices, the layout
+ * read by the skinning shaders, whatever encoding they were exported with
+ * @param {any} armature armature asset
+ * @returns Float32Array with 16 floats per bone per keyframe
+ */
+export function decodeBoneData(armature){
+    const encoding = armature.encoding || 'MAT4';
+    if(encoding === 'MAT4')
+        return new Float32Array(armature.data);
+
+    const src = armature.data;
+    const srcStride = encoding === 'QUAT' ? 8 : 12;
+    const nBones = Math.floor(src.length / srcStride);
+    const data = new Float32Array(nBones * 16);
+    const m = mat4.create();
+
+    for(let i = 0; i < nBones; ++i){
+        const s = i * srcStride;
+        const d = i * 16;
+
+        if(encoding === 'QUAT'){
+            //Rotation (x, y, z, w), translation and uniform scale
+            const scale = src[s + 7];
+            mat4.fromRotationTranslationScale(m,
+                [src[s], src[s + 1], src[s + 2], src[s + 3]],
+                [src[s + 4], src[s + 5], src[s + 6]],
+                [scale, scale, scale]);
+            data.set(m, d);
+        }else{
+            //MAT3x4 - column major without the bottom row
+            for(let c = 0; c < 4; ++c){
+                data[d + c * 4] = src[s + c * 3];
+                data[d + c * 4 + 1] = src[s + c * 3 + 1];
+                data[d + c * 4 + 2] = src[s + c * 3 + 2];
+                data[d + c * 4 + 3] = c === 3 ? 1 : 0;
+            }
+        }
+    }
+
+    return data;
+}
\ No newline at end of file
@@ -1,11 +1,12 @@
 //INFO ON VERTEX FORMATS:
-export const VERTEX_STRIDE_STATIC = 20
+export const VERTEX_STRIDE_STATIC = 24
 
-//LEVEL VERTEX DATA - 16 BYTES
+//LEVEL VERTEX DATA - 24 BYTES
 //Interleaved: 3 * 4 bytes for POSITION (12)
 //             2 * 2 bytes, normalized for TEX COORDS (4) => 16
 //             3 * 1 byte for NORMAL (19)
 //             1 byte PADDING (20)
+//             4 * 1 byte, normalized for BAKED LIGHT (RGB) and AMBIENT OCCLUSION (A) (24)
 
 export const VERTEX_STRIDE_ACTORS = 28;
 export const VERTEX_WEIGHT_AFFECTORS = 4;
@@ -1,4 +1,4 @@
-import { VERTEX_STRIDE_ACTORS, VERTEX_WEIGHT_AFFECTORS } from "./mesh-constants";
+import { VERTEX_STRIDE_ACTORS, VERTEX_STRIDE_STATIC, VERTEX_WEIGHT_AFFECTORS } from "./mesh-constants";
 import { BufferWrapper } from "../../util/array-buffer-wrapper";
 
 /**
@@ -6,7 +6,8 @@ import { BufferWrapper } from "../../util/array-buffer-wrapper";
  * @param {any} vertexPool pooled buffer that stores vertex data
  * @param {any} indexAdjustment pooled buffer that stores indices data
  * @param  {...any} meshes mesh asset(s)
- * @returns Object of lookups into pools for parsed mesh(es) keyed by name
+ * @returns Object of lookups into pools for parsed mesh(es) keyed by name,
+ * [index count, index byte offset, base vertex] per submesh
  */
 export function parseActorMeshes(vertexPool, indexPool, ...meshes){
     //The first step is to go through the data to see how much VRAM to allocate
@@ -31,9 +32,9 @@ export function parseActorMeshes(vertexPool, indexPool, ...meshes){
     const vertexBuffer = new BufferWrapper(vertexBufferSize);
     const indexArray = new Uint16Array(indexArrayLength);
 
-    //Adjust indices to fit with what's in the VBO so far
-    //Adjust indicies by number of vertices in pool
-    let indexAdjustment = vertexPool.cursor / VERTEX_STRIDE_ACTORS;
+    //Indices stay local to their submesh so they fit in 16 bits, each submesh is drawn
+    //from its own base vertex in the pool instead
+    let baseVertex = vertexPool.cursor / VERTEX_STRIDE_ACTORS;
     let pooledIndexOffset = indexPool.cursor;
     let indexOffset = 0;
 
@@ -58,7 +59,15 @@ export function parseActorMeshes(vertexPool, indexPool, ...meshes){
                 vertexBuffer.addFloat32(submesh.verts[k * 3], submesh.verts[k * 3 + 1], submesh.verts[k * 3 + 2]);
 
                 //Weights for skinning
-                if(!!submesh.weights[k]){
+                if(!!submesh.boneWeights){
+                    //Fixed width influences, already quantized to bytes
+                    const n = submesh.influences;
+                    for(let g = 0; g < VERTEX_WEIGHT_AFFECTORS; ++g)
+                        vertexBuffer.addUint8(g < n ? submesh.boneGroups[k * n + g] : 0);
+
+                    for(let g = 0; g < VERTEX_WEIGHT_AFFECTORS; ++g)
+                        vertexBuffer.addUint8(g < n ? submesh.boneWeights[k * n + g] : 0);
+                }else if(!!submesh.weights[k]){
                     //Weights are organized: [ group, weight, group, weight, ... ]
                     const weights = submesh.weights[k];
                     let g = 0;
@@ -96,14 +105,13 @@ export function parseActorMeshes(vertexPool, indexPool, ...meshes){
             }
             //END PER VERTEX DATA
 
-            //indices have to be translated to be as part of the entire VBO
             let k = submesh.indices.length;
-            meshInfo[j] = [k, pooledIndexOffset + indexOffset * 2];
+            meshInfo[j] = [k, pooledIndexOffset + indexOffset * 2, baseVertex];
 
             while(k--) {
-                indexArray[indexOffset++] = submesh.indices[k] + indexAdjustment;
+                indexArray[indexOffset++] = submesh.indices[k];
             }
-            indexAdjustment += nVertices;
+            baseVertex += nVertices;
         }
 
         meshInfoMap[asset.name] = meshInfo;
@@ -122,11 +130,12 @@ export function parseActorMeshes(vertexPool, indexPool, ...meshes){
  * @param {any} vertexBufferObject vertex buffer for static geometry
  * @param {any} indexBufferObject index buffer for static geometry
  * @param  {...any} meshes mesh asset(s)
- * @returns Object of lookups into pools for parsed mesh(es) keyed by name
+ * @returns Object of lookups into pools for parsed mesh(es) keyed by name,
+ * [index count, index byte offset, base vertex] per submesh
  */
 export function parseStaticMeshes(gl, vertexBufferObject, indexBufferObject, ...meshes){
     //The first step is to go through the data to see how much VRAM to allocate
-    const stride = VERTEX_STRIDE_ACTORS;
+    const stride = VERTEX_STRIDE_STATIC;
 
     let vertexBufferSize = 0;
     let indexArrayLength = 0;
@@ -147,8 +156,8 @@ export function parseStaticMeshes(gl, vertexBufferObject, indexBufferObject, ...
     const vertexBuffer = new BufferWrapper(vertexBufferSize);
     const indexArray = new Uint16Array(indexArrayLength);
 
-    //Adjust indices to fit with what's in the VBO so far
-    let indexAdjustment = 0
+    //Indices stay local to their submesh, each is drawn from its own base vertex
+    let baseVertex = 0;
     let indexOffset = 0;
 
     //Now populate the buffers
@@ -186,17 +195,23 @@ export function parseStaticMeshes(gl, vertexBufferObject, indexBufferObject, ...
                     //Pad with zeroes
                     vertexBuffer.addInt8(0,0,0,0);
                 }
+
+                //Baked light and ambient occlusion, unlit and unoccluded if nothing was baked
+                if(!!submesh.bake && !!submesh.bake.length){
+                    vertexBuffer.addUint8(submesh.bake[k * 4], submesh.bake[k * 4 + 1], submesh.bake[k * 4 + 2], submesh.bake[k * 4 + 3]);
+                }else{
+                    vertexBuffer.addUint8(0, 0, 0, 255);
+                }
             }
             //END PER VERTEX DATA
 
-            //indices have to be translated to be as part of the entire VBO
             let k = submesh.indices.length;
-            meshInfo[j] = [k, indexOffset * 2];
+            meshInfo[j] = [k, indexOffset * 2, baseVertex];
 
             while(k--) {
-                indexArray[indexOffset++] = submesh.indices[k] + indexAdjustment;
+                indexArray[indexOffset++] = submesh.indices[k];
             }
-            indexAdjustment += nVertices;
+            baseVertex += nVertices;
         }
 
         meshInfoMap[asset.name] = meshInfo;
@@ -209,4 +224,52 @@ export function parseStaticMeshes(gl, vertexBufferObject, indexBufferObject, ...
     gl.bufferData(gl.ELEMENT_ARRAY_BUFFER, indexArray, gl.STATIC_DRAW);
 
     return meshInfoMap;
-}
\ No newline at end of file
+}
+
+/**
+ * Uploads a binary mesh asset whose vertex data is already interleaved as VERTEX_STRIDE_ACTORS
+ * @param {any} vertexPool pooled buffer that stores vertex data
+ * @param {any} indexPool pooled buffer that stores indices data
+ * @param {any} mesh binary mesh header with its data in mesh.blob
+ * @returns Object of lookups into pools for parsed mesh(es) keyed by name
+ */
+export function parseBinaryActorMeshes(vertexPool, indexPool, mesh){
+    console.log(`Parsing ${mesh.name} (${mesh.submeshes.length} submesh(es) -- BINARY ${mesh.layout})...`);
+
+    const vertexData = new Uint8Array(mesh.blob, 0, mesh.vertexBytes);
+    const indexArray = new Uint16Array(mesh.blob, mesh.vertexBytes, mesh.indexCount);
+
+    //Indices are local to their submesh, which is drawn from its first vertex in the pool
+    const pooledBaseVertex = vertexPool.cursor / VERTEX_STRIDE_ACTORS;
+    const pooledIndexOffset = indexPool.cursor;
+
+    const meshInfo = mesh.submeshes.map(s => [s.indexCount, pooledIndexOffset + s.indexOffset, pooledBaseVertex + s.vertexOffset / mesh.stride]);
+
+    vertexPool.append(vertexData);
+    indexPool.append(indexArray);
+
+    return { [mesh.name]: meshInfo };
+}
+
+/**
+ * Uploads a binary mesh asset whose vertex data is already interleaved as VERTEX_STRIDE_STATIC
+ * @param {any} vertexBufferObject vertex buffer for static geometry
+ * @param {any} indexBufferObject index buffer for static geometry
+ * @param {any} mesh binary mesh header with its data in mesh.blob
+ * @returns Object of lookups into pools for parsed mesh(es) keyed by name
+ */
+export function parseBinaryStaticMeshes(gl, vertexBufferObject, indexBufferObject, mesh){
+    console.log(`Parsing ${mesh.name} (${mesh.submeshes.length} submesh(es) -- BINARY ${mesh.layout})...`);
+
+    //Static files from before the baked lighting attribute have a shorter stride
+    if(mesh.stride !== VERTEX_STRIDE_STATIC)
+        throw new Error(`${mesh.name} has ${mesh.stride} byte vertices, expected ${VERTEX_STRIDE_STATIC}. Re-export it`);
+
+    gl.bindBuffer(gl.ARRAY_BUFFER, vertexBufferObject);
+    gl.bufferData(gl.ARRAY_BUFFER, new Uint8Array(mesh.blob, 0, mesh.vertexBytes), gl.STATIC_DRAW);
+
+    gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, indexBufferObject);
+    gl.bufferData(gl.ELEMENT_ARRAY_BUFFER, new Uint16Array(mesh.blob, mesh.vertexBytes, mesh.indexCount), gl.STATIC_DRAW);
+
+    return { [mesh.name]: mesh.submeshes.map(s => [s.indexCount, s.indexOffset, s.vertexOffset / mesh.stride]) };
+}
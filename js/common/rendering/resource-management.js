@@ -6,8 +6,8 @@ import { PooledBuffer } from "./pooled-buffer";
 import { MessageBus } from "../messaging/message-bus";
 import { MessageType } from "../messaging/message-type";
 import { KeyedMutex } from "../util/concurrency";
-import { parseActorMeshes, parseStaticMeshes } from "./mesh/mesh-parsing";
-import { Animations } from "./animation";
+import { parseActorMeshes, parseStaticMeshes, parseBinaryActorMeshes, parseBinaryStaticMeshes } from "./mesh/mesh-parsing";
+import { Animations, decodeBoneData } from "./animation";
 
 const assetMutex = new KeyedMutex
 
@@ -102,10 +102,22 @@ export class WebGLResourceManager{
         while(i--){
             const mesh = meshes[i];
 
+            //Binary meshes come pre-packed in the layout they are drawn with
+            if(mesh.format === 'BINARY'){
+                const meshResult = mesh.layout === 'ACTOR'
+                    ? parseBinaryActorMeshes(this.actorsVBuffer, this.actorsIBuffer, mesh)
+                    : parseBinaryStaticMeshes(this.gl, this.staticVBuffer, this.staticIBuffer, mesh);
+
+                this.meshes = {...this.meshes, ...meshResult};
+                this.linkLods(mesh, mesh.layout === 'ACTOR');
+                continue;
+            }
+
             const submeshes = mesh.submeshes || [mesh];
 
             const hasUVs = !!submeshes.find(s => !!s.uvs && !!s.uvs.length);
-            const hasWeights = !!submeshes.find(s => !!s.weights && !!s.weights.length && !!s.weights.find(w => !!w && !!w.length));
+            const hasWeights = !!submeshes.find(s => (!!s.boneWeights && !!s.boneWeights.length)
+                || (!!s.weights && !!s.weights.length && !!s.weights.find(w => !!w && !!w.length)));
 
             let meshResult = {};
             if(hasUVs && hasWeights){
@@ -115,6 +127,48 @@ export class WebGLResourceManager{
             }
 
             this.meshes = {...this.meshes, ...meshResult};
+            this.linkLods(mesh, hasUVs && hasWeights);
+        }
+    }
+
+    //Attaches the levels of detail, with their error in world units, to a parsed mesh. Each one is
+    //only downloaded when the renderer first picks it. Statics share a single vertex buffer that
+    //another upload would replace, so they are always drawn at full detail
+    linkLods(mesh, isActor){
+        if(!mesh.lods || !this.meshes[mesh.name])
+            return;
+
+        if(!isActor){
+            console.warn(`Ignoring the levels of detail of static mesh ${mesh.name}`);
+            return;
+        }
+
+        this.meshes[mesh.name].lods = mesh.lods.map(lod => ({
+            error: lod.error,
+            url: lod.url,
+            mesh: null,
+            loading: false
+        }));
+    }
+
+    //Downloads and parses a level of detail linked by linkLods, once
+    async loadLod(lod){
+        if(lod.loading || !!lod.mesh)
+            return;
+
+        //stays set on failure so a missing file is not requested every frame
+        lod.loading = true;
+        try{
+            const asset = await RestClient.getJSON(lod.url);
+            const meshResult = asset.format === 'BINARY'
+                ? parseBinaryActorMeshes(this.actorsVBuffer, this.actorsIBuffer, asset)
+                : parseActorMeshes(this.actorsVBuffer, this.actorsIBuffer, asset);
+
+            this.meshes = {...this.meshes, ...meshResult};
+            lod.mesh = this.meshes[asset.name];
+        }
+        catch(e){
+            console.warn(`Could not load ${lod.url}: ${e.message}`);
         }
     }
 
@@ -125,6 +179,11 @@ export class WebGLResourceManager{
             if(!!this.assets[def.name])
                 return;
 
+            //Everything below is served from the bundle once it is in
+            if(!!def.bundle){
+                await RestClient.loadBundle(def.bundle).catch(e => console.warn(e.message));
+            }
+
             const mesh = await this.downloadAsset(def.mesh);
             const mat = await this.downloadAsset(def.mat);
 
@@ -185,8 +244,14 @@ export class WebGLResourceManager{
                             .map(a => a.keyframes.length)
                             .reduce((p, c) => p + c, 0);
 
-            const data = new Float32Array(armature.data);
-            console.log(`Length of animation data expected: ${width * height * 4} (floats). Data in file: ${armature.data.length} (floats). Matches: ${width * height * 4 === armature.data.length}`);
+            //Streamed clips have their rows reserved but are only filled in once they arrive
+            const residentHeight = armature.animations
+                            .filter(a => !a.src)
+                            .map(a => a.keyframes.length)
+                            .reduce((p, c) => p + c, 0);
+
+            const data = decodeBoneData(armature);
+            console.log(`Length of animation data expected: ${width * residentHeight * 4} (floats). Data decoded: ${data.length} (floats, ${armature.encoding || 'MAT4'}). Matches: ${width * residentHeight * 4 === data.length}`);
             console.log(`Creating RGBA Texture: ${width} x ${height}`);
 
             //Test matrix lookup
@@ -207,7 +272,19 @@ export class WebGLResourceManager{
 
             //Using 32Bit float format for now    
             gl.texImage2D(gl.TEXTURE_2D, 0, gl.RGBA32F, width, height, 0,
-                gl.RGBA, gl.FLOAT, data);
+                gl.RGBA, gl.FLOAT, null);
+
+            //Resident clips are stored back to back in the armature's data
+            let row = 0, residentRow = 0;
+            armature.animations.forEach(anim => {
+                const rows = anim.keyframes.length;
+                if(!anim.src){
+                    gl.texSubImage2D(gl.TEXTURE_2D, 0, 0, row, width, rows, gl.RGBA, gl.FLOAT,
+                        data.subarray(residentRow * width * 4, (residentRow + rows) * width * 4));
+                    residentRow += rows;
+                }
+                row += rows;
+            });
 
             //No mipmaps or filtering for data texture, only read in vertex shader with texel lookup
             gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_MIN_FILTER, gl.NEAREST);
@@ -220,5 +297,30 @@ export class WebGLResourceManager{
         }
              
         Animations.parseArmatures(...armatureAssets);
+
+        //Stream the remaining clips in the background, the resident ones can play meanwhile
+        armatureAssets.forEach(armature => {
+            let row = 0;
+            armature.animations.forEach(anim => {
+                if(!!anim.src)
+                    this.streamClip(armature, anim, row).catch(e => console.warn(`Could not load ${anim.name}: ${e.message}`));
+                row += anim.keyframes.length;
+            });
+        });
+    }
+
+    //Fills the rows reserved for a streamed clip in its armature's data texture
+    async streamClip(armature, anim, row){
+        const clip = await RestClient.getJSON(anim.url);
+        const data = decodeBoneData(clip);
+        const width = armature.bones.length * 4;
+
+        const gl = this.gl;
+        gl.bindTexture(gl.TEXTURE_2D, this.armatures[armature.name.toUpperCase()]);
+        gl.pixelStorei(gl.UNPACK_FLIP_Y_WEBGL, false);
+        gl.texSubImage2D(gl.TEXTURE_2D, 0, 0, row, width, clip.keyframes.length, gl.RGBA, gl.FLOAT, data);
+
+        Animations.clipLoaded(armature.name, anim.name);
+        console.log(`Streamed ${anim.name} for ${armature.name}: ${clip.keyframes.length} keyframe(s)`);
     }
 }
\ No newline at end of file
@@ -8,13 +8,16 @@ export class WallSolver{
         this.corners = [];
 
         meshData.submeshes.forEach((m, i) => {
-            if(m.name.indexOf('floor') >= 0){
+            //Tilesets exported in tileset mode come classified, older ones are classified by name
+            const category = !!m.tile ? m.tile.category : m.name;
+
+            if(category.indexOf('floor') >= 0){
                 this.floors.push(i);
-            }else if(m.name.indexOf('walltorch') >= 0){
+            }else if(category.indexOf('walltorch') >= 0){
                 this.walltorches.push(i);
-            }else if(m.name.indexOf('wall') >= 0){
+            }else if(category.indexOf('wall') >= 0){
                 this.walls.push(i);
-            }else if(m.name.indexOf('corner') >= 0){
+            }else if(category.indexOf('corner') >= 0){
                 this.corners.push(i);
             }
         });
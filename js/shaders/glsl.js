@@ -23,6 +23,7 @@ export const VertexShaders = {
     in vec4 ${Attributes.Pos};
     in vec2 ${Attributes.Tex};
     in vec3 ${Attributes.Norm};
+    in vec4 ${Attributes.Bake};
 
     uniform vec3 ${Uniforms.offset};
     uniform mat4 ${Uniforms.matMVP};
@@ -30,6 +31,7 @@ export const VertexShaders = {
     out vec3 vPosWorld;
     out vec2 vTexCoords;
     out vec3 vNormal;
+    out vec4 vBake;
     
     void main(){
 
@@ -40,6 +42,7 @@ export const VertexShaders = {
         vTexCoords = ${Attributes.Tex};
         vPosWorld = pos.xyz;
         vNormal = normalize(${Attributes.Norm});
+        vBake = ${Attributes.Bake};
     }
     `,
 
@@ -60,6 +63,7 @@ export const VertexShaders = {
     out vec2 vTexCoords;
     out vec3 vPosWorld;
     out vec3 vNormal;
+    out vec4 vBake;
 
     //Texture arrangement:
     //ROW = FRAME, ie. there are as many rows as there are frames of animation
@@ -69,7 +73,8 @@ export const VertexShaders = {
 
     void main(){
         //Apply mesh deform in local space
-        vec4 weights = normalize(${Attributes.Weights});
+        //Weights sum to one, dividing by the sum only keeps files that were not renormalized in proportion
+        vec4 weights = ${Attributes.Weights} / max(dot(${Attributes.Weights}, vec4(1.0)), 0.001);
 
         vec4 deform0;
         vec4 deform1;
@@ -115,6 +120,9 @@ export const VertexShaders = {
         vTexCoords = ${Attributes.Tex};
         vPosWorld = pos.xyz / pos.w;
         vNormal = normalize(mat3(${Uniforms.matWorld}) * ${Attributes.Norm});
+
+        //Actors have nothing baked
+        vBake = vec4(0., 0., 0., 1.);
     }
     `,
 
@@ -137,7 +145,8 @@ export const VertexShaders = {
 
     void main(){
         //Apply mesh deform in local space
-        vec4 weights = normalize(${Attributes.Weights});
+        //Weights sum to one, dividing by the sum only keeps files that were not renormalized in proportion
+        vec4 weights = ${Attributes.Weights} / max(dot(${Attributes.Weights}, vec4(1.0)), 0.001);
 
         vec4 deform0;
         vec4 deform1;
@@ -328,6 +337,7 @@ export const FragmentShaders = {
     in vec2 vTexCoords;
     in vec3 vPosWorld;
     in vec3 vNormal;
+    in vec4 vBake; //baked light (RGB) and ambient occlusion (A)
 
     out vec4 color;
     
@@ -359,7 +369,7 @@ export const FragmentShaders = {
             lighting += (clamp(dot(normalize(vNormal), -normalize(vLD)), 0., 1.) * (1. - sd / ${Uniforms.lightColors}[i].w) * ${Uniforms.lightColors}[i].xyz);
         }
 
-        lighting += ambience;
+        lighting += ambience * vBake.a + vBake.rgb;
 
         color = texture(${Uniforms.diffuse}, vTexCoords);
         color.rgb *= lighting;
@@ -387,6 +397,7 @@ export const FragmentShaders = {
     in vec2 vTexCoords;
     in vec3 vPosWorld;
     in vec3 vNormal;
+    in vec4 vBake; //baked light (RGB) and ambient occlusion (A)
 
     out vec4 color;
     
@@ -425,7 +436,7 @@ export const FragmentShaders = {
             lighting += shadow * clamp(dot(normalize(vNormal), -normalize(vLD)), 0., 1.) * (1. - sd / ${Uniforms.lightColors}[i].w) * ${Uniforms.lightColors}[i].xyz;
         }
 
-        lighting += ambience;
+        lighting += ambience * vBake.a + vBake.rgb;
 
         color = texture(${Uniforms.diffuse}, vTexCoords);
         color.rgb *= lighting;
@@ -2,6 +2,7 @@ export const Attributes = {
     Pos: 'aVertexPosition',
     Tex: 'aTexCoords',
     Norm: 'aNormal',
+    Bake: 'aBake', //Baked light and ambient occlusion of static geometry
     Tangent: 'aTangent',
     Groups: 'aGroups',
     Weights: 'aWeights',